@@ -0,0 +1,189 @@
+"""
+Submission analytics for a ricorso: daily and cumulative curves per region,
+recent submission rate and a projection of the total at each deadline.
+
+Only `submitted_at` and the region field are read, through a projected
+cursor, into columnar numpy arrays; histograms are built with a single
+np.bincount and rolling rates with pandas. Results are cached until a new
+submission arrives or the ricorso changes.
+"""
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from deadlines import parse_deadline, parse_regional_deadlines
+from schemas import get_schemas, regione_field_id
+
+ANALYTICS_BATCH_SIZE = 10000
+ANALYTICS_CACHE_SIZE = 64
+RATE_WINDOW_DAYS = 7
+NON_SPECIFICATA = "Non specificata"
+
+_cache: "OrderedDict[tuple, dict]" = OrderedDict()
+
+
+def to_columns(docs, field_by_version: Dict[str, Optional[str]], current_field_id: Optional[str]):
+    """Turn submission dicts into (submitted_at, regione) numpy arrays."""
+    timestamps = []
+    regions = []
+    for doc in docs:
+        version = doc.get("schema_version")
+        field_id = field_by_version[version] if version in field_by_version else current_field_id
+        timestamps.append(doc["submitted_at"])
+        regions.append((doc.get("dati_utente") or {}).get(field_id) or NON_SPECIFICATA)
+    # DatetimeIndex converte le liste di datetime molto più in fretta di np.array
+    return pd.DatetimeIndex(timestamps).values.astype("datetime64[ms]"), np.array(regions, dtype=object)
+
+
+def compute_analytics(
+    submitted_at: np.ndarray,
+    regions: np.ndarray,
+    deadlines: Dict[str, datetime],
+    default_deadline: Optional[datetime],
+    now: datetime,
+) -> dict:
+    """Vectorized daily/cumulative curves, rates and deadline projections."""
+    last_day = np.datetime64(now, "D")
+    if len(submitted_at):
+        first_day = submitted_at.min().astype("datetime64[D]")
+        last_day = max(last_day, submitted_at.max().astype("datetime64[D]"))
+        # factorize (hash) invece di np.unique (ordinamento di 1M stringhe)
+        codes, labels = pd.factorize(regions, sort=True)
+    else:
+        first_day = last_day
+        labels, codes = np.array([], dtype=object), np.array([], dtype=np.int64)
+    n_days = int((last_day - first_day).astype(np.int64)) + 1
+    n_regions = len(labels)
+
+    # Un solo bincount sull'indice combinato (regione, giorno)
+    day_index = (submitted_at.astype("datetime64[D]") - first_day).astype(np.int64)
+    daily = np.bincount(
+        codes * n_days + day_index, minlength=n_regions * n_days
+    ).reshape(n_regions, n_days)
+    cumulative = daily.cumsum(axis=1)
+    rates = (
+        pd.DataFrame(daily.T).rolling(RATE_WINDOW_DAYS, min_periods=1).mean().to_numpy().T
+        if n_regions else np.zeros((0, n_days))
+    )
+    days = pd.date_range(pd.Timestamp(first_day), periods=n_days, freq="D").strftime("%Y-%m-%d").tolist()
+
+    def projection(count: int, rate: float, deadline: Optional[datetime]):
+        if deadline is None:
+            return {"scadenza": None, "giorni_rimanenti": None, "proiezione": None}
+        days_left = max((deadline - now).total_seconds() / 86400, 0)
+        return {
+            "scadenza": deadline.isoformat(),
+            "giorni_rimanenti": round(days_left, 1),
+            "proiezione": int(round(count + rate * days_left)),
+        }
+
+    per_regione = {}
+    for i, label in enumerate(list(labels)):
+        count = int(cumulative[i, -1])
+        rate = float(rates[i, -1])
+        per_regione[label] = {
+            "totale": count,
+            "daily": daily[i].tolist(),
+            "cumulative": cumulative[i].tolist(),
+            "rate_7d": round(rate, 2),
+            **projection(count, rate, deadlines.get(label, default_deadline)),
+        }
+    # Regioni con scadenza ma ancora nessuna submission
+    for label, deadline in deadlines.items():
+        if label not in per_regione:
+            per_regione[label] = {
+                "totale": 0,
+                "daily": [0] * n_days,
+                "cumulative": [0] * n_days,
+                "rate_7d": 0.0,
+                **projection(0, 0.0, deadline),
+            }
+
+    total_daily = daily.sum(axis=0)
+    total_rate = float(rates.sum(axis=0)[-1]) if n_regions else 0.0
+    return {
+        "days": days,
+        "totale": {
+            "totale": int(total_daily.sum()),
+            "daily": total_daily.tolist(),
+            "cumulative": total_daily.cumsum().tolist(),
+            "rate_7d": round(total_rate, 2),
+        },
+        "per_regione": per_regione,
+    }
+
+
+async def _load_columns(db, ricorso: dict, archived_docs=None):
+    ricorso_id = ricorso["id"]
+    if archived_docs is not None:
+        versions = {doc.get("schema_version") for doc in archived_docs}
+    else:
+        versions = await db.submissions.distinct("schema_version", {"ricorso_id": ricorso_id})
+    schemas = await get_schemas(db, versions)
+    field_by_version = {version: regione_field_id(schema) for version, schema in schemas.items()}
+    current_field_id = regione_field_id(ricorso)
+
+    if archived_docs is not None:
+        return to_columns(archived_docs, field_by_version, current_field_id)
+
+    projection = {"_id": 0, "submitted_at": 1, "schema_version": 1}
+    for field_id in {current_field_id, *field_by_version.values()} - {None}:
+        projection[f"dati_utente.{field_id}"] = 1
+
+    timestamps: List[np.ndarray] = []
+    regions: List[np.ndarray] = []
+    cursor = db.submissions.find({"ricorso_id": ricorso_id}, projection).batch_size(ANALYTICS_BATCH_SIZE)
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= ANALYTICS_BATCH_SIZE:
+            ts, rg = to_columns(batch, field_by_version, current_field_id)
+            timestamps.append(ts)
+            regions.append(rg)
+            batch = []
+    ts, rg = to_columns(batch, field_by_version, current_field_id)
+    timestamps.append(ts)
+    regions.append(rg)
+    return np.concatenate(timestamps), np.concatenate(regions)
+
+
+async def submission_analytics(
+    db, ricorso: dict, load_archived: Optional[Callable[[], Awaitable[list]]] = None
+) -> dict:
+    """Analytics for a ricorso, cached on (latest submitted_at, ricorso version).
+
+    For archived ricorsi `load_archived` replaces the Mongo read.
+    """
+    ricorso_id = ricorso["id"]
+    if load_archived is None:
+        latest = await db.submissions.find_one(
+            {"ricorso_id": ricorso_id}, {"_id": 0, "submitted_at": 1}, sort=[("submitted_at", -1)]
+        )
+        latest_at = latest["submitted_at"] if latest else None
+    else:
+        latest_at = ricorso.get("archived_at")
+    now = datetime.utcnow()
+    # La data corrente fa parte della chiave: curve e proiezioni arrivano a oggi
+    key = (ricorso_id, latest_at, ricorso.get("version"), now.date())
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+
+    archived_docs = await load_archived() if load_archived is not None else None
+    submitted_at, regions = await _load_columns(db, ricorso, archived_docs)
+    scadenza_generale = parse_deadline(ricorso.get("scadenza_generale"))
+    result = {
+        "ricorso_id": ricorso_id,
+        "ricorso_titolo": ricorso.get("titolo"),
+        "generated_at": now,
+        "latest_submitted_at": latest_at,
+        **compute_analytics(submitted_at, regions, parse_regional_deadlines(ricorso), scadenza_generale, now),
+    }
+
+    _cache[key] = result
+    while len(_cache) > ANALYTICS_CACHE_SIZE:
+        _cache.popitem(last=False)
+    return result
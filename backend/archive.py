@@ -0,0 +1,347 @@
+"""
+Cold archival of closed ricorsi.
+
+The submissions of a ricorso that is no longer active and whose deadlines
+have passed are streamed into gzip-compressed NDJSON segments under
+ARCHIVE_DIR/<ricorso_id>/, described by a small index.json sidecar with
+per-segment counts and sha256 checksums, and then removed from the hot
+`submissions` collection. An ids.json sidecar maps each submission id to
+its segment, so find_archived_submission() reads a single segment. Their upload directories are moved alongside, to
+ARCHIVE_DIR/<ricorso_id>/uploads/. Readers use load_archived_submissions()
+to get them back transparently.
+
+Usage: python archive.py [--ricorso ID] [--dry-run]
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import orjson
+
+from deadlines import parse_deadline
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SEGMENT_SIZE = 10000
+ARCHIVE_DELETE_BATCH_SIZE = 1000
+# Ricorsi senza scadenze: archivia solo se disattivati da almeno tanti giorni
+ARCHIVE_GRACE_DAYS = 30
+INDEX_FILE = "index.json"
+ID_MAP_FILE = "ids.json"
+# Submission archiviate trovate di recente (ogni Range request del visualizzatore ne cerca una)
+FOUND_CACHE_SIZE = 256
+
+_id_maps: Dict[str, tuple] = {}
+_found: "OrderedDict[tuple, dict]" = OrderedDict()
+_found_lock = threading.Lock()
+
+
+class ArchiveCorruptedError(Exception):
+    pass
+
+
+def is_archivable(ricorso: dict, now: Optional[datetime] = None) -> bool:
+    """A ricorso can be archived once inactive and past all of its deadlines."""
+    now = now or datetime.utcnow()
+    if ricorso.get("attivo") or ricorso.get("archive_status") == "archived":
+        return False
+
+    deadlines = list((ricorso.get("scadenze_regioni") or {}).values())
+    if ricorso.get("scadenza_generale"):
+        deadlines.append(ricorso["scadenza_generale"])
+    if not deadlines:
+        updated_at = ricorso.get("updated_at") or ricorso.get("created_at")
+        return updated_at is not None and updated_at < now - timedelta(days=ARCHIVE_GRACE_DAYS)
+
+    parsed = [parse_deadline(d) for d in deadlines]
+    # Una scadenza illeggibile non si può dare per superata
+    return all(d is not None and d < now for d in parsed)
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_segment(path: Path, docs: List[dict]) -> dict:
+    with gzip.open(path, "wb", compresslevel=6) as f:
+        for doc in docs:
+            f.write(orjson.dumps(doc))
+            f.write(b"\n")
+    return {
+        "file": path.name,
+        "count": len(docs),
+        "bytes": path.stat().st_size,
+        "sha256": _sha256(path),
+        "first_submitted_at": docs[0].get("submitted_at").isoformat() if docs[0].get("submitted_at") else None,
+        "last_submitted_at": docs[-1].get("submitted_at").isoformat() if docs[-1].get("submitted_at") else None,
+    }
+
+
+def _write_index(directory: Path, index: dict):
+    tmp_path = directory / f"{INDEX_FILE}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, directory / INDEX_FILE)
+
+
+def _write_id_map(directory: Path, id_map: Dict[str, str]):
+    tmp_path = directory / f"{ID_MAP_FILE}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(orjson.dumps(id_map))
+    os.replace(tmp_path, directory / ID_MAP_FILE)
+
+
+def _publish(tmp_dir: Path, final_dir: Path):
+    if final_dir.exists():
+        shutil.rmtree(final_dir)
+    os.replace(tmp_dir, final_dir)
+
+
+def _move_upload_dirs(uploads_dir: Path, target_dir: Path, submission_ids: List[str]):
+    target_dir.mkdir(parents=True, exist_ok=True)
+    for submission_id in submission_ids:
+        source = uploads_dir / submission_id
+        if source.is_dir():
+            os.replace(source, target_dir / submission_id)
+
+
+def archived_upload_dir(archive_dir: Path, ricorso_id: str) -> Path:
+    return archive_dir / ricorso_id / "uploads"
+
+
+def read_archive_index(archive_dir: Path, ricorso_id: str) -> Optional[dict]:
+    try:
+        with open(archive_dir / ricorso_id / INDEX_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _decode(line: bytes) -> dict:
+    doc = orjson.loads(line)
+    if doc.get("submitted_at"):
+        doc["submitted_at"] = datetime.fromisoformat(doc["submitted_at"])
+    return doc
+
+
+def iter_archived_submissions(archive_dir: Path, ricorso_id: str, newest_first: bool = False) -> Iterator[dict]:
+    """Yield archived submissions in submitted_at order, verifying each segment."""
+    index = read_archive_index(archive_dir, ricorso_id)
+    if not index:
+        return
+    segments = index["segments"]
+    if newest_first:
+        segments = reversed(segments)
+    for segment in segments:
+        lines = _read_segment(archive_dir, ricorso_id, segment)
+        if newest_first:
+            lines.reverse()
+        for line in lines:
+            yield _decode(line)
+
+
+def _read_segment(archive_dir: Path, ricorso_id: str, segment: dict) -> List[bytes]:
+    path = archive_dir / ricorso_id / segment["file"]
+    if _sha256(path) != segment["sha256"]:
+        raise ArchiveCorruptedError(f"Checksum mismatch for {path}")
+    with gzip.open(path, "rb") as f:
+        return f.read().splitlines()
+
+
+def _id_map(archive_dir: Path, ricorso_id: str, index: dict) -> Dict[str, str]:
+    """Submission id -> segment file of an archive, built once for archives made before ids.json."""
+    cached = _id_maps.get(ricorso_id)
+    if cached and cached[0] == index["archived_at"]:
+        return cached[1]
+    path = archive_dir / ricorso_id / ID_MAP_FILE
+    try:
+        id_map = orjson.loads(path.read_bytes())
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        id_map = {}
+        for segment in index["segments"]:
+            for line in _read_segment(archive_dir, ricorso_id, segment):
+                id_map[orjson.loads(line)["id"]] = segment["file"]
+        _write_id_map(archive_dir / ricorso_id, id_map)
+    _id_maps[ricorso_id] = (index["archived_at"], id_map)
+    return id_map
+
+
+def find_archived_submission(archive_dir: Path, ricorso_id: str, submission_id: str) -> Optional[dict]:
+    """One archived submission, reading only the segment that holds it."""
+    index = read_archive_index(archive_dir, ricorso_id)
+    if not index:
+        return None
+    key = (ricorso_id, index["archived_at"], submission_id)
+    with _found_lock:
+        if key in _found:
+            _found.move_to_end(key)
+            return _found[key]
+    segment_file = _id_map(archive_dir, ricorso_id, index).get(submission_id)
+    segment = next((s for s in index["segments"] if s["file"] == segment_file), None)
+    if segment is None:
+        return None
+    for line in _read_segment(archive_dir, ricorso_id, segment):
+        doc = orjson.loads(line)
+        if doc.get("id") == submission_id:
+            doc = _decode(line)
+            with _found_lock:
+                _found[key] = doc
+                if len(_found) > FOUND_CACHE_SIZE:
+                    _found.popitem(last=False)
+            return doc
+    return None
+
+
+async def load_archived_submissions(
+    archive_dir: Path, ricorso_id: str, limit: Optional[int] = None, newest_first: bool = True
+) -> List[dict]:
+    def load():
+        docs = []
+        for doc in iter_archived_submissions(archive_dir, ricorso_id, newest_first=newest_first):
+            if limit is not None and len(docs) >= limit:
+                break
+            docs.append(doc)
+        return docs
+
+    return await asyncio.to_thread(load)
+
+
+async def archive_ricorso(db, ricorso_id: str, archive_dir: Path, uploads_dir: Path) -> dict:
+    """Move the submissions of a ricorso into the archive. Safe to re-run."""
+    ricorso = await db.ricorsi.find_one({"id": ricorso_id}, {"_id": 0})
+    final_dir = archive_dir / ricorso_id
+
+    if ricorso.get("archive_status") != "archived":
+        # Da qui in poi create_submission rifiuta nuove submission
+        await db.ricorsi.update_one(
+            {"id": ricorso_id}, {"$set": {"archive_status": "archiving"}}
+        )
+        tmp_dir = archive_dir / f".{ricorso_id}.tmp"
+        await asyncio.to_thread(shutil.rmtree, tmp_dir, True)
+        tmp_dir.mkdir(parents=True)
+
+        segments = []
+        buffer = []
+        id_map = {}
+        cursor = db.submissions.find(
+            {"ricorso_id": ricorso_id}, {"_id": 0}
+        ).sort("submitted_at", 1).batch_size(1000)
+        async for doc in cursor:
+            buffer.append(doc)
+            if len(buffer) >= ARCHIVE_SEGMENT_SIZE:
+                path = tmp_dir / f"segment-{len(segments) + 1:05d}.ndjson.gz"
+                segments.append(await asyncio.to_thread(_write_segment, path, buffer))
+                id_map.update((doc["id"], path.name) for doc in buffer)
+                buffer = []
+        if buffer:
+            path = tmp_dir / f"segment-{len(segments) + 1:05d}.ndjson.gz"
+            segments.append(await asyncio.to_thread(_write_segment, path, buffer))
+            id_map.update((doc["id"], path.name) for doc in buffer)
+
+        index = {
+            "ricorso_id": ricorso_id,
+            "ricorso_titolo": ricorso.get("titolo"),
+            "archived_at": datetime.utcnow().isoformat(),
+            "total": sum(s["count"] for s in segments),
+            "segments": segments,
+        }
+        await asyncio.to_thread(_write_id_map, tmp_dir, id_map)
+        await asyncio.to_thread(_write_index, tmp_dir, index)
+        await asyncio.to_thread(_publish, tmp_dir, final_dir)
+        await db.ricorsi.update_one(
+            {"id": ricorso_id},
+            {"$set": {"archive_status": "archived", "archived_at": datetime.utcnow()}}
+        )
+    else:
+        index = read_archive_index(archive_dir, ricorso_id)
+
+    # Elimina dal DB solo quanto è sicuramente nell'archivio
+    deleted = 0
+    if index["segments"]:
+        delete_filter = {
+            "ricorso_id": ricorso_id,
+            "submitted_at": {
+                "$lte": datetime.fromisoformat(index["segments"][-1]["last_submitted_at"])
+            },
+        }
+        while True:
+            batch = await db.submissions.find(
+                delete_filter, {"_id": 0, "id": 1}
+            ).limit(ARCHIVE_DELETE_BATCH_SIZE).to_list(ARCHIVE_DELETE_BATCH_SIZE)
+            if not batch:
+                break
+            submission_ids = [s["id"] for s in batch]
+            await asyncio.to_thread(
+                _move_upload_dirs, uploads_dir, archived_upload_dir(archive_dir, ricorso_id), submission_ids
+            )
+            result = await db.submissions.delete_many(
+                {**delete_filter, "id": {"$in": submission_ids}}
+            )
+            deleted += result.deleted_count
+
+    report = {"ricorso_id": ricorso_id, "archived": index["total"], "deleted_from_db": deleted}
+    logger.info(f"Archive: {report}")
+    return report
+
+
+async def find_archivable_ricorsi(db) -> List[dict]:
+    """Closed ricorsi to archive, plus archived ones whose cleanup was interrupted."""
+    candidates = await db.ricorsi.find(
+        {"attivo": False, "deleted_at": None},
+        {"_id": 0, "id": 1, "titolo": 1, "attivo": 1, "archive_status": 1,
+         "scadenze_regioni": 1, "scadenza_generale": 1, "created_at": 1, "updated_at": 1}
+    ).to_list(1000)
+    now = datetime.utcnow()
+    result = []
+    for ricorso in candidates:
+        if ricorso.get("archive_status") == "archived":
+            if await db.submissions.find_one({"ricorso_id": ricorso["id"]}, {"_id": 0, "id": 1}):
+                result.append(ricorso)
+        elif is_archivable(ricorso, now):
+            result.append(ricorso)
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Archive submissions of closed ricorsi")
+    parser.add_argument("--ricorso", help="archive only this ricorso id")
+    parser.add_argument("--dry-run", action="store_true", help="only list archivable ricorsi")
+    args = parser.parse_args()
+
+    ROOT_DIR = Path(__file__).parent
+    load_dotenv(ROOT_DIR / '.env')
+    logging.basicConfig(level=logging.INFO)
+
+    async def main():
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        db = client[os.environ['DB_NAME']]
+        ricorsi = await find_archivable_ricorsi(db)
+        if args.ricorso:
+            ricorsi = [r for r in ricorsi if r["id"] == args.ricorso]
+        for ricorso in ricorsi:
+            if args.dry_run:
+                print(f"{ricorso['id']}  {ricorso.get('titolo')}")
+            else:
+                print(await archive_ricorso(db, ricorso["id"], ROOT_DIR / 'archive', ROOT_DIR / 'uploads'))
+        client.close()
+
+    asyncio.run(main())
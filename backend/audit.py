@@ -0,0 +1,133 @@
+"""
+Append-only audit log of admin actions.
+
+Handlers call `record()`, which only appends the event to an in-process
+buffer; a background writer flushes it to `audit_log` with insert_many
+every AUDIT_FLUSH_SECONDS, or as soon as AUDIT_BATCH_SIZE events are
+waiting. The buffer is flushed on shutdown. Entries expire through a TTL
+index after AUDIT_RETENTION_DAYS.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Optional
+
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+AUDIT_BATCH_SIZE = 200
+AUDIT_FLUSH_SECONDS = 1.0
+AUDIT_QUEUE_MAX = 10000
+AUDIT_RETENTION_DAYS = int(os.environ.get("AUDIT_RETENTION_DAYS", "730"))
+AUDIT_QUERY_MAX_LIMIT = 500
+
+_buffer: deque = deque()
+_wakeup: Optional[asyncio.Event] = None
+_writer: Optional[asyncio.Task] = None
+_stopping = False
+_db = None
+
+
+def record(actor: str, action: str, entity_type: str, entity_id: Optional[str] = None, **details):
+    """Queue an audit event; never waits on the database."""
+    if len(_buffer) >= AUDIT_QUEUE_MAX:
+        # Database irraggiungibile da tempo: si perdono gli eventi più vecchi
+        _buffer.popleft()
+        logger.warning("Audit buffer full, oldest event dropped")
+    _buffer.append({
+        "id": str(uuid.uuid4()),
+        "at": datetime.utcnow(),
+        "actor": actor,
+        "action": action,
+        "entity_type": entity_type,
+        "entity_id": entity_id,
+        "details": details,
+    })
+    if _wakeup is not None and len(_buffer) >= AUDIT_BATCH_SIZE:
+        _wakeup.set()
+
+
+async def flush():
+    """Write all buffered events, one insert_many per batch."""
+    while _buffer and _db is not None:
+        batch = [_buffer.popleft() for _ in range(min(len(_buffer), AUDIT_BATCH_SIZE))]
+        try:
+            await _db.audit_log.insert_many(batch, ordered=False)
+        except asyncio.CancelledError:
+            # Il batch è già fuori dal buffer: rimesso in testa, con gli _id già assegnati
+            _buffer.extendleft(reversed(batch))
+            raise
+        except BulkWriteError as e:
+            # Errori per singolo documento (es. duplicati di un retry): non si ritenta
+            logger.error("Audit batch partially written: %s", e.details.get("writeErrors"))
+        except Exception:
+            logger.exception("Audit flush failed, %d events kept for retry", len(batch))
+            _buffer.extendleft(reversed(batch))
+            return
+
+
+async def _run():
+    while not _stopping:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), AUDIT_FLUSH_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        await flush()
+
+
+async def ensure_audit_indexes(db):
+    await db.audit_log.create_index("at", expireAfterSeconds=AUDIT_RETENTION_DAYS * 86400)
+    await db.audit_log.create_index([("actor", 1), ("at", -1)])
+    await db.audit_log.create_index([("entity_type", 1), ("entity_id", 1), ("at", -1)])
+
+
+def start_audit_writer(db):
+    global _db, _wakeup, _writer, _stopping
+    _db = db
+    _stopping = False
+    _wakeup = asyncio.Event()
+    _writer = asyncio.create_task(_run())
+
+
+async def stop_audit_writer():
+    """Stop the background writer after its current batch and flush what is left."""
+    global _writer, _stopping
+    if _writer is not None:
+        # Niente cancel: un insert_many interrotto a metà perderebbe il batch
+        _stopping = True
+        _wakeup.set()
+        await _writer
+        _writer = None
+    await flush()
+
+
+async def query_audit(
+    db,
+    actor: Optional[str] = None,
+    entity_type: Optional[str] = None,
+    entity_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = 100,
+) -> list:
+    """Audit events, newest first, filtered on the indexed fields."""
+    query = {}
+    if actor:
+        query["actor"] = actor
+    if entity_type:
+        query["entity_type"] = entity_type
+    if entity_id:
+        query["entity_id"] = entity_id
+    if since or until:
+        query["at"] = {}
+        if since:
+            query["at"]["$gte"] = since
+        if until:
+            query["at"]["$lt"] = until
+    limit = min(limit, AUDIT_QUERY_MAX_LIMIT)
+    return await db.audit_log.find(query, {"_id": 0}).sort("at", -1).limit(limit).to_list(limit)
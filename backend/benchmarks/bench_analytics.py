@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Benchmark: calcolo delle analytics (GET /submissions/analytics/{id})
+su 1M submission sintetiche distribuite su 90 giorni e 20 regioni.
+
+Uso: python benchmarks/bench_analytics.py
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+
+from analytics import compute_analytics, to_columns
+
+N_SUBMISSIONS = 1_000_000
+REGIONI = [
+    'Abruzzo', 'Basilicata', 'Calabria', 'Campania', 'Emilia-Romagna',
+    'Friuli-Venezia Giulia', 'Lazio', 'Liguria', 'Lombardia', 'Marche',
+    'Molise', 'Piemonte', 'Puglia', 'Sardegna', 'Sicilia', 'Toscana',
+    'Trentino-Alto Adige', 'Umbria', "Valle d'Aosta", 'Veneto'
+]
+
+
+def main():
+    rng = np.random.default_rng(42)
+    now = datetime.utcnow()
+    offsets = rng.integers(0, 90 * 86400 * 1000, N_SUBMISSIONS)
+    submitted_at = np.datetime64(now, "ms") - offsets.astype("timedelta64[ms]")
+    regions = np.array(REGIONI, dtype=object)[rng.integers(0, len(REGIONI), N_SUBMISSIONS)]
+    deadlines = {r: now + timedelta(days=int(d)) for r, d in zip(REGIONI, rng.integers(1, 60, len(REGIONI)))}
+
+    # Conversione documenti -> colonne (il costo per documento lato Python)
+    docs = [
+        {"submitted_at": ts, "schema_version": "v1", "dati_utente": {"regione": rg}}
+        for ts, rg in zip(submitted_at[:100_000].astype(datetime), regions[:100_000])
+    ]
+    start = time.perf_counter()
+    to_columns(docs, {"v1": "regione"}, "regione")
+    per_100k = time.perf_counter() - start
+    print(f"to_columns:        {per_100k * 1000:8.1f} ms / 100k documenti")
+
+    start = time.perf_counter()
+    result = compute_analytics(submitted_at, regions, deadlines, None, now)
+    elapsed = time.perf_counter() - start
+    print(f"compute_analytics: {elapsed * 1000:8.1f} ms / {N_SUBMISSIONS:,} submission "
+          f"({len(result['days'])} giorni, {len(result['per_regione'])} regioni)")
+
+
+if __name__ == "__main__":
+    main()
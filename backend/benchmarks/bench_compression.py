@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Benchmark: compressione delle risposte (compression.py)
+Per i payload più grandi dell'API (GET /submissions con 500 record,
+GET /submissions/stats con le liste per regione, GET /ricorsi) misura per
+gzip e brotli, ai livelli dinamici e a quelli delle risposte memorizzate,
+i byte risparmiati contro il tempo CPU speso, e il tempo di trasferimento
+guadagnato su un collegamento d'ufficio lento. Misura anche il costo di un
+hit della cache delle risposte compresse (solo hash del corpo).
+
+Uso: python benchmarks/bench_compression.py
+"""
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import orjson
+
+from compression import compress, _memo_get, _memo_key, _memo_put
+
+N_RICORSI = 100
+N_SUBMISSIONS = 500
+N_STATS = 5000
+ROUNDS = 50
+# Collegamento di riferimento: 10 Mbit/s
+LINK_KB_S = 1250
+REGIONI = ["Lazio", "Lombardia", "Campania", "Sicilia", "Veneto", "Piemonte", "Puglia", "Toscana"]
+
+
+def dati(i):
+    return {
+        "nome": random.choice(["Mario", "Luca", "Giulia", "Anna"]), "cognome": f"Rossi{i % 97}",
+        "matricola": str(100000 + i), "telefono": f"+39 333 {1000000 + i}",
+        "reparto": "Nucleo PEF Milano", "email": f"socio{i}@email.com", "regione": REGIONI[i % len(REGIONI)],
+    }
+
+
+def submissions_payload():
+    now = datetime.utcnow()
+    return orjson.dumps([
+        {
+            "id": f"{random.getrandbits(64):016x}", "ricorso_id": "ric0", "reference_id": f"REF-{1700000000 + i}",
+            "dati_utente": dati(i), "files_info": {f"doc{j}": f"documento_{j}.pdf" for j in range(6)},
+            "submitted_at": now - timedelta(minutes=i), "is_complete": i % 3 != 0,
+        }
+        for i in range(N_SUBMISSIONS)
+    ])
+
+
+def stats_payload():
+    now = datetime.utcnow()
+    per_regione = {}
+    for i in range(N_STATS):
+        regione = per_regione.setdefault(REGIONI[i % len(REGIONI)], {"count": 0, "submissions": []})
+        regione["count"] += 1
+        regione["submissions"].append({
+            "id": f"{random.getrandbits(64):016x}", "reference_id": f"REF-{1700000000 + i}",
+            "submitted_at": now - timedelta(minutes=i),
+        })
+    return orjson.dumps({"ricorso_id": "ric0", "totale_submissions": N_STATS, "per_regione": per_regione})
+
+
+def ricorsi_payload():
+    return orjson.dumps([
+        {
+            "id": f"ric{i}", "titolo": f"Ricorso {i}", "descrizione": "Ricorso collettivo " * 10,
+            "campi_dati": [{"id": f"campo{j}", "label": f"Campo {j}", "type": "text", "required": True} for j in range(7)],
+            "documenti_richiesti": [{"id": f"doc{j}", "label": f"Documento {j}", "fileType": "pdf"} for j in range(6)],
+            "attivo": True, "scadenze_regioni": {r: "2026-12-31" for r in REGIONI},
+        }
+        for i in range(N_RICORSI)
+    ])
+
+
+def bench(label, body, fn):
+    fn()  # warm-up
+    start = time.process_time()
+    for _ in range(ROUNDS):
+        out = fn()
+    cpu_ms = (time.process_time() - start) / ROUNDS * 1000
+    saved_kb = (len(body) - len(out)) / 1024
+    transfer_ms = saved_kb / LINK_KB_S * 1000
+    print(f"  {label:<22} {len(out) / 1024:8.1f} KB  x{len(body) / len(out):5.1f}  {cpu_ms:7.2f} ms CPU  "
+          f"{saved_kb / cpu_ms if cpu_ms else float('inf'):7.0f} KB risparmiati/ms  "
+          f"-{transfer_ms:6.0f} ms di trasferimento")
+
+
+def main():
+    random.seed(0)
+    for route, body in [
+        (f"GET /submissions ({N_SUBMISSIONS})", submissions_payload()),
+        (f"GET /submissions/stats ({N_STATS})", stats_payload()),
+        (f"GET /ricorsi ({N_RICORSI})", ricorsi_payload()),
+    ]:
+        print(f"{route}: {len(body) / 1024:.1f} KB non compressi")
+        for encoding in ("gzip", "br"):
+            bench(f"{encoding} dinamico", body, lambda: compress(body, encoding))
+            bench(f"{encoding} memorizzato", body, lambda: compress(body, encoding, memoized=True))
+        key = _memo_key(body, "br")
+        _memo_put(key, compress(body, "br", memoized=True))
+        bench("br, hit della cache", body, lambda: _memo_get(_memo_key(body, "br")))
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Benchmark: cifratura a riposo degli upload (encryption.py)
+Confronta la scrittura in chiaro con quella cifrata a chunk, e la lettura
+con decifratura, su un file da FILE_MB scritto a pezzi come arriva da
+request.stream(). Riporta il costo della cifratura rispetto alla banda
+di upload e il picco di memoria (nessun file intero in RAM).
+
+Uso: python benchmarks/bench_encryption.py
+"""
+import base64
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+os.environ.setdefault("UPLOAD_MASTER_KEY", base64.urlsafe_b64encode(os.urandom(32)).decode())
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from encryption import EncryptedWriter, StoredFile
+
+FILE_MB = 50
+STREAM_CHUNK = 64 * 1024
+ROUNDS = 5
+# Banda di upload di riferimento (1 Gbit/s)
+UPLOAD_MB_S = 125
+
+
+def write_plain(path: Path, payload: bytes):
+    with open(path, "wb") as f:
+        for i in range(0, len(payload), STREAM_CHUNK):
+            f.write(payload[i:i + STREAM_CHUNK])
+
+
+def write_encrypted(path: Path, payload: bytes):
+    writer = EncryptedWriter(open(path, "wb"))
+    for i in range(0, len(payload), STREAM_CHUNK):
+        writer.write(payload[i:i + STREAM_CHUNK])
+    writer.close()
+
+
+def read_all(path: Path):
+    stored = StoredFile(path)
+    for _ in stored.iter_range(0, stored.size - 1):
+        pass
+
+
+def bench(label, fn, path, payload=None):
+    args = (path,) if payload is None else (path, payload)
+    fn(*args)  # warm-up
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        fn(*args)
+    elapsed = (time.perf_counter() - start) / ROUNDS
+    print(f"  {label:<28} {FILE_MB / elapsed:9.0f} MB/s")
+    return elapsed
+
+
+def main():
+    payload = os.urandom(FILE_MB * 1024 * 1024)
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = Path(tmp) / "plain.pdf"
+        sealed = Path(tmp) / "sealed.pdf"
+
+        print(f"Scrittura ({FILE_MB} MB a chunk da {STREAM_CHUNK // 1024} KB)")
+        t_plain = bench("in chiaro", write_plain, plain, payload)
+        t_sealed = bench("cifrata (AES-GCM)", write_encrypted, sealed, payload)
+        cost = t_sealed - t_plain
+        print(f"  -> costo cifratura {cost / FILE_MB * 1000:.2f} ms/MB, "
+              f"{cost * UPLOAD_MB_S / FILE_MB * 100:.1f}% del tempo di upload a {UPLOAD_MB_S} MB/s\n")
+
+        print("Lettura")
+        bench("in chiaro", read_all, plain)
+        bench("con decifratura", read_all, sealed)
+
+        tracemalloc.start()
+        write_encrypted(sealed, payload)
+        read_all(sealed)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"\nPicco di memoria scrittura+lettura cifrate: {peak / 1024:.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
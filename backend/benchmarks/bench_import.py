@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark: import massivo (importer.py) con le scritture su MongoDB.
+Genera un CSV di N_ROWS righe e lo importa due volte in un ricorso con
+gli indici del server: la prima volta ogni riga crea socio e adesione,
+la seconda ogni riga è un duplicato (solo le query di dedup). Obiettivo:
+100k righe nuove in meno di TARGET_SECONDS; se il primo import lo supera
+il benchmark termina con codice 1.
+
+Richiede MongoDB (MONGO_URL, anche da backend/.env); usa un database
+temporaneo che viene eliminato alla fine.
+
+Uso: python benchmarks/bench_import.py
+"""
+import asyncio
+import csv
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from importer import import_submissions
+from members import ensure_member_indexes
+
+N_ROWS = 100_000
+TARGET_SECONDS = 60
+BENCH_DB = "bench_import"
+REGIONI = ["Lazio", "Lombardia", "Campania", "Sicilia"]
+
+RICORSO = {
+    "id": "ric0",
+    "titolo": "Benchmark import",
+    "campi_dati": [
+        {"id": "nome", "label": "Nome", "type": "text", "required": True},
+        {"id": "cognome", "label": "Cognome", "type": "text", "required": True},
+        {"id": "matricola", "label": "Matricola", "type": "text", "required": True},
+        {"id": "email", "label": "Email", "type": "email", "required": True},
+        {"id": "data_nascita", "label": "Data di nascita", "type": "date", "required": True},
+        {"id": "regione", "label": "Regione", "type": "select", "required": True, "options": REGIONI},
+    ],
+    "documenti_richiesti": [],
+}
+
+
+def write_sheet(path: Path):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow([campo["label"] for campo in RICORSO["campi_dati"]])
+        for i in range(N_ROWS):
+            writer.writerow([
+                f"Nome{i}", f"Cognome{i}", str(100000 + i), f"socio{i}@example.com",
+                f"{1 + i % 28:02d}/{1 + i % 12:02d}/19{50 + i % 50}", REGIONI[i % len(REGIONI)].upper(),
+            ])
+
+
+async def run(db, path: Path, label: str):
+    start = time.perf_counter()
+    report = await import_submissions(db, RICORSO, path, f"bench-{label}")
+    elapsed = time.perf_counter() - start
+    assert report["invalid"] == 0 and report["failed"] == 0, report["errors"][:5]
+    print(f"  {label:10s} {elapsed:6.1f} s  ({N_ROWS / elapsed:8.0f} righe/s)  "
+          f"importate {report['imported']}, duplicate {report['duplicates']}")
+    return report, elapsed
+
+
+async def main():
+    load_dotenv(ROOT_DIR / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[BENCH_DB]
+    try:
+        await client.drop_database(BENCH_DB)
+        # Indici usati dal server per le query di dedup
+        await ensure_member_indexes(db)
+        await db.submissions.create_index([("ricorso_id", 1), ("member_id", 1)])
+        await db.submissions.create_index([("ricorso_id", 1), ("matricola", 1)])
+        await db.submissions.create_index("id")
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "soci.csv"
+            write_sheet(path)
+            print(f"{N_ROWS} righe CSV, {path.stat().st_size / 2**20:.1f} MB")
+            first, elapsed = await run(db, path, "nuove")
+            assert first["imported"] == N_ROWS
+            again, _ = await run(db, path, "duplicate")
+            assert again["imported"] == 0 and again["duplicates"] == N_ROWS
+        assert await db.submissions.count_documents({}) == N_ROWS
+        met = elapsed < TARGET_SECONDS
+        print(f"Obiettivo {N_ROWS} righe in {TARGET_SECONDS} s: {'raggiunto' if met else 'NON raggiunto'}")
+        return met
+    finally:
+        await client.drop_database(BENCH_DB)
+        client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
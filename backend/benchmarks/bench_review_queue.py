@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark: coda di revisione (review.py) con revisori concorrenti.
+Per 1, 10, 25 e 50 revisori in parallelo svuota una coda di N_SUBMISSIONS
+submission pending con claim da CLAIM_SIZE e verifica che nessuna
+submission sia assegnata due volte. Ogni revisore impiega REVIEW_MS per
+submission, come un revisore reale: se i claim non entrano in conflitto
+il throughput dovrebbe crescere linearmente con il numero di revisori.
+Il requisito dei 50 revisori concorrenti è soddisfatto solo se la riga
+dei 50 si avvicina a x50 su un MongoDB reale: contro un database finto
+in-process (mongomock) ogni claim è serializzato e i tempi non contano.
+
+Richiede MongoDB (MONGO_URL, anche da backend/.env); usa un database
+temporaneo che viene eliminato alla fine.
+
+Uso: python benchmarks/bench_review_queue.py
+"""
+import asyncio
+import os
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from review import claim, decide, ensure_review_indexes
+from models import ReviewStatus
+
+N_SUBMISSIONS = 2000
+CLAIM_SIZE = 5
+REVIEW_MS = 10
+REVIEWERS = [1, 10, 25, 50]
+BENCH_DB = "bench_review_queue"
+
+
+async def fill_queue(db):
+    await db.submissions.delete_many({})
+    start = datetime.utcnow() - timedelta(days=1)
+    await db.submissions.insert_many([
+        {
+            "id": f"sub{i}",
+            "ricorso_id": "ric0",
+            "dati_utente": {"matricola": str(100000 + i)},
+            "files_info": {},
+            "review_status": ReviewStatus.PENDING.value,
+            "submitted_at": start + timedelta(seconds=i),
+        }
+        for i in range(N_SUBMISSIONS)
+    ])
+
+
+async def reviewer(db, name: str, seen: Counter):
+    done = 0
+    while True:
+        batch = await claim(db, name, CLAIM_SIZE, "ric0")
+        if not batch:
+            return done
+        for doc in batch:
+            seen[doc["id"]] += 1
+            await asyncio.sleep(REVIEW_MS / 1000)
+            await decide(db, doc["id"], name, ReviewStatus.APPROVED)
+            done += 1
+
+
+async def run(db, n_reviewers: int):
+    await fill_queue(db)
+    seen = Counter()
+    start = time.perf_counter()
+    done = await asyncio.gather(*(reviewer(db, f"rev{i}", seen) for i in range(n_reviewers)))
+    elapsed = time.perf_counter() - start
+    doubles = sum(1 for count in seen.values() if count > 1)
+    assert sum(done) == N_SUBMISSIONS, f"reviewed {sum(done)} of {N_SUBMISSIONS}"
+    assert doubles == 0, f"{doubles} submissions claimed twice"
+    return N_SUBMISSIONS / elapsed
+
+
+async def main():
+    load_dotenv(ROOT_DIR / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[BENCH_DB]
+    await ensure_review_indexes(db)
+    try:
+        print(f"{N_SUBMISSIONS} submission, claim da {CLAIM_SIZE}, {REVIEW_MS} ms di revisione ciascuna")
+        baseline = None
+        for n in REVIEWERS:
+            throughput = await run(db, n)
+            baseline = baseline or throughput
+            print(f"  {n:3d} revisori  {throughput:8.0f} submission/s  "
+                  f"(x{throughput / baseline:.1f}, ideale x{n}), nessun doppio claim")
+    finally:
+        await client.drop_database(BENCH_DB)
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
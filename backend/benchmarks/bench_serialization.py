@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark: serializzazione delle liste (GET /ricorsi, GET /submissions)
+Confronta il vecchio percorso (modelli Pydantic + response_model + json)
+con il percorso diretto orjson sui dict letti da Mongo.
+
+Uso: python benchmarks/bench_serialization.py
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import TypeAdapter
+
+from models import Ricorso, Submission
+
+N_RICORSI = 100
+N_SUBMISSIONS = 500
+ROUNDS = 200
+
+
+def make_ricorsi():
+    now = datetime.utcnow()
+    docs = []
+    for i in range(N_RICORSI):
+        docs.append({
+            "id": f"ric{i}",
+            "titolo": f"Ricorso {i}",
+            "descrizione": "Ricorso collettivo " * 10,
+            "badge_text": "RICORSO COLLETTIVO",
+            "campi_dati": [
+                {"id": f"campo{j}", "label": f"Campo {j}", "type": "text",
+                 "required": True, "placeholder": "...", "options": None}
+                for j in range(7)
+            ],
+            "documenti_richiesti": [
+                {"id": f"doc{j}", "label": f"Documento {j}", "required": True,
+                 "fileType": "pdf", "esempio_file_url": None}
+                for j in range(6)
+            ],
+            "attivo": True,
+            "scadenze_regioni": {"Lazio": "2026-12-31", "Lombardia": "2026-11-30"},
+            "scadenza_generale": "2026-12-31",
+            "created_at": now - timedelta(days=i),
+            "updated_at": now,
+        })
+    return docs
+
+
+def make_submissions():
+    now = datetime.utcnow()
+    return [
+        {
+            "id": f"sub{i}",
+            "ricorso_id": "ric0",
+            "schema_version": "3f1c2a9b8d7e6f5a4b3c2d1e0f9a8b7c",
+            "dati_utente": {
+                "nome": "Mario", "cognome": "Rossi", "matricola": str(100000 + i),
+                "telefono": "+39 333 1234567", "reparto": "Nucleo PEF Milano",
+                "email": f"socio{i}@email.com", "regione": "Lazio",
+            },
+            "files_info": {f"doc{j}": f"documento_{j}.pdf" for j in range(6)},
+            "submitted_at": now - timedelta(minutes=i),
+            "reference_id": f"REF-{1700000000 + i}",
+        }
+        for i in range(N_SUBMISSIONS)
+    ]
+
+
+def old_path(docs, model):
+    """Equivalente di `return [Model(**d) ...]` con response_model=List[Model]."""
+    objs = [model(**d) for d in docs]
+    adapter = TypeAdapter(List[model])
+    validated = adapter.validate_python(jsonable_encoder(objs))
+    return JSONResponse(adapter.dump_python(validated, mode="json")).body
+
+
+def old_path_raw(docs):
+    """Equivalente di `return docs` senza response_model (encoder di default)."""
+    return JSONResponse(jsonable_encoder(docs)).body
+
+
+def new_path(docs):
+    return ORJSONResponse(docs).body
+
+
+def bench(label, fn, docs):
+    fn(docs)  # warm-up
+    start = time.process_time()
+    for _ in range(ROUNDS):
+        body = fn(docs)
+    per_request = (time.process_time() - start) / ROUNDS * 1000
+    print(f"  {label:<34} {per_request:8.3f} ms CPU/request  ({len(body)} bytes)")
+    return per_request
+
+
+def main():
+    ricorsi = make_ricorsi()
+    submissions = make_submissions()
+
+    print(f"GET /ricorsi ({N_RICORSI} ricorsi)")
+    before = bench("Pydantic + response_model", lambda d: old_path(d, Ricorso), ricorsi)
+    after = bench("orjson diretto", new_path, ricorsi)
+    print(f"  -> risparmio {before - after:.3f} ms ({before / after:.1f}x)\n")
+
+    print(f"GET /submissions ({N_SUBMISSIONS} submissions)")
+    before = bench("jsonable_encoder + json", old_path_raw, submissions)
+    after = bench("orjson diretto", new_path, submissions)
+    print(f"  -> risparmio {before - after:.3f} ms ({before / after:.1f}x)")
+
+    # Riferimento: lo stesso payload validato come List[Submission]
+    bench("(rif.) Pydantic List[Submission]", lambda d: old_path(d, Submission), submissions)
+
+
+if __name__ == "__main__":
+    main()
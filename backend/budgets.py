@@ -0,0 +1,160 @@
+"""
+Per-route time budgets for the MongoDB work of a request.
+
+Each API route has a budget (ROUTE_BUDGETS_MS, otherwise DEFAULT_BUDGET_MS).
+The middleware runs the handler inside pymongo.timeout(), so every Motor
+call made while serving the request is sent with the remaining budget as
+maxTimeMS and Mongo itself stops work past the deadline (Motor copies the
+context into its executor threads). Meanwhile it listens for the client
+going away and cancels the handler, so a request nobody waits for issues
+no further queries. Running out of budget is answered with a 503. The
+route template is also made available to the slow-query log.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+import pymongo
+from pymongo.errors import PyMongoError
+from starlette.responses import JSONResponse
+from starlette.routing import Match
+
+from slowlog import current_route
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUDGET_MS = int(os.environ.get("QUERY_BUDGET_MS", 10000))
+RETRY_AFTER_SECONDS = 5
+
+# None: nessun budget (il corpo arriva in streaming e può durare minuti)
+ROUTE_BUDGETS_MS: Dict[str, Optional[int]] = {
+    "/api/ricorsi": 2000,
+    "/api/ricorsi/{ricorso_id}": 2000,
+    "/api/submissions": 5000,
+    "/api/submissions/stats/{ricorso_id}": 8000,
+    "/api/submissions/worklist/{ricorso_id}": 5000,
+    "/api/submissions/analytics/{ricorso_id}": 30000,
+    "/api/audit": 5000,
+    "/api/upload/{submission_id}/{document_id}": None,
+    "/api/upload-esempio/{ricorso_id}/{document_id}": None,
+    "/api/ricorsi/{ricorso_id}/import": None,
+}
+
+_metrics: Dict[str, dict] = {}
+
+
+def route_template(routes, scope) -> Optional[str]:
+    """Path template of the route serving `scope` (e.g. /api/ricorsi/{ricorso_id})."""
+    partial = None
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial
+
+
+def budget_for(template: str) -> Optional[int]:
+    return ROUTE_BUDGETS_MS.get(template, DEFAULT_BUDGET_MS)
+
+
+def _route_metrics(template: str, budget_ms: int) -> dict:
+    return _metrics.setdefault(template, {
+        "budget_ms": budget_ms, "requests": 0, "completed": 0, "timeouts": 0, "cancelled": 0, "max_ms": 0.0,
+    })
+
+
+def budget_metrics() -> dict:
+    """Counters per route template since startup."""
+    return {template: dict(metrics) for template, metrics in sorted(_metrics.items())}
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+class QueryBudgetMiddleware:
+    """ASGI middleware applying the route budget and cancelling abandoned requests."""
+
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        template = route_template(self.routes, scope)
+        current_route.set(template)
+        budget_ms = budget_for(template) if template else None
+        if budget_ms is None:
+            return await self.app(scope, receive, send)
+        metrics = _route_metrics(template, budget_ms)
+        metrics["requests"] += 1
+
+        # Il corpo (piccolo: gli upload non hanno budget) si legge prima di far partire il budget
+        messages = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                metrics["cancelled"] += 1
+                return
+            messages.append(message)
+            if not message.get("more_body"):
+                break
+        disconnected = asyncio.Event()
+
+        async def replay():
+            if messages:
+                return messages.pop(0)
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        response_started = False
+
+        async def tracking_send(message):
+            nonlocal response_started
+            response_started = True
+            await send(message)
+
+        async def handle():
+            with pymongo.timeout(budget_ms / 1000):
+                await self.app(scope, replay, tracking_send)
+
+        start = time.perf_counter()
+        handler = asyncio.create_task(handle())
+        watcher = asyncio.create_task(_wait_for_disconnect(receive))
+        try:
+            await asyncio.wait({handler, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not handler.done():
+                # Client andato via: nessuna altra query per questa richiesta
+                disconnected.set()
+                handler.cancel()
+                await asyncio.gather(handler, return_exceptions=True)
+                metrics["cancelled"] += 1
+                return
+            try:
+                handler.result()
+            except PyMongoError as e:
+                if not e.timeout or response_started:
+                    raise
+                metrics["timeouts"] += 1
+                logger.warning(f"{scope['method']} {template} exceeded its {budget_ms} ms budget: {e}")
+                response = JSONResponse(
+                    status_code=503,
+                    content={"detail": "Il server è sovraccarico, riprova tra qualche secondo",
+                             "route": template, "budget_ms": budget_ms},
+                    headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+                )
+                await response(scope, replay, send)
+                return
+            metrics["completed"] += 1
+        finally:
+            watcher.cancel()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            metrics["max_ms"] = round(max(metrics["max_ms"], elapsed_ms), 1)
@@ -0,0 +1,112 @@
+"""
+Completeness of submissions: which required documents are still missing.
+
+`missing_documents` and `is_complete` are set when a submission is created
+and kept up to date atomically by each upload, so the follow-up worklist
+is a plain indexed query on (ricorso_id, is_complete, regione).
+"""
+from datetime import datetime
+from typing import List, Optional
+
+from deadlines import parse_deadline, parse_regional_deadlines
+from schemas import regione_field_id
+
+WORKLIST_MAX_LIMIT = 500
+
+WORKLIST_PROJECTION = {
+    "_id": 0, "id": 1, "reference_id": 1, "regione": 1, "dati_utente": 1,
+    "missing_documents": 1, "files_info": 1, "submitted_at": 1,
+}
+
+
+def required_document_ids(ricorso: dict) -> List[str]:
+    return [d["id"] for d in ricorso.get("documenti_richiesti", []) if d.get("required", True)]
+
+
+def upload_update_pipeline(document_id: str, filename: str, size: int) -> list:
+    """Aggregation-pipeline update recording an upload and recomputing completeness.
+
+    Runs as a single atomic update_one on the submission.
+    """
+    return [
+        {"$set": {
+            f"files_info.{document_id}": {"$literal": filename},
+            f"files_bytes.{document_id}": {"$literal": size},
+            "missing_documents": {
+                "$setDifference": [{"$ifNull": ["$missing_documents", []]}, [document_id]]
+            },
+        }},
+        {"$set": {"is_complete": {"$eq": [{"$size": "$missing_documents"}, 0]}}},
+    ]
+
+
+async def backfill_completeness(db):
+    """Compute completeness and regione for submissions created before tracking existed."""
+    async for ricorso in db.ricorsi.find(
+        {}, {"_id": 0, "id": 1, "campi_dati": 1, "documenti_richiesti": 1}
+    ):
+        field_id = regione_field_id(ricorso)
+        await db.submissions.update_many(
+            {"ricorso_id": ricorso["id"], "is_complete": {"$exists": False}},
+            [
+                {"$set": {
+                    "regione": f"$dati_utente.{field_id}" if field_id else None,
+                    "missing_documents": {"$setDifference": [
+                        required_document_ids(ricorso),
+                        {"$map": {
+                            "input": {"$objectToArray": {"$ifNull": ["$files_info", {}]}},
+                            "in": "$$this.k"
+                        }}
+                    ]},
+                }},
+                {"$set": {"is_complete": {"$eq": [{"$size": "$missing_documents"}, 0]}}},
+            ]
+        )
+
+
+async def incomplete_worklist(db, ricorso: dict, regione: Optional[str] = None,
+                              limit: int = 100) -> dict:
+    """Incomplete submissions, region by region, nearest deadline first."""
+    now = datetime.utcnow()
+    ricorso_id = ricorso["id"]
+    deadlines = parse_regional_deadlines(ricorso)
+    scadenza_generale = parse_deadline(ricorso.get("scadenza_generale"))
+
+    counts = await db.submissions.aggregate([
+        {"$match": {"ricorso_id": ricorso_id, "is_complete": False}},
+        {"$group": {"_id": "$regione", "count": {"$sum": 1}}},
+    ]).to_list(None)
+
+    regioni = []
+    for row in counts:
+        scadenza = deadlines.get(row["_id"], scadenza_generale)
+        regioni.append({
+            "regione": row["_id"],
+            "incomplete": row["count"],
+            "scadenza": scadenza,
+            "giorni_rimanenti": (scadenza - now).days if scadenza else None,
+        })
+    # Scadenza più vicina prima; regioni senza scadenza in fondo
+    regioni.sort(key=lambda r: (r["scadenza"] is None, r["scadenza"] or now, str(r["regione"])))
+
+    items = []
+    limit = min(limit, WORKLIST_MAX_LIMIT)
+    for entry in regioni:
+        if regione is not None and entry["regione"] != regione:
+            continue
+        if len(items) >= limit:
+            break
+        batch = await db.submissions.find(
+            {"ricorso_id": ricorso_id, "is_complete": False, "regione": entry["regione"]},
+            WORKLIST_PROJECTION
+        ).sort("submitted_at", 1).limit(limit - len(items)).to_list(limit - len(items))
+        for item in batch:
+            item["scadenza"] = entry["scadenza"]
+        items.extend(batch)
+
+    return {
+        "ricorso_id": ricorso_id,
+        "totale_incomplete": sum(r["incomplete"] for r in regioni),
+        "regioni": regioni,
+        "items": items,
+    }
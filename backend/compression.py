@@ -0,0 +1,213 @@
+"""
+Negotiated response compression (brotli or gzip).
+
+The middleware picks br or gzip from Accept-Encoding and compresses
+text-like responses above MIN_SIZE. Whole bodies are compressed in one
+go, off the event loop when large; streamed bodies are compressed chunk by
+chunk as they are sent. Files (PDF, images, Range responses) are passed
+through untouched.
+
+Responses of MEMOIZED_PREFIXES (the public ricorso JSON, identical for
+every visitor) are compressed once at a higher level and the compressed
+bytes are kept in a small LRU keyed by the digest of the body, so a
+campaign peak does not recompress the same payload per request.
+"""
+import asyncio
+import gzip
+import hashlib
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+
+from budgets import route_template
+
+MIN_SIZE = 1024
+# Oltre questa dimensione la compressione gira in un thread
+OFFLOAD_SIZE = 256 * 1024
+MEMOIZED_PREFIXES = ("/api/ricorsi",)
+MEMO_MAX_BYTES = 8 * 1024 * 1024
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "application/x-ndjson", "image/svg+xml")
+
+# Livelli veloci per le risposte dinamiche, più spinti per quelle memorizzate
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+MEMO_GZIP_LEVEL = 9
+MEMO_BROTLI_QUALITY = 9
+
+_memo: "OrderedDict[tuple, bytes]" = OrderedDict()
+_memo_bytes = 0
+_metrics: Dict[str, dict] = {}
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """Preferred supported encoding of an Accept-Encoding header (br over gzip at equal q)."""
+    weights = {}
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[coding.strip()] = q
+    best, best_q = None, 0.0
+    for coding in ("br", "gzip"):
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(body: bytes, encoding: str, memoized: bool = False) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=MEMO_BROTLI_QUALITY if memoized else BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=MEMO_GZIP_LEVEL if memoized else GZIP_LEVEL, mtime=0)
+
+
+def _memo_key(body: bytes, encoding: str) -> tuple:
+    return encoding, hashlib.blake2b(body, digest_size=16).digest()
+
+
+def _memo_get(key: tuple) -> Optional[bytes]:
+    compressed = _memo.get(key)
+    if compressed is not None:
+        _memo.move_to_end(key)
+    return compressed
+
+
+def _memo_put(key: tuple, compressed: bytes):
+    global _memo_bytes
+    if key in _memo:
+        return
+    _memo[key] = compressed
+    _memo_bytes += len(compressed)
+    while _memo_bytes > MEMO_MAX_BYTES and len(_memo) > 1:
+        _, dropped = _memo.popitem(last=False)
+        _memo_bytes -= len(dropped)
+
+
+def _stream_compressor(encoding: str):
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.flush, compressor.finish
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+def _compressible(message: dict, headers: Headers) -> bool:
+    return (
+        200 <= message["status"] < 300 and message["status"] not in (204, 206)
+        and "content-encoding" not in headers
+        and "content-range" not in headers
+        and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+    )
+
+
+def _route_metrics(template: str) -> dict:
+    return _metrics.setdefault(template, {
+        "responses": 0, "bytes_in": 0, "bytes_out": 0, "cpu_ms": 0.0, "memo_hits": 0,
+    })
+
+
+def compression_metrics() -> dict:
+    """Bytes saved and time spent compressing, per route template."""
+    report = {}
+    for template, metrics in sorted(_metrics.items()):
+        saved = metrics["bytes_in"] - metrics["bytes_out"]
+        report[template] = {
+            **metrics,
+            "cpu_ms": round(metrics["cpu_ms"], 1),
+            "ratio": round(metrics["bytes_out"] / metrics["bytes_in"], 3) if metrics["bytes_in"] else None,
+            "kb_saved_per_cpu_ms": round(saved / 1024 / metrics["cpu_ms"], 1) if metrics["cpu_ms"] else None,
+        }
+    return {"memo_entries": len(_memo), "memo_bytes": _memo_bytes, "routes": report}
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses with the negotiated encoding."""
+
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        memoizable = scope["method"] == "GET" and scope["path"].startswith(MEMOIZED_PREFIXES)
+        start_message = None
+        mode = None  # "pass" | "stream"
+        stream = None
+        metrics = None
+
+        async def compressing_send(message):
+            nonlocal start_message, mode, stream, metrics
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if mode is None:
+                headers = MutableHeaders(raw=start_message["headers"])
+                if not _compressible(start_message, headers) or (not more_body and len(body) < MIN_SIZE):
+                    mode = "pass"
+                    await send(start_message)
+                    await send(message)
+                    return
+                headers.add_vary_header("Accept-Encoding")
+                headers["Content-Encoding"] = encoding
+                metrics = _route_metrics(route_template(self.routes, scope) or "other")
+                metrics["responses"] += 1
+                if not more_body:
+                    # Corpo intero: compressione in un colpo solo (o riuso di quella memorizzata)
+                    started = time.perf_counter()
+                    key = _memo_key(body, encoding) if memoizable else None
+                    compressed = _memo_get(key) if memoizable else None
+                    if compressed is not None:
+                        metrics["memo_hits"] += 1
+                    else:
+                        if len(body) >= OFFLOAD_SIZE:
+                            compressed = await asyncio.to_thread(compress, body, encoding, memoizable)
+                        else:
+                            compressed = compress(body, encoding, memoizable)
+                        if memoizable:
+                            _memo_put(key, compressed)
+                    metrics["cpu_ms"] += (time.perf_counter() - started) * 1000
+                    metrics["bytes_in"] += len(body)
+                    metrics["bytes_out"] += len(compressed)
+                    headers["Content-Length"] = str(len(compressed))
+                    await send(start_message)
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+                mode = "stream"
+                stream = _stream_compressor(encoding)
+                del headers["Content-Length"]
+                await send(start_message)
+            elif mode == "pass":
+                await send(message)
+                return
+
+            process, flush, finish = stream
+            started = time.perf_counter()
+            # Flush a ogni chunk: il client riceve i dati man mano che arrivano
+            chunk = process(body) + (flush() if more_body else finish())
+            metrics["cpu_ms"] += (time.perf_counter() - started) * 1000
+            metrics["bytes_in"] += len(body)
+            metrics["bytes_out"] += len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, compressing_send)
@@ -0,0 +1,207 @@
+"""
+Ricorso deadlines (scadenze_regioni / scadenza_generale) and their enforcement.
+
+Deadlines are validated when a ricorso is written: each value must be a
+date (YYYY-MM-DD, the deadline is the end of that day in DEADLINE_TIMEZONE)
+or an ISO datetime (without an offset it is read in DEADLINE_TIMEZONE),
+region names are matched to the options of the region field, and the
+ricorso stores `closes_at`, the moment every region is closed (None while
+some region has no deadline).
+
+On submit the deadline of the member's region is looked up in a table
+compiled once per ricorso version and kept in memory. A region found
+closed in a table compiled in the last DEADLINE_CACHE_SECONDS is rejected
+before any query, so a closed region hammered on its last day costs no
+Mongo round trip. A background scheduler sets `attivo` to false on the
+ricorsi whose closes_at has passed.
+"""
+import asyncio
+import logging
+import os
+import time as _time
+from datetime import date, datetime, time, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from schemas import regione_field_id
+
+logger = logging.getLogger(__name__)
+
+DEADLINE_TIMEZONE = ZoneInfo(os.environ.get("DEADLINE_TIMEZONE", "Europe/Rome"))
+# Per quanto una tabella può rifiutare senza rileggere il ricorso (proroghe da altri worker)
+DEADLINE_CACHE_SECONDS = 30
+DEADLINE_CHECK_SECONDS = 60
+
+_tables: Dict[str, "DeadlineTable"] = {}
+_scheduler: Optional[asyncio.Task] = None
+
+
+def _parse(value: str) -> datetime:
+    """Aware datetime of a deadline string; ValueError if it is not one."""
+    value = value.strip()
+    if len(value) == 10:
+        # Solo la data: vale fino alla fine di quel giorno
+        return datetime.combine(date.fromisoformat(value), time.max, tzinfo=DEADLINE_TIMEZONE)
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=DEADLINE_TIMEZONE)
+
+
+def parse_deadline(value: Optional[str]) -> Optional[datetime]:
+    """Parse a deadline string to a naive UTC datetime (None if unparsable)."""
+    try:
+        return _parse(value).astimezone(timezone.utc).replace(tzinfo=None)
+    except (AttributeError, ValueError):
+        return None
+
+
+def parse_regional_deadlines(ricorso: dict) -> Dict[str, datetime]:
+    """Parsed scadenze_regioni, skipping values that cannot be parsed."""
+    deadlines = {}
+    for regione, value in (ricorso.get("scadenze_regioni") or {}).items():
+        parsed = parse_deadline(value)
+        if parsed is not None:
+            deadlines[regione] = parsed
+    return deadlines
+
+
+def _canonical(label: str, value: str) -> str:
+    try:
+        parsed = _parse(value)
+    except ValueError:
+        raise ValueError(f"Scadenza non valida ({label}): {value!r}, usare AAAA-MM-GG")
+    if len(value.strip()) == 10:
+        return parsed.date().isoformat()
+    return parsed.isoformat()
+
+
+def _region_options(ricorso: dict) -> Optional[List[str]]:
+    field_id = regione_field_id(ricorso)
+    for campo in ricorso.get("campi_dati", []):
+        if campo.get("id") == field_id and campo.get("options"):
+            return campo["options"]
+    return None
+
+
+def normalize_deadlines(ricorso: dict) -> Tuple[Optional[Dict[str, str]], Optional[str]]:
+    """Validated (scadenze_regioni, scadenza_generale) of a ricorso being written.
+
+    Empty values are dropped, region names take the spelling of the region
+    field's options; raises ValueError with a message for the admin.
+    """
+    options = _region_options(ricorso)
+    by_name = {option.lower(): option for option in options or []}
+    regionali = None
+    if ricorso.get("scadenze_regioni") is not None:
+        regionali = {}
+        for regione, value in ricorso["scadenze_regioni"].items():
+            if not value or not value.strip():
+                continue
+            if options is not None:
+                if regione.strip().lower() not in by_name:
+                    raise ValueError(f"Regione sconosciuta nelle scadenze: {regione}")
+                regione = by_name[regione.strip().lower()]
+            regionali[regione] = _canonical(regione, value)
+    generale = ricorso.get("scadenza_generale")
+    generale = _canonical("scadenza generale", generale) if generale and generale.strip() else None
+    return regionali, generale
+
+
+def closing_time(ricorso: dict) -> Optional[datetime]:
+    """When every region is closed (naive UTC), None if some region never closes."""
+    regionali = parse_regional_deadlines(ricorso)
+    generale = parse_deadline(ricorso.get("scadenza_generale"))
+    if generale is None:
+        options = _region_options(ricorso)
+        # Senza scadenza generale, una regione senza scadenza propria resta aperta
+        if not regionali or options is None or not set(options) <= regionali.keys():
+            return None
+    return max([*regionali.values(), *([generale] if generale else [])])
+
+
+class DeadlineTable:
+    """Deadlines of one version of a ricorso, by region value."""
+
+    __slots__ = ("version", "regione_field", "regioni", "generale", "compiled_at")
+
+    def __init__(self, ricorso: dict):
+        self.version = ricorso.get("version")
+        self.regione_field = regione_field_id(ricorso)
+        self.regioni = parse_regional_deadlines(ricorso)
+        self.generale = parse_deadline(ricorso.get("scadenza_generale"))
+        self.compiled_at = _time.monotonic()
+
+    def closed(self, dati: dict, now: Optional[datetime] = None) -> Optional[Tuple[Optional[str], datetime]]:
+        """(region, deadline) if the region of `dati` is closed, else None."""
+        regione = dati.get(self.regione_field) if self.regione_field else None
+        deadline = self.regioni.get(regione, self.generale)
+        if deadline is not None and deadline < (now or datetime.utcnow()):
+            return regione, deadline
+        return None
+
+
+def deadline_table(ricorso: dict) -> DeadlineTable:
+    """The compiled table of `ricorso`, rebuilt only when its version changes."""
+    table = _tables.get(ricorso["id"])
+    if table is None or table.version != ricorso.get("version"):
+        table = _tables[ricorso["id"]] = DeadlineTable(ricorso)
+    else:
+        table.compiled_at = _time.monotonic()
+    return table
+
+
+def cached_closure(ricorso_id: str, dati: dict) -> Optional[Tuple[Optional[str], datetime]]:
+    """Closure of the region of `dati` from a recent table only; None means "ask Mongo"."""
+    table = _tables.get(ricorso_id)
+    if table is None or _time.monotonic() - table.compiled_at > DEADLINE_CACHE_SECONDS:
+        return None
+    return table.closed(dati)
+
+
+def forget(ricorso_id: str):
+    _tables.pop(ricorso_id, None)
+
+
+def closed_message(closure: Tuple[Optional[str], datetime]) -> str:
+    regione, deadline = closure
+    local = deadline.replace(tzinfo=timezone.utc).astimezone(DEADLINE_TIMEZONE)
+    where = f"per la regione {regione}" if regione else "per questo ricorso"
+    return f"Adesioni chiuse {where}: la scadenza era il {local:%d/%m/%Y alle %H:%M}"
+
+
+async def close_expired(db, now: Optional[datetime] = None) -> List[str]:
+    """Deactivate the active ricorsi whose every deadline has passed; returns their ids."""
+    now = now or datetime.utcnow()
+    closed = []
+    async for ricorso in db.ricorsi.find(
+        {"attivo": True, "deleted_at": None, "closes_at": {"$lte": now}}, {"_id": 0, "id": 1, "version": 1}
+    ):
+        result = await db.ricorsi.update_one(
+            {"id": ricorso["id"], "version": ricorso["version"], "attivo": True},
+            {"$set": {"attivo": False, "updated_at": now}, "$inc": {"version": 1}}
+        )
+        if result.modified_count:
+            closed.append(ricorso["id"])
+    return closed
+
+
+async def _run(db, on_close: Callable[[List[str]], None]):
+    while True:
+        try:
+            closed = await close_expired(db)
+            if closed:
+                logger.info(f"Ricorsi closed after their last deadline: {closed}")
+                on_close(closed)
+        except Exception:
+            logger.exception("Deadline check failed")
+        await asyncio.sleep(DEADLINE_CHECK_SECONDS)
+
+
+def start_deadline_scheduler(db, on_close: Callable[[List[str]], None]):
+    global _scheduler
+    _scheduler = asyncio.create_task(_run(db, on_close))
+
+
+async def stop_deadline_scheduler():
+    if _scheduler is not None:
+        _scheduler.cancel()
+        await asyncio.gather(_scheduler, return_exceptions=True)
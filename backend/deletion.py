@@ -0,0 +1,53 @@
+"""
+Cascading delete of a ricorso: submissions, uploaded files, example files and archive.
+"""
+import asyncio
+import shutil
+from pathlib import Path
+from typing import List
+
+from pymongo import DeleteOne
+
+from jobs import update_job, add_progress
+
+DELETE_BATCH_SIZE = 500
+# Pausa tra un batch e l'altro per non saturare Mongo durante cancellazioni enormi
+BATCH_PAUSE_SECONDS = 0.05
+
+
+def _remove_upload_dirs(uploads_dir: Path, submission_ids: List[str]):
+    for submission_id in submission_ids:
+        shutil.rmtree(uploads_dir / submission_id, ignore_errors=True)
+
+
+async def cascade_delete_ricorso(
+    db, job_id: str, ricorso_id: str, uploads_dir: Path, examples_dir: Path, archive_dir: Path
+):
+    """Delete everything belonging to a soft-deleted ricorso, batch by batch.
+
+    Idempotent: if interrupted it can simply be run again.
+    """
+    total = await db.submissions.count_documents({"ricorso_id": ricorso_id})
+    await update_job(db, job_id, total=total, processed=0)
+
+    while True:
+        batch = await db.submissions.find(
+            {"ricorso_id": ricorso_id}, {"_id": 0, "id": 1}
+        ).limit(DELETE_BATCH_SIZE).to_list(DELETE_BATCH_SIZE)
+        if not batch:
+            break
+
+        submission_ids = [s["id"] for s in batch]
+        # Prima i file (fuori dall'event loop), poi i documenti: se il job si
+        # interrompe a metà, la submission è ancora lì e verrà ripresa
+        await asyncio.to_thread(_remove_upload_dirs, uploads_dir, submission_ids)
+        result = await db.submissions.bulk_write(
+            [DeleteOne({"id": sid, "ricorso_id": ricorso_id}) for sid in submission_ids],
+            ordered=False
+        )
+        await add_progress(db, job_id, result.deleted_count)
+        await asyncio.sleep(BATCH_PAUSE_SECONDS)
+
+    await asyncio.to_thread(shutil.rmtree, examples_dir / ricorso_id, True)
+    await asyncio.to_thread(shutil.rmtree, archive_dir / ricorso_id, True)
+    await db.ricorsi.delete_one({"id": ricorso_id})
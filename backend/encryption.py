@@ -0,0 +1,256 @@
+"""
+Encryption at rest for uploaded documents.
+
+Each file gets a random data key, wrapped (AES-GCM) with the master key
+from UPLOAD_MASTER_KEY and stored in the file header. The content is split
+into fixed-size chunks, each sealed with AES-GCM under the data key; the
+chunk counter is part of the nonce and a final-chunk flag is authenticated,
+so chunks cannot be reordered, dropped or truncated unnoticed. Fixed-size
+chunks also let a Range request decrypt only the chunks it touches.
+
+Layout: MAGIC | key id (4) | wrap nonce (12) | wrapped data key (48)
+        | nonce prefix (8) | chunk 0 | chunk 1 | ...   (chunk = data + 16-byte tag)
+
+Files without the magic header are plaintext uploads from before
+encryption was enabled and are read as they are. Usage to encrypt them:
+    python encryption.py [UPLOADS_DIR]
+"""
+import base64
+import hashlib
+import io
+import logging
+import os
+import sys
+import uuid
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"SNFENC\x00\x01"
+CHUNK_SIZE = 64 * 1024
+TAG_SIZE = 16
+HEADER_SIZE = len(MAGIC) + 4 + 12 + 32 + TAG_SIZE + 8
+READ_CHUNK_SIZE = 256 * 1024
+
+
+def _key_id(key: bytes) -> bytes:
+    return hashlib.sha256(key).digest()[:4]
+
+
+def _load_keys() -> Dict[bytes, bytes]:
+    """Master keys by id: the current one plus retired ones still needed to read old files."""
+    keys = {}
+    for name in ("UPLOAD_MASTER_KEY", "UPLOAD_PREVIOUS_MASTER_KEYS"):
+        for encoded in filter(None, os.environ.get(name, "").split(",")):
+            key = base64.urlsafe_b64decode(encoded.strip())
+            if len(key) != 32:
+                raise ValueError(f"{name}: a master key must be 32 bytes (base64)")
+            keys[_key_id(key)] = key
+    return keys
+
+
+_master_keys = _load_keys()
+_current_key: Optional[bytes] = (
+    base64.urlsafe_b64decode(os.environ["UPLOAD_MASTER_KEY"].strip())
+    if os.environ.get("UPLOAD_MASTER_KEY") else None
+)
+
+
+def encryption_enabled() -> bool:
+    return _current_key is not None
+
+
+def _nonce(prefix: bytes, index: int) -> bytes:
+    return prefix + index.to_bytes(4, "big")
+
+
+def _aad(header: bytes, final: bool) -> bytes:
+    return header + (b"\x01" if final else b"\x00")
+
+
+class EncryptedWriter:
+    """File-like writer sealing data chunk by chunk; holds at most one chunk in memory."""
+
+    def __init__(self, fh):
+        self.fh = fh
+        data_key = AESGCM.generate_key(bit_length=256)
+        key_id = _key_id(_current_key)
+        wrap_nonce = os.urandom(12)
+        wrapped = AESGCM(_current_key).encrypt(wrap_nonce, data_key, MAGIC + key_id)
+        self.nonce_prefix = os.urandom(8)
+        self.header = MAGIC + key_id + wrap_nonce + wrapped + self.nonce_prefix
+        self.cipher = AESGCM(data_key)
+        self.index = 0
+        self.buffer = bytearray()
+        fh.write(self.header)
+
+    def _seal(self, data, final: bool):
+        self.fh.write(self.cipher.encrypt(
+            _nonce(self.nonce_prefix, self.index), data, _aad(self.header, final)
+        ))
+        self.index += 1
+
+    def write(self, data: bytes):
+        self.buffer += data
+        if len(self.buffer) <= CHUNK_SIZE:
+            return
+        # L'ultimo chunk resta nel buffer: va sigillato come finale in close()
+        view = memoryview(self.buffer)
+        offset = 0
+        while len(self.buffer) - offset > CHUNK_SIZE:
+            self._seal(view[offset:offset + CHUNK_SIZE], final=False)
+            offset += CHUNK_SIZE
+        rest = bytearray(view[offset:])
+        view.release()
+        self.buffer = rest
+
+    def close(self):
+        if not self.fh.closed:
+            self._seal(self.buffer, final=True)
+            self.buffer.clear()
+            self.fh.close()
+
+    @property
+    def closed(self):
+        return self.fh.closed
+
+
+class StoredFile:
+    """Read access to a stored upload, decrypting it if needed."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.cipher = None
+        stored_size = os.stat(path).st_size
+        with open(path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+        if not header.startswith(MAGIC):
+            self.size = stored_size
+            return
+
+        key_id = header[8:12]
+        master_key = _master_keys.get(key_id)
+        if master_key is None:
+            raise RuntimeError(f"No master key available to decrypt {path.name}")
+        data_key = AESGCM(master_key).decrypt(header[12:24], header[24:72], MAGIC + key_id)
+        self.cipher = AESGCM(data_key)
+        self.header = header
+        self.nonce_prefix = header[72:80]
+        body = stored_size - HEADER_SIZE
+        self.chunk_count = -(-body // (CHUNK_SIZE + TAG_SIZE))
+        self.size = body - self.chunk_count * TAG_SIZE
+
+    @property
+    def encrypted(self) -> bool:
+        return self.cipher is not None
+
+    def _read_chunk(self, f, index: int) -> bytes:
+        f.seek(HEADER_SIZE + index * (CHUNK_SIZE + TAG_SIZE))
+        sealed = f.read(CHUNK_SIZE + TAG_SIZE)
+        final = index == self.chunk_count - 1
+        return self.cipher.decrypt(_nonce(self.nonce_prefix, index), sealed, _aad(self.header, final))
+
+    def iter_range(self, start: int, end: int) -> Iterator[bytes]:
+        """Plaintext bytes start..end (inclusive), one chunk at a time."""
+        with open(self.path, "rb") as f:
+            if self.cipher is None:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    data = f.read(min(READ_CHUNK_SIZE, remaining))
+                    if not data:
+                        break
+                    remaining -= len(data)
+                    yield data
+                return
+            for index in range(start // CHUNK_SIZE, end // CHUNK_SIZE + 1):
+                chunk_start = index * CHUNK_SIZE
+                data = self._read_chunk(f, index)
+                yield data[max(start - chunk_start, 0):end - chunk_start + 1]
+
+    def read(self) -> bytes:
+        """Whole plaintext; only for small files."""
+        return b"".join(self.iter_range(0, self.size - 1)) if self.size else b""
+
+    def open(self):
+        """Seekable binary reader over the plaintext, decrypting one chunk at a time."""
+        if self.cipher is None:
+            return open(self.path, "rb")
+        return io.BufferedReader(_DecryptingReader(self), buffer_size=CHUNK_SIZE)
+
+
+class _DecryptingReader(io.RawIOBase):
+    """Raw reader for StoredFile.open(); keeps only the last decrypted chunk."""
+
+    def __init__(self, stored: StoredFile):
+        self.stored = stored
+        self.fh = open(stored.path, "rb")
+        self.position = 0
+        self.chunk_index = -1
+        self.chunk = b""
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.stored.size}[whence]
+        self.position = max(base + offset, 0)
+        return self.position
+
+    def readinto(self, buffer) -> int:
+        if self.position >= self.stored.size:
+            return 0
+        index, offset = divmod(self.position, CHUNK_SIZE)
+        if index != self.chunk_index:
+            self.chunk = self.stored._read_chunk(self.fh, index)
+            self.chunk_index = index
+        data = self.chunk[offset:offset + len(buffer)]
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def close(self):
+        self.fh.close()
+        super().close()
+
+
+def encrypt_file(path: Path) -> bool:
+    """Encrypt a plaintext upload in place (atomic replace). False if already encrypted."""
+    stored = StoredFile(path)
+    if stored.encrypted:
+        return False
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.part")
+    try:
+        writer = EncryptedWriter(open(tmp_path, "wb"))
+        for data in stored.iter_range(0, stored.size - 1):
+            writer.write(data)
+        writer.close()
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return True
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if not encryption_enabled():
+        sys.exit("UPLOAD_MASTER_KEY is not set")
+    root = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(__file__).parent / "uploads"
+    count = 0
+    for path in root.rglob("*"):
+        if path.is_file() and not path.name.startswith(".") and encrypt_file(path):
+            count += 1
+    logger.info(f"Encrypted {count} files under {root}")
+
+
+if __name__ == "__main__":
+    main()
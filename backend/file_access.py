@@ -0,0 +1,154 @@
+"""
+Serving uploaded documents to staff: HTTP Range streaming and signed URLs.
+
+A signed URL carries its own expiry and an HMAC over the file it grants,
+keyed with auth.SECRET_KEY, so the browser can fetch ranges in parallel
+without a JWT decode or a Mongo lookup per request. The same signature is
+the member's only key to their PDF receipt, handed out on submit. Encrypted uploads are
+decrypted on the fly, only the chunks covering the requested range.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from auth import SECRET_KEY
+from encryption import StoredFile
+from receipts import RECEIPT_STEM
+
+SIGNED_URL_TTL_SECONDS = 600
+# La ricevuta serve al socio anche mesi dopo l'adesione
+RECEIPT_URL_TTL_SECONDS = 365 * 86400
+
+MEDIA_TYPES = {
+    'pdf': 'application/pdf',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+}
+
+
+def find_document_file(directory: Path, stem: str) -> Optional[Path]:
+    for ext in MEDIA_TYPES:
+        path = directory / f"{stem}.{ext}"
+        if path.is_file():
+            return path
+    return None
+
+
+def _signature(submission_id: str, document_id: str, ricorso_id: str, expires: int) -> str:
+    message = f"{submission_id}/{document_id}/{ricorso_id}/{expires}".encode()
+    digest = hmac.new(SECRET_KEY.encode(), message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def sign_document_url(submission_id: str, document_id: str, ricorso_id: str = "",
+                      ttl: int = SIGNED_URL_TTL_SECONDS) -> str:
+    """Relative URL granting read access to one document until it expires.
+
+    `ricorso_id` is only set for archived submissions, whose files live
+    under the ricorso's archive directory.
+    """
+    expires = int(time.time()) + ttl
+    sig = _signature(submission_id, document_id, ricorso_id, expires)
+    url = f"/api/files/{submission_id}/{document_id}?expires={expires}&sig={sig}"
+    if ricorso_id:
+        url += f"&ricorso_id={ricorso_id}"
+    return url
+
+
+def sign_receipt_url(submission_id: str, ttl: int = RECEIPT_URL_TTL_SECONDS) -> str:
+    """Relative URL of the receipt of a submission, for the member who sent it."""
+    expires = int(time.time()) + ttl
+    sig = _signature(submission_id, RECEIPT_STEM, "", expires)
+    return f"/api/submissions/{submission_id}/receipt?expires={expires}&sig={sig}"
+
+
+def verify_document_signature(submission_id: str, document_id: str, ricorso_id: str,
+                              expires: int, sig: str):
+    if expires < time.time():
+        raise HTTPException(status_code=403, detail="Link scaduto")
+    expected = _signature(submission_id, document_id, ricorso_id, expires)
+    if not hmac.compare_digest(expected, sig):
+        raise HTTPException(status_code=403, detail="Firma non valida")
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single `bytes=` range into inclusive (start, end).
+
+    Returns None to serve the whole file (no header, or multiple ranges),
+    raises 416 when the range cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_str, _, end_str = header[len("bytes="):].strip().partition("-")
+    try:
+        if start_str:
+            start = int(start_str)
+            end = int(end_str) if end_str else size - 1
+        else:
+            # bytes=-N: gli ultimi N byte
+            start = max(size - int(end_str), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+
+async def _iter_file(stored: StoredFile, start: int, end: int):
+    chunks = stored.iter_range(start, end)
+    try:
+        while True:
+            # Lettura (e decifratura) fuori dall'event loop
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        chunks.close()
+
+
+def range_file_response(request: Request, path: Path, filename: Optional[str] = None) -> StreamingResponse:
+    """Stream `path` honouring a Range header, reading off the event loop."""
+    st = os.stat(path)
+    stored = StoredFile(path)
+    size = stored.size
+    etag = f'"{int(st.st_mtime)}-{size}"'
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Cache-Control": "private, max-age=300",
+        "Content-Disposition": f"inline; filename*=UTF-8''{quote(filename or path.name)}",
+    }
+
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range == etag:
+        byte_range = parse_range(request.headers.get("range"), size)
+
+    media_type = MEDIA_TYPES.get(path.suffix.lstrip(".").lower(), "application/octet-stream")
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(_iter_file(stored, 0, size - 1), media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        _iter_file(stored, start, end), status_code=206, media_type=media_type, headers=headers
+    )
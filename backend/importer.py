@@ -0,0 +1,461 @@
+"""
+Bulk import of submissions from legacy spreadsheets (CSV or XLSX).
+
+Rows are streamed from the file (an XLSX sheet with the stdlib expat
+parser), so memory stays flat whatever the size. Columns are mapped to the ricorso's
+campi_dati by id or label (or by an explicit mapping) and every row is
+validated against its field: required values, email, number, date
+(normalized to YYYY-MM-DD as the form sends it) and select options
+(normalized to the option's spelling, e.g. "LAZIO" -> "Lazio").
+
+Rows are written in batches of IMPORT_BATCH_SIZE: one `$in` query finds
+the members already known by matricola, one finds the submissions this
+ricorso already has for those matricole, by the submission's own
+matricola or by member (those rows are reported as duplicates, as are
+repeats within the file), then the members and the
+submissions are written with unordered bulk_writes. While a batch is
+being written the next one is parsed and validated in a thread.
+
+A new member gets the spreadsheet data; an existing member's data is
+left alone, since the app's own forms are newer than any legacy sheet.
+Imported submissions carry `import_id` and get no receipt email.
+Running the same file again imports nothing twice.
+
+Usage: python importer.py <ricorso_id> <file.csv|file.xlsx> [--dry-run] [--map "Colonna=campo_id" ...]
+"""
+import asyncio
+import csv
+import re
+import unicodedata
+import uuid
+import zipfile
+from datetime import date, datetime, timedelta
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+from xml.etree import ElementTree
+
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from completeness import required_document_ids
+from members import member_keys
+from models import Submission
+from schemas import ensure_schema_version, regione_field_id
+
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_MB = 100
+# Oltre questo numero di righe con errori il report riporta solo i conteggi
+MAX_REPORTED_ERRORS = 5000
+
+EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%d/%m/%y")
+
+XLSX_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+XLSX_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+# Formati numerici predefiniti di Excel che rappresentano date
+XLSX_DATE_FORMATS = set(range(14, 23)) | set(range(27, 37)) | {45, 46, 47} | set(range(50, 59))
+XLSX_EPOCH = datetime(1899, 12, 30)
+
+
+def _normalize_header(value) -> str:
+    text = unicodedata.normalize("NFKD", str(value or "")).encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+
+def map_columns(header: List, campi: List[dict], mapping: Optional[Dict[str, str]] = None) -> Tuple[Dict[int, dict], List[str]]:
+    """Column index -> campo, and the names of the columns left out."""
+    explicit = {_normalize_header(column): campo_id for column, campo_id in (mapping or {}).items()}
+    by_name = {}
+    for campo in campi:
+        by_name.setdefault(_normalize_header(campo["id"]), campo)
+        by_name.setdefault(_normalize_header(campo.get("label")), campo)
+    by_id = {campo["id"]: campo for campo in campi}
+
+    columns, unmapped, seen = {}, [], set()
+    for index, name in enumerate(header):
+        key = _normalize_header(name)
+        campo = by_id.get(explicit[key]) if key in explicit else by_name.get(key)
+        if campo is None or campo["id"] in seen:
+            if key:
+                unmapped.append(str(name))
+            continue
+        seen.add(campo["id"])
+        columns[index] = campo
+    return columns, unmapped
+
+
+def _cell_text(value) -> str:
+    if type(value) is str:
+        return value.strip()
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        # Excel salva matricole e telefoni come numeri: 123456.0 -> "123456"
+        return str(int(value))
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value).strip()
+
+
+def _parse_date(text: str) -> Optional[str]:
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def validate_row(cells: List, columns: Dict[int, dict], campi: List[dict]) -> Tuple[dict, List[str]]:
+    """(dati_utente, errors) of one row."""
+    dati, errors = {}, []
+    for index, campo in columns.items():
+        text = _cell_text(cells[index] if index < len(cells) else None)
+        if not text:
+            continue
+        field_type = campo.get("type")
+        if field_type == "email" and not EMAIL_RE.match(text):
+            errors.append(f"{campo['label']}: email non valida")
+            continue
+        if field_type == "number":
+            try:
+                float(text.replace(",", "."))
+            except ValueError:
+                errors.append(f"{campo['label']}: non è un numero")
+                continue
+        if field_type == "date":
+            parsed = _parse_date(text)
+            if parsed is None:
+                errors.append(f"{campo['label']}: data non valida")
+                continue
+            text = parsed
+        if field_type == "select" and campo.get("options"):
+            options = {option.lower(): option for option in campo["options"]}
+            if text.lower() not in options:
+                errors.append(f"{campo['label']}: valore non previsto ({text})")
+                continue
+            text = options[text.lower()]
+        dati[campo["id"]] = text
+    for campo in campi:
+        if campo.get("required", True) and campo["id"] not in dati and not any(
+            err.startswith(f"{campo['label']}:") for err in errors
+        ):
+            errors.append(f"{campo['label']}: obbligatorio")
+    return dati, errors
+
+
+def _csv_rows(path: Path) -> Iterator[Tuple[int, List]]:
+    with open(path, "rb") as fh:
+        head = fh.read(64 * 1024)
+    try:
+        head.decode("utf-8")
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError as e:
+        # Troncato a metà di un carattere multibyte: è comunque UTF-8
+        encoding = "utf-8-sig" if e.start >= len(head) - 3 else "cp1252"  # export di Excel italiano
+    sample = head.decode(encoding, errors="ignore")
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=";,\t")
+    except csv.Error:
+        dialect = csv.excel
+    with open(path, newline="", encoding=encoding) as fh:
+        yield from enumerate(csv.reader(fh, dialect), start=1)
+
+
+def _xml_text(element) -> str:
+    return "".join(t.text or "" for t in element.iter(f"{XLSX_NS}t"))
+
+
+def _date_styles(archive: zipfile.ZipFile) -> List[bool]:
+    """For each cell style index, whether it formats numbers as dates."""
+    try:
+        root = ElementTree.fromstring(archive.read("xl/styles.xml"))
+    except KeyError:
+        return []
+    custom = {}
+    for fmt in root.iter(f"{XLSX_NS}numFmt"):
+        # Senza testo tra virgolette e sezioni [colore]/[locale]: resta il formato vero
+        code = re.sub(r'"[^"]*"|\[[^]]*\]', "", fmt.get("formatCode", "")).lower()
+        custom[int(fmt.get("numFmtId"))] = "d" in code or "y" in code or "a" in code.replace("am/pm", "")
+    cell_xfs = root.find(f"{XLSX_NS}cellXfs")
+    return [
+        (lambda fmt_id: fmt_id in XLSX_DATE_FORMATS or custom.get(fmt_id, False))(int(xf.get("numFmtId", 0)))
+        for xf in (cell_xfs if cell_xfs is not None else [])
+    ]
+
+
+def _first_sheet(archive: zipfile.ZipFile) -> str:
+    workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    sheet = workbook.find(f"{XLSX_NS}sheets/{XLSX_NS}sheet")
+    rel_id = sheet.get(f"{{{XLSX_REL_NS}}}id")
+    rels = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+    for rel in rels:
+        if rel.get("Id") == rel_id:
+            target = rel.get("Target")
+            return target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+    raise ValueError("Foglio non trovato nel file XLSX")
+
+
+def _column_index(reference: str) -> int:
+    index = 0
+    for char in reference:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - 64
+    return index - 1
+
+
+def _xlsx_rows(path: Path) -> Iterator[Tuple[int, List]]:
+    """Cell values of the first sheet, parsed with expat (openpyxl is several times slower)."""
+    with zipfile.ZipFile(path) as archive:
+        try:
+            shared = [
+                _xml_text(si) for si in ElementTree.fromstring(archive.read("xl/sharedStrings.xml"))
+            ]
+        except KeyError:
+            shared = []
+        date_styles = _date_styles(archive)
+        with archive.open(_first_sheet(archive)) as sheet:
+            row_number = 0
+            cells = []
+            for _, element in ElementTree.iterparse(sheet):
+                tag = element.tag
+                if tag == f"{XLSX_NS}c":
+                    kind = element.get("t", "n")
+                    if kind == "inlineStr":
+                        value = _xml_text(element)
+                    else:
+                        v = element.find(f"{XLSX_NS}v")
+                        value = v.text if v is not None else None
+                        if value is not None:
+                            if kind == "s":
+                                value = shared[int(value)]
+                            elif kind == "n":
+                                value = float(value)
+                                style = int(element.get("s", 0))
+                                if style < len(date_styles) and date_styles[style]:
+                                    value = XLSX_EPOCH + timedelta(days=value)
+                            elif kind == "b":
+                                value = value == "1"
+                    reference = element.get("r")
+                    if reference:
+                        cells.extend([None] * (_column_index(reference) - len(cells)))
+                    cells.append(value)
+                elif tag == f"{XLSX_NS}row":
+                    row_number = int(element.get("r", row_number + 1))
+                    yield row_number, cells
+                    cells = []
+                    element.clear()
+
+
+def read_rows(path: Path) -> Iterator[Tuple[int, List]]:
+    """(row number, cells) of a CSV or XLSX file, the header first."""
+    with open(path, "rb") as fh:
+        is_xlsx = fh.read(4) == b"PK\x03\x04"
+    return _xlsx_rows(path) if is_xlsx else _csv_rows(path)
+
+
+class _Batcher:
+    """Parses and validates the rows of the file a batch at a time."""
+
+    def __init__(self, rows: Iterator[Tuple[int, List]], ricorso: dict, schema_version: str, import_id: str,
+                 mapping: Optional[Dict[str, str]]):
+        self.campi = ricorso.get("campi_dati", [])
+        self.regione_id = regione_field_id(ricorso)
+        self.rows = rows
+        _, header = next(self.rows, (0, []))
+        self.columns, self.unmapped = map_columns(header, self.campi, mapping)
+        mapped = {campo["id"] for campo in self.columns.values()}
+        missing = [campo["label"] for campo in self.campi if campo.get("required", True) and campo["id"] not in mapped]
+        if missing:
+            raise ValueError(f"Colonne obbligatorie mancanti: {', '.join(missing)}")
+        # Validata una volta dal modello; le righe ne cambiano solo i campi propri
+        missing_documents = required_document_ids(ricorso)
+        self.template = Submission(
+            ricorso_id=ricorso["id"],
+            schema_version=schema_version,
+            import_id=import_id,
+            dati_utente={},
+            files_info={},
+            missing_documents=missing_documents,
+            is_complete=not missing_documents,
+        ).dict()
+        # Con l'id dell'import: due import partiti nello stesso secondo non si sovrappongono
+        self.reference_prefix = f"REF-{import_id}"
+
+    def next_batch(self) -> Optional[List[Tuple[int, Optional[dict], List[str]]]]:
+        """(row number, submission or None, errors) for the next IMPORT_BATCH_SIZE rows; None at the end."""
+        batch = []
+        consumed = 0
+        for row_number, cells in islice(self.rows, IMPORT_BATCH_SIZE):
+            consumed += 1
+            if not any(_cell_text(cell) for cell in cells):
+                continue
+            dati, errors = validate_row(cells, self.columns, self.campi)
+            if errors:
+                batch.append((row_number, None, errors))
+                continue
+            batch.append((row_number, {
+                **self.template,
+                "id": str(uuid.uuid4()),
+                "dati_utente": dati,
+                "files_info": {},
+                "files_bytes": {},
+                "regione": dati.get(self.regione_id) if self.regione_id else None,
+                "missing_documents": list(self.template["missing_documents"]),
+                "reference_id": f"{self.reference_prefix}-{row_number}",
+            }, []))
+        return batch if consumed else None
+
+
+class ImportReport:
+    def __init__(self, unmapped: List[str]):
+        self.counts = {"rows": 0, "imported": 0, "duplicates": 0, "invalid": 0, "failed": 0}
+        self.unmapped_columns = unmapped
+        self.errors = []
+
+    def error(self, row_number: int, kind: str, messages: List[str]):
+        self.counts[kind] += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row_number, "errors": messages})
+
+    def as_dict(self) -> dict:
+        return {
+            **self.counts,
+            "unmapped_columns": self.unmapped_columns,
+            "errors": sorted(self.errors, key=lambda error: error["row"]),
+            "errors_truncated": sum(self.counts[k] for k in ("duplicates", "invalid", "failed")) > len(self.errors),
+        }
+
+
+async def _write_batch(db, ricorso: dict, batch, seen: set, report: ImportReport, dry_run: bool):
+    keyed = []
+    for row_number, submission, errors in batch:
+        report.counts["rows"] += 1
+        if submission is None:
+            report.error(row_number, "invalid", errors)
+            continue
+        matricola, email = member_keys(ricorso, submission["dati_utente"])
+        if matricola and matricola in seen:
+            report.error(row_number, "duplicates", [f"Matricola {matricola} ripetuta nel file"])
+            continue
+        if matricola:
+            seen.add(matricola)
+        submission["matricola"] = matricola
+        keyed.append((row_number, submission, matricola, email))
+
+    matricole = [matricola for _, _, matricola, _ in keyed if matricola]
+    members = {
+        m["matricola"]: m["id"] for m in await db.members.find(
+            {"matricola": {"$in": matricole}}, {"_id": 0, "id": 1, "matricola": 1}
+        ).to_list(None)
+    } if matricole else {}
+    # Adesioni già presenti: per socio, o per matricola se non collegate al registro
+    existing = await db.submissions.find(
+        {"ricorso_id": ricorso["id"], "$or": [
+            {"matricola": {"$in": matricole}}, {"member_id": {"$in": list(members.values())}}
+        ]},
+        {"_id": 0, "member_id": 1, "matricola": 1}
+    ).to_list(None) if matricole else []
+    taken_members = {s.get("member_id") for s in existing} - {None}
+    taken_matricole = {s.get("matricola") for s in existing} - {None}
+
+    rows = []
+    for row_number, submission, matricola, email in keyed:
+        if matricola in taken_matricole or members.get(matricola) in taken_members:
+            report.error(row_number, "duplicates", [f"Matricola {matricola} ha già un'adesione a questo ricorso"])
+            continue
+        rows.append((row_number, submission, matricola, email))
+    if dry_run:
+        report.counts["imported"] += len(rows)
+        return
+    if not rows:
+        return
+
+    now = datetime.utcnow()
+    member_ops, new = [], []
+    for _, submission, matricola, email in rows:
+        if matricola and matricola not in members:
+            new.append(matricola)
+            on_insert = {"id": str(uuid.uuid4()), "matricola": matricola, "dati": submission["dati_utente"],
+                         "created_at": now, "updated_at": now}
+            if email:
+                on_insert["email"] = email
+            member_ops.append(UpdateOne({"matricola": matricola}, {"$setOnInsert": on_insert}, upsert=True))
+    if member_ops:
+        await db.members.bulk_write(member_ops, ordered=False)
+        # Id riletti: su un upsert concorrente vince l'id già scritto
+        members.update({
+            m["matricola"]: m["id"] for m in await db.members.find(
+                {"matricola": {"$in": new}}, {"_id": 0, "id": 1, "matricola": 1}
+            ).to_list(None)
+        })
+
+    for _, submission, matricola, _ in rows:
+        submission["member_id"] = members.get(matricola)
+    try:
+        result = await db.submissions.bulk_write([InsertOne(s) for _, s, _, _ in rows], ordered=False)
+        report.counts["imported"] += result.inserted_count
+    except BulkWriteError as e:
+        report.counts["imported"] += e.details.get("nInserted", 0)
+        for error in e.details.get("writeErrors", []):
+            report.error(rows[error["index"]][0], "failed", [error.get("errmsg", "Scrittura fallita")])
+
+
+async def import_submissions(db, ricorso: dict, path: Path, import_id: str,
+                             mapping: Optional[Dict[str, str]] = None, dry_run: bool = False,
+                             on_progress=None) -> dict:
+    """Import the rows of `path` as submissions of `ricorso`; returns the report."""
+    schema_version = ricorso.get("schema_version") or await ensure_schema_version(db, ricorso)
+    batcher = await asyncio.to_thread(_Batcher, read_rows(path), ricorso, schema_version, import_id, mapping)
+    report = ImportReport(batcher.unmapped)
+    seen = set()
+    pending = asyncio.ensure_future(asyncio.to_thread(batcher.next_batch))
+    try:
+        while (batch := await pending) is not None:
+            # Il batch successivo si legge mentre questo viene scritto
+            pending = asyncio.ensure_future(asyncio.to_thread(batcher.next_batch))
+            await _write_batch(db, ricorso, batch, seen, report, dry_run)
+            if on_progress is not None:
+                await on_progress(len(batch))
+    finally:
+        pending.cancel()
+    return report.as_dict()
+
+
+async def main():
+    import argparse
+    import json
+    import os
+
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Import submissions from a CSV/XLSX file")
+    parser.add_argument("ricorso_id")
+    parser.add_argument("file", type=Path)
+    parser.add_argument("--dry-run", action="store_true", help="validate only, write nothing")
+    parser.add_argument("--map", action="append", default=[], metavar="COLONNA=CAMPO_ID")
+    args = parser.parse_args()
+    mapping = dict(item.split("=", 1) for item in args.map)
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        db = client[os.environ['DB_NAME']]
+        ricorso = await db.ricorsi.find_one({"id": args.ricorso_id, "deleted_at": None}, {"_id": 0})
+        if not ricorso:
+            raise SystemExit(f"Ricorso {args.ricorso_id} not found")
+        report = await import_submissions(
+            db, ricorso, args.file, f"cli-{uuid.uuid4()}", mapping=mapping, dry_run=args.dry_run
+        )
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,210 @@
+"""
+Incremental janitor for orphan files under UPLOADS_DIR and EXAMPLES_DIR.
+
+Top-level directories are visited in name order, a bounded number per run,
+and cross-checked against Mongo with batched `$in` queries. The last directory
+processed is checkpointed in `janitor_checkpoints`, so the next run resumes
+from there; when the end of the tree is reached the cursor wraps around.
+
+Usage: python janitor.py [--reclaim] [--area uploads|examples]
+"""
+import asyncio
+import heapq
+import logging
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from receipts import RECEIPT_STEM
+from thumbnails import THUMB_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+JANITOR_BATCH_SIZE = 500
+JANITOR_MAX_DIRS_PER_RUN = 50000
+# Non toccare file più recenti di così: potrebbero essere upload in corso
+JANITOR_MIN_AGE_SECONDS = 3600
+
+
+def _next_dir_names(root: Path, after: str, limit: int) -> List[str]:
+    """The `limit` smallest directory names greater than `after`, in O(limit) memory."""
+    with os.scandir(root) as it:
+        return heapq.nsmallest(
+            limit,
+            (e.name for e in it if e.name > after and e.is_dir(follow_symlinks=False))
+        )
+
+
+def _sweep(path: Path, keep: Set[str], reclaim: bool, min_mtime: float, by_stem: bool = False) -> Dict[str, int]:
+    """Remove (or just count, in dry-run) every file in `path` not listed in `keep`.
+
+    With `by_stem`, `keep` lists file names without extension.
+    """
+    files = 0
+    size = 0
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                name = entry.name.split(".", 1)[0] if by_stem else entry.name
+                if name in keep or not entry.is_file(follow_symlinks=False):
+                    continue
+                st = entry.stat(follow_symlinks=False)
+                if st.st_mtime > min_mtime:
+                    continue
+                files += 1
+                size += st.st_size
+                if reclaim:
+                    os.unlink(entry.path)
+        if reclaim and not keep:
+            os.rmdir(path)
+    except OSError:
+        # Directory non vuota (file recenti) o rimossa nel frattempo
+        pass
+    return {"files": files, "bytes": size}
+
+
+def _expected_upload_files(submission: dict) -> Set[str]:
+    """Document ids uploaded for this submission (files are named <document_id>.<ext>), plus its receipt."""
+    return set((submission.get("files_info") or {}).keys()) | {RECEIPT_STEM}
+
+
+def _latest_esempio_files(path: Path, document_ids: Set[str]) -> Set[str]:
+    """For each document with a sample, keep only the most recently written file (and its thumbnail)."""
+    latest = {}
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.endswith(THUMB_SUFFIX):
+                    continue
+                document_id, sep, _ = entry.name.rpartition("_esempio.")
+                if not sep or document_id not in document_ids:
+                    continue
+                mtime = entry.stat(follow_symlinks=False).st_mtime
+                if document_id not in latest or mtime > latest[document_id][0]:
+                    latest[document_id] = (mtime, entry.name)
+    except OSError:
+        pass
+    keep = {name for _, name in latest.values()}
+    keep.update(f"{document_id}_esempio{THUMB_SUFFIX}" for document_id in latest)
+    return keep
+
+
+def _sweep_examples(path: Path, document_ids: Optional[Set[str]], reclaim: bool, min_mtime: float):
+    keep = _latest_esempio_files(path, document_ids) if document_ids else set()
+    return _sweep(path, keep, reclaim, min_mtime)
+
+
+async def _sweep_uploads_batch(db, root: Path, names: List[str], reclaim: bool, min_mtime: float):
+    submissions = await db.submissions.find(
+        {"id": {"$in": names}}, {"_id": 0, "id": 1, "files_info": 1}
+    ).to_list(len(names))
+    known = {s["id"]: _expected_upload_files(s) for s in submissions}
+
+    def sweep_all():
+        return [
+            _sweep(root / name, known.get(name, set()), reclaim, min_mtime, by_stem=True)
+            for name in names
+        ]
+
+    return await asyncio.to_thread(sweep_all)
+
+
+async def _sweep_examples_batch(db, root: Path, names: List[str], reclaim: bool, min_mtime: float):
+    ricorsi = await db.ricorsi.find(
+        {"id": {"$in": names}}, {"_id": 0, "id": 1, "documenti_richiesti": 1}
+    ).to_list(len(names))
+    with_samples = {
+        r["id"]: {d["id"] for d in r.get("documenti_richiesti", []) if d.get("esempio_file_url")}
+        for r in ricorsi
+    }
+
+    def sweep_all():
+        return [
+            _sweep_examples(root / name, with_samples.get(name), reclaim, min_mtime)
+            for name in names
+        ]
+
+    return await asyncio.to_thread(sweep_all)
+
+
+_AREAS = {
+    "uploads": _sweep_uploads_batch,
+    "examples": _sweep_examples_batch,
+}
+
+
+async def run_janitor(
+    db,
+    area: str,
+    root: Path,
+    reclaim: bool = False,
+    batch_size: int = JANITOR_BATCH_SIZE,
+    max_dirs: int = JANITOR_MAX_DIRS_PER_RUN,
+    min_age_seconds: int = JANITOR_MIN_AGE_SECONDS,
+) -> dict:
+    """Sweep up to `max_dirs` directories of `area`, resuming from the checkpoint."""
+    sweep_batch = _AREAS[area]
+    checkpoint = await db.janitor_checkpoints.find_one({"area": area}, {"_id": 0})
+    cursor = checkpoint["cursor"] if checkpoint else ""
+    min_mtime = time.time() - min_age_seconds
+
+    names = await asyncio.to_thread(_next_dir_names, root, cursor, max_dirs)
+    report = {
+        "area": area,
+        "mode": "reclaim" if reclaim else "dry_run",
+        "started_from": cursor,
+        "scanned_dirs": 0,
+        "orphan_files": 0,
+        "orphan_bytes": 0,
+        "cycle_completed": len(names) < max_dirs,
+    }
+
+    for i in range(0, len(names), batch_size):
+        batch = names[i:i + batch_size]
+        for result in await sweep_batch(db, root, batch, reclaim, min_mtime):
+            report["orphan_files"] += result["files"]
+            report["orphan_bytes"] += result["bytes"]
+        report["scanned_dirs"] += len(batch)
+        await db.janitor_checkpoints.update_one(
+            {"area": area},
+            {"$set": {"cursor": batch[-1], "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    if report["cycle_completed"]:
+        await db.janitor_checkpoints.update_one(
+            {"area": area},
+            {"$set": {"cursor": "", "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    logger.info(f"Janitor {area}: {report}")
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Remove orphan files from uploads/examples")
+    parser.add_argument("--reclaim", action="store_true", help="delete files (default: dry-run)")
+    parser.add_argument("--area", choices=sorted(_AREAS), action="append")
+    parser.add_argument("--max-dirs", type=int, default=JANITOR_MAX_DIRS_PER_RUN)
+    args = parser.parse_args()
+
+    ROOT_DIR = Path(__file__).parent
+    load_dotenv(ROOT_DIR / '.env')
+    logging.basicConfig(level=logging.INFO)
+
+    async def main():
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        db = client[os.environ['DB_NAME']]
+        roots = {"uploads": ROOT_DIR / 'uploads', "examples": ROOT_DIR / 'examples'}
+        for area in args.area or sorted(_AREAS):
+            print(await run_janitor(db, area, roots[area], reclaim=args.reclaim, max_dirs=args.max_dirs))
+        client.close()
+
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+"""
+Background jobs with progress tracked in the `jobs` collection.
+"""
+import asyncio
+import contextvars
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from models import Job, JobStatus
+
+logger = logging.getLogger(__name__)
+
+# Riferimenti ai task in corso, altrimenti il GC può raccoglierli a metà
+_running_tasks = set()
+
+
+async def create_job(db, tipo: str, created_by: str = None, **params) -> dict:
+    job = Job(tipo=tipo, params=params, created_by=created_by)
+    job_dict = job.dict()
+    await db.jobs.insert_one(job_dict)
+    job_dict.pop("_id", None)
+    return job_dict
+
+
+async def update_job(db, job_id: str, **fields):
+    fields["updated_at"] = datetime.utcnow()
+    await db.jobs.update_one({"id": job_id}, {"$set": fields})
+
+
+async def add_progress(db, job_id: str, count: int):
+    await db.jobs.update_one(
+        {"id": job_id},
+        {"$inc": {"processed": count}, "$set": {"updated_at": datetime.utcnow()}}
+    )
+
+
+async def get_job(db, job_id: str):
+    return await db.jobs.find_one({"id": job_id}, {"_id": 0})
+
+
+async def find_unfinished_jobs(db, tipo: str):
+    """Jobs interrupted by a restart, to be resumed on startup."""
+    return await db.jobs.find(
+        {"tipo": tipo, "status": {"$in": [JobStatus.PENDING.value, JobStatus.RUNNING.value]}},
+        {"_id": 0}
+    ).to_list(1000)
+
+
+def start_job(db, job_id: str, work: Callable[[], Awaitable[None]]) -> asyncio.Task:
+    """Run `work` in the background, recording its outcome on the job document."""
+    async def runner():
+        await update_job(db, job_id, status=JobStatus.RUNNING.value)
+        try:
+            await work()
+        except Exception as e:
+            logger.exception("Job %s failed", job_id)
+            await update_job(
+                db, job_id,
+                status=JobStatus.FAILED.value, error=str(e), finished_at=datetime.utcnow()
+            )
+        else:
+            await update_job(
+                db, job_id, status=JobStatus.COMPLETED.value, finished_at=datetime.utcnow()
+            )
+
+    # Contesto vuoto: il job non eredita il budget di query della richiesta che lo avvia
+    task = asyncio.create_task(runner(), context=contextvars.Context())
+    _running_tasks.add(task)
+    task.add_done_callback(_running_tasks.discard)
+    return task
@@ -0,0 +1,231 @@
+"""
+Registry of members (soci) across ricorsi, keyed by matricola.
+
+Reading or changing a member's registry entry takes the member token
+(codice socio): an HMAC-signed member id sent only in the receipt email,
+so only to the address on record. Matricola and email alone prove
+nothing, colleagues know both. A submission carrying the token is linked
+to the member and refreshes its data; one without it can only create a
+new member for an unknown matricola, never touch an existing one.
+
+Each upload of a linked submission is kept as the member's pending copy
+of that document, and an approved review promotes the copies from that
+submission to verified `documents`. A later submission by the token
+holder can then reuse a verified document: the file is hard-linked from
+the original submission instead of being uploaded again.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from auth import SECRET_KEY
+from upload_guard import STORED_EXTENSIONS
+
+MEMBER_PROJECTION = {"_id": 0, "id": 1, "matricola": 1, "email": 1, "dati": 1, "documents": 1}
+# Il codice socio vale per le adesioni di più ricorsi: dura quanto il link della ricevuta
+MEMBER_TOKEN_TTL_SECONDS = 365 * 86400
+BACKFILL_BATCH_SIZE = 1000
+
+
+def _field_id(ricorso: dict, name: str, field_type: Optional[str] = None) -> Optional[str]:
+    for campo in ricorso.get("campi_dati", []):
+        if campo.get("id") == name or campo.get("label", "").lower() == name:
+            return campo.get("id")
+    for campo in ricorso.get("campi_dati", []):
+        if field_type and campo.get("type") == field_type:
+            return campo.get("id")
+    return None
+
+
+def member_keys(ricorso: dict, dati: dict):
+    """Normalized (matricola, email) of a submission, None where missing."""
+    matricola_id = _field_id(ricorso, "matricola")
+    email_id = _field_id(ricorso, "email", "email")
+    matricola = str(dati.get(matricola_id) or "").strip() if matricola_id else ""
+    email = str(dati.get(email_id) or "").strip().lower() if email_id else ""
+    return matricola or None, email or None
+
+
+def _token_signature(member_id: str, expires: int) -> str:
+    message = f"member/{member_id}/{expires}".encode()
+    digest = hmac.new(SECRET_KEY.encode(), message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def member_token(member_id: str, ttl: int = MEMBER_TOKEN_TTL_SECONDS) -> str:
+    """Member token (codice socio) for `member_id`, valid until it expires."""
+    expires = int(time.time()) + ttl
+    return f"{member_id}.{expires}.{_token_signature(member_id, expires)}"
+
+
+def verify_member_token(token: Optional[str]) -> Optional[str]:
+    """Member id carried by a valid, unexpired member token; None otherwise."""
+    try:
+        member_id, expires, sig = (token or "").split(".")
+        expires = int(expires)
+    except ValueError:
+        return None
+    if expires < time.time() or not hmac.compare_digest(_token_signature(member_id, expires), sig):
+        return None
+    return member_id
+
+
+async def ensure_member_indexes(db):
+    await db.members.create_index(
+        "matricola", unique=True, partialFilterExpression={"matricola": {"$type": "string"}}
+    )
+    await db.members.create_index("email")
+    await db.members.create_index("id", unique=True)
+
+
+async def backfill_submission_matricole(db):
+    """Copy the normalized matricola to the top level of submissions created before it was kept there."""
+    async for ricorso in db.ricorsi.find({}, {"_id": 0, "id": 1, "campi_dati": 1}):
+        field_id = _field_id(ricorso, "matricola")
+        if not field_id:
+            continue
+        ops = []
+        async for submission in db.submissions.find(
+            {"ricorso_id": ricorso["id"], "matricola": {"$exists": False}, f"dati_utente.{field_id}": {"$ne": None}},
+            {"_id": 0, "id": 1, "dati_utente": 1}
+        ):
+            # Stessa normalizzazione di member_keys, usata da import e form
+            matricola, _ = member_keys(ricorso, submission["dati_utente"])
+            ops.append(UpdateOne({"id": submission["id"]}, {"$set": {"matricola": matricola}}))
+            if len(ops) == BACKFILL_BATCH_SIZE:
+                await db.submissions.bulk_write(ops, ordered=False)
+                ops = []
+        if ops:
+            await db.submissions.bulk_write(ops, ordered=False)
+
+
+async def upsert_member(db, ricorso: dict, dati: dict, member_id: Optional[str] = None) -> Optional[str]:
+    """Member to link a submission to; returns its id, None for no link.
+
+    `member_id` comes from a verified member token: that member's data is
+    refreshed with the form values, provided the matricola is its own.
+    Without a token a member is only created, for a matricola not yet in
+    the registry; an existing member is left untouched and not linked.
+    """
+    matricola, email = member_keys(ricorso, dati)
+    if not matricola:
+        return None
+    # Solo i campi del form: le chiavi di dati_utente arrivano dal client
+    field_ids = {campo.get("id") for campo in ricorso.get("campi_dati", [])}
+    form_dati = {k: v for k, v in dati.items() if k in field_ids}
+    now = datetime.utcnow()
+    if member_id:
+        result = await db.members.update_one(
+            {"id": member_id, "matricola": matricola},
+            {"$set": {**{f"dati.{k}": v for k, v in form_dati.items()}, "updated_at": now}}
+        )
+        return member_id if result.matched_count else None
+    if not email:
+        return None
+    new_id = str(uuid.uuid4())
+    try:
+        result = await db.members.update_one(
+            {"matricola": matricola},
+            {"$setOnInsert": {
+                "id": new_id, "matricola": matricola, "email": email, "dati": form_dati,
+                "created_at": now, "updated_at": now,
+            }},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # Upsert concorrente della stessa matricola: il socio esiste già
+        return None
+    return new_id if result.upserted_id is not None else None
+
+
+async def receipt_member_token(db, ricorso: dict, submission: dict) -> Optional[str]:
+    """Member token to put in a submission's receipt email.
+
+    Only when the submission's email is the one on record, since that is
+    where the receipt goes.
+    """
+    matricola, email = member_keys(ricorso, submission.get("dati_utente") or {})
+    if not matricola or not email:
+        return None
+    member = await db.members.find_one({"matricola": matricola, "email": email}, {"_id": 0, "id": 1})
+    return member_token(member["id"]) if member else None
+
+
+async def record_member_document(db, member_id: Optional[str], ricorso_id: str, submission_id: str,
+                                 document_id: str, filename: str, size: int):
+    """Remember an upload as the member's latest unverified copy of a document."""
+    if not member_id:
+        return
+    await db.members.update_one({"id": member_id}, {"$set": {f"pending_documents.{document_id}": {
+        "ricorso_id": ricorso_id,
+        "submission_id": submission_id,
+        "filename": filename,
+        "size": size,
+        "uploaded_at": datetime.utcnow(),
+    }}})
+
+
+async def mark_documents_verified(db, submission: dict, reviewer: str):
+    """After an approved review, the member's copies from that submission become verified."""
+    member_id = submission.get("member_id")
+    if not member_id:
+        return
+    pending = {"$objectToArray": {"$ifNull": ["$pending_documents", {}]}}
+    from_submission = {"$eq": ["$$this.v.submission_id", {"$literal": submission["id"]}]}
+    stamp = {"verified_at": {"$literal": datetime.utcnow()}, "verified_by": {"$literal": reviewer}}
+    await db.members.update_one({"id": member_id}, [{"$set": {
+        "documents": {"$mergeObjects": [
+            {"$ifNull": ["$documents", {}]},
+            {"$arrayToObject": {"$map": {
+                "input": {"$filter": {"input": pending, "cond": from_submission}},
+                "in": {"k": "$$this.k", "v": {"$mergeObjects": ["$$this.v", stamp]}},
+            }}},
+        ]},
+        "pending_documents": {"$arrayToObject": {"$filter": {"input": pending, "cond": {"$not": [from_submission]}}}},
+    }}])
+
+
+async def find_member(db, member_id: str) -> Optional[dict]:
+    return await db.members.find_one({"id": member_id}, MEMBER_PROJECTION)
+
+
+def prefill(member: dict, ricorso: Optional[dict] = None) -> dict:
+    """Form values and reusable documents of a member, limited to `ricorso` if given."""
+    dati = member.get("dati") or {}
+    verified = list(member.get("documents") or {})
+    if ricorso is not None:
+        field_ids = {campo.get("id") for campo in ricorso.get("campi_dati", [])}
+        document_ids = {doc.get("id") for doc in ricorso.get("documenti_richiesti", [])}
+        dati = {k: v for k, v in dati.items() if k in field_ids}
+        verified = [document_id for document_id in verified if document_id in document_ids]
+    return {"dati_utente": dati, "documenti_riutilizzabili": verified}
+
+
+def link_document(source: Path, dest_dir: Path, stem: str) -> Path:
+    """Hard-link `source` as dest_dir/<stem>.<ext>, replacing other versions (copy across devices)."""
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    kind = source.suffix.lstrip(".")
+    tmp_path = dest_dir / f".{stem}.{uuid.uuid4().hex}.part"
+    try:
+        try:
+            os.link(source, tmp_path)
+        except OSError:
+            shutil.copyfile(source, tmp_path)
+        final_path = dest_dir / f"{stem}.{kind}"
+        os.replace(tmp_path, final_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    for ext in STORED_EXTENSIONS + ['jpeg']:
+        if ext != kind:
+            (dest_dir / f"{stem}.{ext}").unlink(missing_ok=True)
+    return final_path
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Literal
 from datetime import datetime
 from enum import Enum
 import uuid
@@ -35,6 +35,7 @@ class DocumentoRichiesto(BaseModel):
     label: str
     required: bool = True
     fileType: FileType = FileType.PDF
+    max_size_mb: Optional[int] = None  # Default: MAX_UPLOAD_MB
     esempio_file_url: Optional[str] = None  # URL del file di esempio
 
 
@@ -48,6 +49,11 @@ class Ricorso(BaseModel):
     attivo: bool = True
     scadenze_regioni: Optional[Dict[str, str]] = None  # {"Lazio": "2026-12-31", "Lombardia": "2026-11-30"}
     scadenza_generale: Optional[str] = None  # Scadenza di default se non specificata per regione
+    closes_at: Optional[datetime] = None  # Passata l'ultima scadenza il ricorso si disattiva (deadlines.py)
+    archive_status: Optional[str] = None  # "archiving" | "archived" (vedi archive.py)
+    archived_at: Optional[datetime] = None
+    version: int = 1  # Incrementato a ogni modifica (ETag / If-Match)
+    schema_version: Optional[str] = None  # Versione corrente di campi_dati/documenti_richiesti
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -121,6 +127,9 @@ class InviteToken(BaseModel):
     created_by: str  # username dell'admin che ha creato l'invito
     expires_at: datetime
     used: bool = False
+    # True finché l'invito è utilizzabile: un indice unico parziale ne ammette uno per email
+    active: bool = True
+    used_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 
@@ -135,11 +144,60 @@ class Token(BaseModel):
     token_type: str = "bearer"
 
 
+class ReviewStatus(str, Enum):
+    PENDING = "pending"
+    IN_REVIEW = "in_review"
+    APPROVED = "approved"
+    REJECTED = "rejected"
+
+
 class Submission(BaseModel):
     id: str = Field(default_factory=lambda: str(datetime.now().timestamp()).replace('.', ''))
     ricorso_id: str
-    ricorso_titolo: str
+    schema_version: Optional[str] = None  # Versione del form compilato (ricorso_schemas)
+    member_id: Optional[str] = None  # Socio nel registro members (per matricola)
+    import_id: Optional[str] = None  # Job di import da foglio (importer.py), None se inviata dal form
     dati_utente: Dict[str, Any]
     files_info: Dict[str, str]  # documento_id -> filename
+    files_bytes: Dict[str, int] = {}  # documento_id -> dimensione in byte
+    regione: Optional[str] = None  # Copiata da dati_utente per la worklist
+    matricola: Optional[str] = None  # Copiata (normalizzata) da dati_utente per il dedup degli import
+    missing_documents: List[str] = []  # Documenti obbligatori non ancora caricati
+    is_complete: bool = False
+    review_status: ReviewStatus = ReviewStatus.PENDING
+    reviewer: Optional[str] = None  # username di chi ha la submission in revisione
+    lease_expires_at: Optional[datetime] = None
     submitted_at: datetime = Field(default_factory=datetime.utcnow)
     reference_id: str = Field(default_factory=lambda: f"REF-{int(datetime.now().timestamp())}")
+
+
+class ReviewClaim(BaseModel):
+    ricorso_id: Optional[str] = None
+    count: int = Field(default=1, ge=1, le=20)
+
+
+class ReviewDecision(BaseModel):
+    status: Literal[ReviewStatus.APPROVED, ReviewStatus.REJECTED]
+    note: Optional[str] = None
+
+
+class JobStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+class Job(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    tipo: str  # es. "delete_ricorso"
+    params: Dict[str, Any] = {}
+    status: JobStatus = JobStatus.PENDING
+    total: int = 0
+    processed: int = 0
+    error: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    created_by: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
@@ -0,0 +1,368 @@
+"""
+Transactional outbox for outgoing email (submission receipts, admin invites).
+
+The request that creates a submission or an invite also inserts the
+message into the `outbox` collection, right after its own insert and
+keyed by (kind, source_id) so that writing it twice is harmless; it
+never talks to the mail server. A background worker claims due messages
+in batches (one atomic find_one_and_update each, so several app workers
+can share the outbox) and delivers them over a small pool of persistent
+SMTP connections. Temporary failures are retried with exponential
+backoff; permanent ones (5xx, refused recipient) and messages out of
+attempts are marked failed. Delivery is at least once: a message whose
+sender died after sending is sent again when its lease lapses. When the
+worker starts, recent submissions and invites that have no outbox entry
+(a crash between the two inserts) are queued.
+
+SMTP_HOST unset disables delivery: messages stay queued. For local
+testing any SMTP stand-in works, e.g. `python -m aiosmtpd -n -l localhost:8025`
+with SMTP_HOST=localhost SMTP_PORT=8025 SMTP_STARTTLS=false.
+"""
+import asyncio
+import logging
+import os
+import random
+import smtplib
+import uuid
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from typing import List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from members import member_keys, receipt_member_token
+
+logger = logging.getLogger(__name__)
+
+SMTP_HOST = os.environ.get("SMTP_HOST")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", 587))
+SMTP_USER = os.environ.get("SMTP_USER")
+SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD")
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "true").lower() == "true"
+SMTP_FROM = os.environ.get("SMTP_FROM", "noreply@sinafi.it")
+SMTP_TIMEOUT_SECONDS = 30
+FRONTEND_URL = os.environ.get("FRONTEND_URL", "").rstrip("/")
+
+OUTBOX_BATCH_SIZE = 50
+SMTP_POOL_SIZE = 2
+POLL_SECONDS = 10
+LEASE_SECONDS = 5 * 60
+MAX_ATTEMPTS = 8
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 6 * 3600
+RECONCILE_HOURS = 48
+SENT_RETENTION_DAYS = 90
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+_wakeup: Optional[asyncio.Event] = None
+_worker: Optional[asyncio.Task] = None
+
+
+class PermanentDeliveryError(Exception):
+    """The server rejected the message for good: retrying would not help."""
+
+
+async def ensure_outbox_indexes(db):
+    await db.outbox.create_index([("kind", 1), ("source_id", 1)], unique=True)
+    await db.outbox.create_index([("status", 1), ("next_attempt_at", 1)])
+    await db.outbox.create_index("source_id")
+    # I messaggi consegnati si tengono per un po' come traccia, poi li toglie l'indice TTL
+    await db.outbox.create_index(
+        "sent_at", expireAfterSeconds=SENT_RETENTION_DAYS * 86400,
+        partialFilterExpression={"status": SENT}
+    )
+
+
+async def enqueue(db, kind: str, source_id: str, to: Optional[str], subject: str, body: str) -> Optional[str]:
+    """Queue a message; a no-op without recipient or if already queued for this source."""
+    if not to:
+        return None
+    now = datetime.utcnow()
+    message = {
+        "id": str(uuid.uuid4()),
+        "kind": kind,
+        "source_id": source_id,
+        "to": to,
+        "subject": subject,
+        "body": body,
+        "status": PENDING,
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created_at": now,
+    }
+    try:
+        await db.outbox.insert_one(message)
+    except DuplicateKeyError:
+        return None
+    if _wakeup is not None:
+        _wakeup.set()
+    return message["id"]
+
+
+def _label(ricorso: dict, field_id: str) -> str:
+    for campo in ricorso.get("campi_dati", []):
+        if campo.get("id") == field_id:
+            return campo.get("label") or field_id
+    return field_id
+
+
+def submission_receipt(ricorso: dict, submission: dict, member_token: Optional[str] = None):
+    """(subject, body) of the receipt of a submission, with the member token if given."""
+    dati = submission.get("dati_utente") or {}
+    lines = [
+        "Gentile socio,",
+        "",
+        f"abbiamo ricevuto la tua adesione al ricorso \"{ricorso.get('titolo')}\".",
+        f"Codice di riferimento: {submission['reference_id']}",
+        "",
+        "Dati inviati:",
+    ]
+    lines += [f"  {_label(ricorso, campo.get('id'))}: {dati.get(campo.get('id'), '')}"
+              for campo in ricorso.get("campi_dati", []) if campo.get("id") in dati]
+    missing = submission.get("missing_documents") or []
+    if missing:
+        labels = {doc.get("id"): doc.get("label") for doc in ricorso.get("documenti_richiesti", [])}
+        lines += ["", "Documenti ancora da caricare:"] + [f"  - {labels.get(doc_id, doc_id)}" for doc_id in missing]
+    lines += ["", "Conserva questo codice per ogni comunicazione."]
+    if member_token:
+        lines += [
+            "",
+            "Il tuo codice socio, per precompilare le prossime adesioni e riutilizzare i documenti",
+            "già verificati. Non condividerlo: dà accesso ai tuoi dati.",
+            f"  {member_token}",
+        ]
+    lines += ["", "Si.Na.Fi."]
+    return f"Ricevuta adesione {submission['reference_id']} - {ricorso.get('titolo')}", "\n".join(lines)
+
+
+def invite_message(invite: dict):
+    """(subject, body) of an admin invite."""
+    url = f"{FRONTEND_URL}/admin/register/{invite['token']}"
+    body = "\n".join([
+        f"Ciao {invite['nome']}," if invite.get("nome") else "Ciao,",
+        "",
+        f"{invite.get('created_by')} ti ha invitato come amministratore della piattaforma ricorsi Si.Na.Fi.",
+        f"Completa la registrazione da questo link entro il {invite['expires_at']:%d/%m/%Y}:",
+        "",
+        url,
+    ])
+    return "Invito amministratore piattaforma ricorsi Si.Na.Fi.", body
+
+
+async def claim_batch(db, size: int = OUTBOX_BATCH_SIZE) -> List[dict]:
+    """Atomically claim due messages (also those whose sender died mid-batch)."""
+    claimed = []
+    for _ in range(size):
+        now = datetime.utcnow()
+        message = await db.outbox.find_one_and_update(
+            {"$or": [
+                {"status": PENDING, "next_attempt_at": {"$lte": now}},
+                {"status": SENDING, "lease_until": {"$lt": now}},
+            ]},
+            {"$set": {"status": SENDING, "lease_until": now + timedelta(seconds=LEASE_SECONDS)}},
+            sort=[("next_attempt_at", 1)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if message is None:
+            break
+        claimed.append(message)
+    return claimed
+
+
+class SMTPPool:
+    """Persistent SMTP connections, each used by one thread at a time."""
+
+    def __init__(self, size: int = SMTP_POOL_SIZE):
+        self._idle: asyncio.Queue = asyncio.Queue()
+        for _ in range(size):
+            self._idle.put_nowait(None)
+
+    @staticmethod
+    def _connect() -> smtplib.SMTP:
+        connection = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT_SECONDS)
+        if SMTP_STARTTLS:
+            connection.starttls()
+        if SMTP_USER:
+            connection.login(SMTP_USER, SMTP_PASSWORD)
+        return connection
+
+    @classmethod
+    def _send(cls, connection: Optional[smtplib.SMTP], message: dict) -> smtplib.SMTP:
+        email = EmailMessage()
+        email["From"] = SMTP_FROM
+        email["To"] = message["to"]
+        email["Subject"] = message["subject"]
+        email["Message-ID"] = f"<{message['id']}@{SMTP_FROM.split('@')[-1]}>"
+        email.set_content(message["body"])
+        for attempt in range(2):
+            if connection is None:
+                connection = cls._connect()
+            try:
+                connection.send_message(email)
+                return connection
+            except smtplib.SMTPServerDisconnected:
+                # Connessione chiusa dal server tra un batch e l'altro: riapri una volta
+                connection = None
+                if attempt:
+                    raise
+            except Exception as e:
+                # Stato della sessione incerto: si chiude, il prossimo invio riapre
+                connection.close()
+                if isinstance(e, smtplib.SMTPRecipientsRefused):
+                    raise PermanentDeliveryError(str(e.recipients))
+                if isinstance(e, smtplib.SMTPResponseException) and e.smtp_code >= 500:
+                    raise PermanentDeliveryError(f"{e.smtp_code} {e.smtp_error!r}")
+                raise
+
+    async def send(self, message: dict):
+        connection = await self._idle.get()
+        try:
+            connection = await asyncio.to_thread(self._send, connection, message)
+        except Exception:
+            connection = None
+            raise
+        finally:
+            self._idle.put_nowait(connection)
+
+    async def close(self):
+        while not self._idle.empty():
+            connection = self._idle.get_nowait()
+            if connection is not None:
+                try:
+                    await asyncio.to_thread(connection.quit)
+                except (smtplib.SMTPException, OSError):
+                    pass
+
+
+def backoff_seconds(attempts: int) -> float:
+    delay = min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+
+async def _deliver(db, pool: SMTPPool, message: dict):
+    attempts = message.get("attempts", 0) + 1
+    try:
+        await pool.send(message)
+    except Exception as e:
+        permanent = isinstance(e, PermanentDeliveryError) or attempts >= MAX_ATTEMPTS
+        await db.outbox.update_one({"id": message["id"]}, {"$set": {
+            "status": FAILED if permanent else PENDING,
+            "attempts": attempts,
+            "last_error": f"{type(e).__name__}: {e}",
+            "next_attempt_at": datetime.utcnow() + timedelta(seconds=backoff_seconds(attempts)),
+        }, "$unset": {"lease_until": ""}})
+        logger.warning(f"Mail {message['kind']} to {message['to']} failed (attempt {attempts}): {e}")
+        return
+    await db.outbox.update_one({"id": message["id"]}, {
+        "$set": {"status": SENT, "attempts": attempts, "sent_at": datetime.utcnow()},
+        "$unset": {"lease_until": "", "last_error": ""},
+    })
+
+
+async def deliver_due(db, pool: SMTPPool) -> int:
+    """Deliver one batch of due messages; returns how many were claimed."""
+    batch = await claim_batch(db)
+    await asyncio.gather(*(_deliver(db, pool, message) for message in batch))
+    return len(batch)
+
+
+async def _run(db):
+    pool = SMTPPool()
+    try:
+        try:
+            queued = await reconcile(db)
+            if queued:
+                logger.info(f"Outbox: {queued} messages queued for submissions/invites without one")
+        except Exception:
+            logger.exception("Outbox reconciliation failed")
+        while True:
+            # Prima di cercare: un enqueue durante il batch risveglia il giro successivo
+            _wakeup.clear()
+            try:
+                if await deliver_due(db, pool):
+                    continue
+            except Exception:
+                logger.exception("Outbox delivery failed")
+            try:
+                await asyncio.wait_for(_wakeup.wait(), POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        await pool.close()
+
+
+def _without_mail(match: dict, source_field: str) -> list:
+    return [
+        {"$match": match},
+        {"$lookup": {"from": "outbox", "localField": source_field, "foreignField": "source_id", "as": "mail"}},
+        {"$match": {"mail": {"$size": 0}}},
+        {"$project": {"_id": 0, "mail": 0}},
+    ]
+
+
+async def reconcile(db) -> int:
+    """Queue the messages of recent submissions and invites that have none."""
+    since = datetime.utcnow() - timedelta(hours=RECONCILE_HOURS)
+    queued = 0
+    async for invite in db.invite_tokens.aggregate(
+        _without_mail({"created_at": {"$gte": since}, "active": True}, "token")
+    ):
+        queued += bool(await enqueue(db, "admin_invite", invite["token"], invite["email"], *invite_message(invite)))
+
+    ricorsi = {}
+    async for submission in db.submissions.aggregate(_without_mail({"submitted_at": {"$gte": since}, "import_id": None}, "id")):
+        ricorso_id = submission["ricorso_id"]
+        if ricorso_id not in ricorsi:
+            ricorsi[ricorso_id] = await db.ricorsi.find_one({"id": ricorso_id}, {"_id": 0})
+        ricorso = ricorsi[ricorso_id]
+        if not ricorso:
+            continue
+        _, email = member_keys(ricorso, submission.get("dati_utente") or {})
+        token = await receipt_member_token(db, ricorso, submission)
+        queued += bool(await enqueue(
+            db, "submission_receipt", submission["id"], email, *submission_receipt(ricorso, submission, token)
+        ))
+    return queued
+
+
+def start_notification_worker(db):
+    global _wakeup, _worker
+    _wakeup = asyncio.Event()
+    if not SMTP_HOST:
+        logger.info("SMTP_HOST not set: outgoing mail stays queued in the outbox")
+        return
+    _worker = asyncio.create_task(_run(db))
+
+
+async def stop_notification_worker():
+    if _worker is not None:
+        _worker.cancel()
+        await asyncio.gather(_worker, return_exceptions=True)
+
+
+async def outbox_summary(db, limit: int = 50) -> dict:
+    counts = await db.outbox.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]).to_list(None)
+    failed = await db.outbox.find(
+        {"status": FAILED}, {"_id": 0, "body": 0}
+    ).sort("next_attempt_at", -1).limit(limit).to_list(limit)
+    return {
+        "counts": {status: 0 for status in (PENDING, SENDING, SENT, FAILED)} | {row["_id"]: row["count"] for row in counts},
+        "failed": failed,
+    }
+
+
+async def retry(db, message_id: str) -> bool:
+    """Put a failed message back in the queue, with fresh attempts."""
+    result = await db.outbox.update_one(
+        {"id": message_id, "status": FAILED},
+        {"$set": {"status": PENDING, "attempts": 0, "next_attempt_at": datetime.utcnow()}}
+    )
+    if result.modified_count and _wakeup is not None:
+        _wakeup.set()
+    return result.modified_count == 1
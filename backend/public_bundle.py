@@ -0,0 +1,247 @@
+"""
+Static prerendered bundle of the active ricorsi, for nginx or a CDN.
+
+Every ricorso mutation asks the publisher for a new bundle. The publisher
+coalesces bursts, reads the active ricorsi once and writes a new version
+directory next to the previous ones:
+
+    PUBLIC_DIR/bundles/<version>/ricorsi.json[.gz|.br]        GET /api/ricorsi?attivo=true
+    PUBLIC_DIR/bundles/<version>/ricorsi/<id>.json[.gz|.br]   GET /api/ricorsi/{id}
+    PUBLIC_DIR/bundles/<version>/manifest.json
+    PUBLIC_DIR/files/<sha256>.<ext>                           sample files, immutable
+    PUBLIC_DIR/latest -> bundles/<version>
+
+The JSON is precompressed once (gzip_static / brotli_static) and the
+ricorsi point their esempio_file_url at the hashed copies, which can be
+cached forever. `latest` is a symlink replaced atomically with
+os.replace, so a reader sees either the old or the new bundle, never a
+half-written one. An nginx setup serving the public form without Python:
+
+    gzip_static on; brotli_static on;
+    location = /api/ricorsi {
+        if ($arg_attivo = "true") { rewrite ^ /public/latest/ricorsi.json last; }
+        proxy_pass http://backend;
+    }
+    location ~ ^/api/ricorsi/([^/]+)$ { try_files /public/latest/ricorsi/$1.json @backend; }
+    location /public/files/ { expires max; }
+
+Usage: python public_bundle.py (publishes once)
+"""
+import asyncio
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import brotli
+import orjson
+
+from file_access import find_document_file
+from models import Ricorso
+
+logger = logging.getLogger(__name__)
+
+PUBLIC_BUNDLE_URL = os.environ.get("PUBLIC_BUNDLE_URL", "/public").rstrip("/")
+BUNDLE_KEEP = 3
+PUBLISH_DEBOUNCE_SECONDS = 0.5
+MANIFEST_FILE = "manifest.json"
+LATEST = "latest"
+
+# Come ORJSONResponse, così i file sono identici alle risposte dell'API
+JSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+_pending: Optional[asyncio.Event] = None
+_publisher: Optional[asyncio.Task] = None
+# (path, mtime_ns, size) -> sha256, per non rileggere i file di esempio invariati
+_file_hashes: Dict[tuple, str] = {}
+
+
+def _file_hash(path: Path) -> str:
+    stat = os.stat(path)
+    key = (str(path), stat.st_mtime_ns, stat.st_size)
+    if key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+                digest.update(chunk)
+        _file_hashes[key] = digest.hexdigest()
+    return _file_hashes[key]
+
+
+def _write_compressed(path: Path, data: bytes):
+    """Write data as path, path.gz and path.br."""
+    path.write_bytes(data)
+    path.with_name(path.name + ".gz").write_bytes(gzip.compress(data, compresslevel=9, mtime=0))
+    path.with_name(path.name + ".br").write_bytes(brotli.compress(data, quality=11))
+
+
+def _publish_sample(public_dir: Path, source: Path) -> str:
+    """Content-addressed copy of a sample file; returns its name under files/."""
+    name = f"{_file_hash(source)[:32]}{source.suffix.lower()}"
+    dest = public_dir / "files" / name
+    if not dest.exists():
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = dest.with_name(f".{name}.{uuid.uuid4().hex}.part")
+        try:
+            try:
+                os.link(source, tmp_path)
+            except OSError:
+                shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, dest)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+    return name
+
+
+def current_version(public_dir: Path) -> Optional[str]:
+    try:
+        return os.readlink(public_dir / LATEST).rsplit("/", 1)[-1]
+    except OSError:
+        return None
+
+
+def read_manifest(public_dir: Path) -> Optional[dict]:
+    try:
+        return orjson.loads((public_dir / LATEST / MANIFEST_FILE).read_bytes())
+    except FileNotFoundError:
+        return None
+
+
+def write_bundle(public_dir: Path, examples_dir: Path, ricorsi: List[dict]) -> Optional[str]:
+    """Write a bundle for `ricorsi` and point `latest` at it; None if nothing changed."""
+    files = {}
+    for ricorso in ricorsi:
+        for documento in ricorso.get("documenti_richiesti", []):
+            if not documento.get("esempio_file_url"):
+                continue
+            source = find_document_file(examples_dir / ricorso["id"], f"{documento['id']}_esempio")
+            if source is not None:
+                name = _publish_sample(public_dir, source)
+                files[f"{ricorso['id']}/{documento['id']}"] = name
+                documento["esempio_file_url"] = f"{PUBLIC_BUNDLE_URL}/files/{name}"
+
+    listing = orjson.dumps(ricorsi, option=JSON_OPTIONS)
+    details = {
+        ricorso["id"]: orjson.dumps(Ricorso(**ricorso).dict(), option=JSON_OPTIONS) for ricorso in ricorsi
+    }
+    digest = hashlib.sha256(listing)
+    for ricorso_id in sorted(details):
+        digest.update(details[ricorso_id])
+    content_hash = digest.hexdigest()[:12]
+    latest = current_version(public_dir)
+    if latest and latest.endswith(content_hash):
+        return None
+
+    bundles_dir = public_dir / "bundles"
+    version = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{content_hash}"
+    tmp_dir = bundles_dir / f".{version}.part"
+    (tmp_dir / "ricorsi").mkdir(parents=True)
+    try:
+        _write_compressed(tmp_dir / "ricorsi.json", listing)
+        for ricorso_id, data in details.items():
+            _write_compressed(tmp_dir / "ricorsi" / f"{ricorso_id}.json", data)
+        (tmp_dir / MANIFEST_FILE).write_bytes(orjson.dumps({
+            "version": version,
+            "generated_at": datetime.utcnow(),
+            "ricorsi": list(details),
+            "files": files,
+        }, option=JSON_OPTIONS))
+        os.rename(tmp_dir, bundles_dir / version)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    # Symlink nuovo accanto al vecchio, poi rename atomico sopra "latest"
+    tmp_link = public_dir / f".{LATEST}.{uuid.uuid4().hex}"
+    os.symlink(f"bundles/{version}", tmp_link)
+    os.replace(tmp_link, public_dir / LATEST)
+    _prune(public_dir)
+    return version
+
+
+def _prune(public_dir: Path):
+    """Keep the newest BUNDLE_KEEP versions and the sample files they use."""
+    bundles_dir = public_dir / "bundles"
+    versions = sorted(p.name for p in bundles_dir.iterdir() if not p.name.startswith("."))
+    latest = current_version(public_dir)
+    kept = set(versions[-BUNDLE_KEEP:]) | {latest}
+    for name in versions:
+        if name not in kept:
+            shutil.rmtree(bundles_dir / name, ignore_errors=True)
+
+    referenced = set()
+    for name in kept:
+        try:
+            manifest = orjson.loads((bundles_dir / name / MANIFEST_FILE).read_bytes())
+        except FileNotFoundError:
+            continue
+        referenced.update(manifest["files"].values())
+    files_dir = public_dir / "files"
+    if files_dir.is_dir():
+        for path in files_dir.iterdir():
+            if path.name not in referenced and not path.name.startswith("."):
+                path.unlink(missing_ok=True)
+
+
+async def publish(db, public_dir: Path, examples_dir: Path) -> Optional[str]:
+    """Build a bundle of the active ricorsi (same query as GET /ricorsi?attivo=true)."""
+    ricorsi = await db.ricorsi.find(
+        {"deleted_at": None, "attivo": True}, {"_id": 0}
+    ).sort("created_at", -1).limit(100).to_list(100)
+    version = await asyncio.to_thread(write_bundle, public_dir, examples_dir, ricorsi)
+    if version:
+        logger.info(f"Public bundle {version} published ({len(ricorsi)} ricorsi)")
+    return version
+
+
+def request_publish():
+    """Ask for a new bundle; bursts of mutations produce a single one."""
+    if _pending is not None:
+        _pending.set()
+
+
+async def _run(db, public_dir: Path, examples_dir: Path):
+    while True:
+        await _pending.wait()
+        await asyncio.sleep(PUBLISH_DEBOUNCE_SECONDS)
+        _pending.clear()
+        try:
+            await publish(db, public_dir, examples_dir)
+        except Exception:
+            logger.exception("Public bundle publishing failed")
+
+
+def start_publisher(db, public_dir: Path, examples_dir: Path):
+    global _pending, _publisher
+    _pending = asyncio.Event()
+    _publisher = asyncio.create_task(_run(db, public_dir, examples_dir))
+    request_publish()
+
+
+async def stop_publisher():
+    if _publisher is not None:
+        _publisher.cancel()
+        await asyncio.gather(_publisher, return_exceptions=True)
+
+
+async def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    root_dir = Path(__file__).parent
+    load_dotenv(root_dir / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        version = await publish(client[os.environ['DB_NAME']], root_dir / 'public', root_dir / 'examples')
+        print(version or "Bundle già aggiornato")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
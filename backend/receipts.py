@@ -0,0 +1,189 @@
+"""
+PDF proof of submission for members.
+
+A receipt lists the reference_id, the data the member entered (with the
+field labels of the schema version they filled in) and the documents
+received so far. It is rendered once and stored next to the uploads as
+_receipt.<fingerprint>.pdf, encrypted like them. The fingerprint is a hash
+of what a receipt can change with after submission (files_info), so an
+upload makes the stored copy stale without any explicit invalidation; it
+is also the ETag, which lets a repeat download end in a 304 before any
+file is touched.
+
+Renders run on a small dedicated thread pool, so a deadline-day rush of
+first downloads cannot starve the default executor used by uploads, and
+concurrent requests for the same receipt share one render.
+
+The PDF is written directly (A4, standard Helvetica, WinAnsi text): a
+receipt is a page of plain text and needs no layout engine.
+"""
+import asyncio
+import hashlib
+import os
+import textwrap
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import orjson
+
+from encryption import EncryptedWriter, StoredFile, encryption_enabled
+from singleflight import single_flight
+
+RECEIPT_STEM = "_receipt"
+RECEIPT_WORKERS = 2
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in punti
+MARGIN = 56
+FONT_SIZE = 10
+LEADING = 14
+# Caratteri per riga di Helvetica 10pt nella larghezza utile (stima prudente)
+WRAP_WIDTH = 90
+
+_executor = ThreadPoolExecutor(max_workers=RECEIPT_WORKERS, thread_name_prefix="receipt")
+
+
+def receipt_fingerprint(submission: dict) -> str:
+    content = orjson.dumps(
+        [submission.get("reference_id"), submission.get("files_info") or {}], option=orjson.OPT_SORT_KEYS
+    )
+    return hashlib.sha256(content).hexdigest()[:20]
+
+
+def receipt_etag(submission: dict) -> str:
+    return f'"{receipt_fingerprint(submission)}"'
+
+
+def receipt_path(directory: Path, submission: dict) -> Path:
+    return directory / f"{RECEIPT_STEM}.{receipt_fingerprint(submission)}.pdf"
+
+
+def _pdf_text(text: str) -> bytes:
+    data = text.encode("cp1252", errors="replace")
+    return data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+def _receipt_lines(submission: dict, titolo: str, schema: dict) -> List[Tuple[str, str]]:
+    """(font, text) lines of the receipt; font is "F1" (regular) or "F2" (bold)."""
+    dati = submission.get("dati_utente") or {}
+    files_info = submission.get("files_info") or {}
+    submitted_at = submission.get("submitted_at")
+    lines = [
+        ("F2", "Ricevuta di adesione"),
+        ("F1", ""),
+        ("F1", f"Ricorso: {titolo}"),
+        ("F1", f"Codice di riferimento: {submission['reference_id']}"),
+    ]
+    if isinstance(submitted_at, datetime):
+        lines.append(("F1", f"Data di invio: {submitted_at:%d/%m/%Y %H:%M} UTC"))
+
+    lines += [("F1", ""), ("F2", "Dati inseriti")]
+    for campo in schema.get("campi_dati", []):
+        if campo.get("id") in dati:
+            lines.append(("F1", f"{campo.get('label') or campo['id']}: {dati[campo['id']]}"))
+
+    lines += [("F1", ""), ("F2", "Documenti ricevuti")]
+    documenti = schema.get("documenti_richiesti", [])
+    received = [doc for doc in documenti if doc.get("id") in files_info]
+    if received:
+        lines += [("F1", f"- {doc.get('label') or doc['id']}: {files_info[doc['id']]}") for doc in received]
+    else:
+        lines.append(("F1", "Nessun documento ricevuto"))
+    missing = [doc for doc in documenti if doc.get("required", True) and doc.get("id") not in files_info]
+    if missing:
+        lines += [("F1", ""), ("F2", "Documenti ancora da caricare")]
+        lines += [("F1", f"- {doc.get('label') or doc['id']}") for doc in missing]
+
+    lines += [
+        ("F1", ""),
+        ("F1", "Conserva questa ricevuta e il codice di riferimento per ogni comunicazione."),
+        ("F1", f"Documento generato il {datetime.utcnow():%d/%m/%Y %H:%M} UTC - Si.Na.Fi."),
+    ]
+    wrapped = []
+    for font, text in lines:
+        for part in textwrap.wrap(text, WRAP_WIDTH) or [""]:
+            wrapped.append((font, part))
+    return wrapped
+
+
+def render_receipt(submission: dict, titolo: str, schema: dict) -> bytes:
+    """The receipt as PDF bytes."""
+    lines = _receipt_lines(submission, titolo, schema)
+    per_page = (PAGE_HEIGHT - 2 * MARGIN) // LEADING
+    pages = [lines[i:i + per_page] for i in range(0, len(lines), per_page)]
+
+    streams = []
+    for page_lines in pages:
+        ops = [b"BT", b"%d TL" % LEADING, b"%d %d Td" % (MARGIN, PAGE_HEIGHT - MARGIN)]
+        for font, text in page_lines:
+            ops.append(b"/%s %d Tf (%s) '" % (font.encode(), FONT_SIZE, _pdf_text(text)))
+        ops.append(b"ET")
+        streams.append(b"\n".join(ops))
+
+    # Oggetti: 1 catalogo, 2 albero delle pagine, 3-4 font, poi pagina + contenuto per ogni pagina
+    page_ids = [5 + 2 * i for i in range(len(pages))]
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % i for i in page_ids), len(pages)),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+    ]
+    for page_id, stream in zip(page_ids, streams):
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> >>" % (PAGE_WIDTH, PAGE_HEIGHT, page_id + 1)
+        )
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def _store_receipt(path: Path, data: bytes):
+    """Write the receipt atomically and drop the stale ones of the same submission."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.part")
+    try:
+        fh = open(tmp_path, "wb")
+        if encryption_enabled():
+            fh = EncryptedWriter(fh)
+        fh.write(data)
+        fh.close()
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    for old in path.parent.glob(f"{RECEIPT_STEM}.*.pdf"):
+        if old != path:
+            old.unlink(missing_ok=True)
+
+
+def _load_or_render(path: Path, submission: dict, titolo: str, schema: dict) -> bytes:
+    try:
+        return StoredFile(path).read()
+    except FileNotFoundError:
+        pass
+    data = render_receipt(submission, titolo, schema)
+    _store_receipt(path, data)
+    return data
+
+
+async def load_receipt(directory: Path, submission: dict, titolo: str, schema: Optional[dict]) -> bytes:
+    """PDF bytes of the current receipt, rendered on the receipt pool if not stored yet."""
+    path = receipt_path(directory, submission)
+
+    async def render():
+        return await asyncio.get_running_loop().run_in_executor(
+            _executor, _load_or_render, path, submission, titolo, schema or {}
+        )
+
+    return await single_flight(("receipt", str(path)), render)
@@ -0,0 +1,176 @@
+"""
+Review queue over submissions, shared by several reviewers.
+
+A claim reads the ids of the oldest CLAIM_WINDOW pending submissions,
+picks `count` of them at random and takes them with one update_many that
+flips review_status to in_review and stamps the reviewer, a lease expiry
+and a claim token, all conditional on the submission still being
+pending. The documents carrying the token are the ones won, so two
+reviewers can never get the same submission. Random picks spread
+concurrent reviewers over the head of the queue instead of all racing
+for its first document; a reviewer that loses some picks tries again on
+a fresh window. Leases that lapse without a decision are put back in the
+queue by a periodic sweep, keeping their place by submitted_at, and
+count as lost from the moment they lapse.
+"""
+import asyncio
+import logging
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from pymongo import ReturnDocument
+
+from models import ReviewStatus
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = 15 * 60
+MAX_CLAIM = 20
+CLAIM_WINDOW = 100
+CLAIM_ATTEMPTS = 5
+SWEEP_SECONDS = 30
+
+REVIEW_PROJECTION = {
+    "_id": 0, "id": 1, "ricorso_id": 1, "member_id": 1, "reference_id": 1, "dati_utente": 1,
+    "files_info": 1, "missing_documents": 1, "submitted_at": 1,
+    "review_status": 1, "reviewer": 1, "lease_expires_at": 1,
+}
+
+_sweeper: Optional[asyncio.Task] = None
+
+
+async def ensure_review_indexes(db):
+    # Coda: pending in ordine di arrivo, per ricorso o globale
+    await db.submissions.create_index([("review_status", 1), ("ricorso_id", 1), ("submitted_at", 1)])
+    await db.submissions.create_index([("review_status", 1), ("submitted_at", 1)])
+    # Rilettura delle submission vinte da un claim
+    await db.submissions.create_index("claim_token", sparse=True)
+    # Sweep dei lease scaduti
+    await db.submissions.create_index(
+        [("lease_expires_at", 1)], partialFilterExpression={"review_status": ReviewStatus.IN_REVIEW.value}
+    )
+    await db.submissions.update_many(
+        {"review_status": {"$exists": False}}, {"$set": {"review_status": ReviewStatus.PENDING.value}}
+    )
+
+
+async def claim(db, reviewer: str, count: int = 1, ricorso_id: Optional[str] = None,
+                lease_seconds: int = LEASE_SECONDS) -> List[dict]:
+    """Atomically claim up to `count` pending submissions from the head of the queue."""
+    query = {"review_status": ReviewStatus.PENDING.value}
+    if ricorso_id:
+        query["ricorso_id"] = ricorso_id
+    count = min(count, MAX_CLAIM)
+    token = str(uuid.uuid4())
+    won = 0
+    for _ in range(CLAIM_ATTEMPTS):
+        window = await db.submissions.find(query, {"_id": 0, "id": 1}).sort("submitted_at", 1).to_list(CLAIM_WINDOW)
+        if not window:
+            break
+        picks = random.sample([doc["id"] for doc in window], min(count - won, len(window)))
+        now = datetime.utcnow()
+        result = await db.submissions.update_many(
+            {**query, "id": {"$in": picks}},
+            {"$set": {
+                "review_status": ReviewStatus.IN_REVIEW.value,
+                "reviewer": reviewer,
+                "claimed_at": now,
+                "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                "claim_token": token,
+            }}
+        )
+        won += result.modified_count
+        if won >= count:
+            break
+    if not won:
+        return []
+    return await db.submissions.find(
+        {"claim_token": token}, REVIEW_PROJECTION
+    ).sort("submitted_at", 1).to_list(won)
+
+
+def _held_by(submission_id: str, reviewer: str) -> dict:
+    # Un lease scaduto non vale più, anche prima che lo sweep lo rimetta in coda
+    return {
+        "id": submission_id, "review_status": ReviewStatus.IN_REVIEW.value, "reviewer": reviewer,
+        "lease_expires_at": {"$gt": datetime.utcnow()},
+    }
+
+
+async def renew(db, submission_id: str, reviewer: str, lease_seconds: int = LEASE_SECONDS) -> Optional[dict]:
+    """Extend a lease still held by `reviewer`."""
+    return await db.submissions.find_one_and_update(
+        _held_by(submission_id, reviewer),
+        {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=lease_seconds)}},
+        projection=REVIEW_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def decide(db, submission_id: str, reviewer: str, status: ReviewStatus,
+                 note: Optional[str] = None) -> Optional[dict]:
+    """Record the decision on a submission held by `reviewer` and end the lease."""
+    return await db.submissions.find_one_and_update(
+        _held_by(submission_id, reviewer),
+        {"$set": {
+            "review_status": status.value,
+            "review_note": note,
+            "reviewed_at": datetime.utcnow(),
+            "lease_expires_at": None,
+        }},
+        projection=REVIEW_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def release(db, submission_id: str, reviewer: str) -> bool:
+    """Give a claimed submission back to the queue."""
+    result = await db.submissions.update_one(
+        _held_by(submission_id, reviewer),
+        {"$set": {"review_status": ReviewStatus.PENDING.value, "reviewer": None, "lease_expires_at": None}}
+    )
+    return result.modified_count == 1
+
+
+async def reclaim_lapsed(db) -> int:
+    """Put submissions whose lease has expired back in the queue."""
+    result = await db.submissions.update_many(
+        {"review_status": ReviewStatus.IN_REVIEW.value, "lease_expires_at": {"$lt": datetime.utcnow()}},
+        {"$set": {"review_status": ReviewStatus.PENDING.value, "reviewer": None, "lease_expires_at": None}}
+    )
+    return result.modified_count
+
+
+async def queue_summary(db, ricorso_id: str) -> dict:
+    counts = await db.submissions.aggregate([
+        {"$match": {"ricorso_id": ricorso_id}},
+        {"$group": {"_id": "$review_status", "count": {"$sum": 1}}},
+    ]).to_list(None)
+    summary = {status.value: 0 for status in ReviewStatus}
+    for row in counts:
+        summary[row["_id"] or ReviewStatus.PENDING.value] += row["count"]
+    return {"ricorso_id": ricorso_id, **summary}
+
+
+async def _sweep_forever(db):
+    while True:
+        await asyncio.sleep(SWEEP_SECONDS)
+        try:
+            reclaimed = await reclaim_lapsed(db)
+            if reclaimed:
+                logger.info(f"Review queue: {reclaimed} lapsed leases reclaimed")
+        except Exception:
+            logger.exception("Review lease sweep failed")
+
+
+def start_lease_sweeper(db):
+    global _sweeper
+    _sweeper = asyncio.create_task(_sweep_forever(db))
+
+
+async def stop_lease_sweeper():
+    if _sweeper is not None:
+        _sweeper.cancel()
+        await asyncio.gather(_sweeper, return_exceptions=True)
@@ -0,0 +1,89 @@
+"""
+Immutable, content-hashed versions of a ricorso's form definition.
+
+A schema version holds `campi_dati` and `documenti_richiesti` as they were
+when a member filled in the form. It is stored once in `ricorso_schemas`
+under the hash of its content; submissions reference it by id, so old
+submissions are always read with the field definitions they were filled
+against, even after the ricorso is edited.
+"""
+import hashlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+import orjson
+
+SCHEMA_CACHE_SIZE = 1024
+
+# Non fa parte della definizione del form: cambia a ogni upload dell'esempio
+_PRESENTATION_FIELDS = {"esempio_file_url"}
+
+_cache: "OrderedDict[str, dict]" = OrderedDict()
+
+
+def _schema_content(ricorso: dict) -> dict:
+    return {
+        "campi_dati": ricorso.get("campi_dati") or [],
+        "documenti_richiesti": [
+            {k: v for k, v in doc.items() if k not in _PRESENTATION_FIELDS}
+            for doc in ricorso.get("documenti_richiesti") or []
+        ],
+    }
+
+
+def schema_version_id(ricorso: dict) -> str:
+    """Content hash of the ricorso's form definition."""
+    content = orjson.dumps(_schema_content(ricorso), option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(content).hexdigest()[:32]
+
+
+def _remember(schema: dict):
+    _cache[schema["id"]] = schema
+    _cache.move_to_end(schema["id"])
+    while len(_cache) > SCHEMA_CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+async def ensure_schema_version(db, ricorso: dict) -> str:
+    """Store the current form definition of `ricorso` (once) and return its id."""
+    version_id = schema_version_id(ricorso)
+    if version_id not in _cache:
+        schema = {"id": version_id, **_schema_content(ricorso)}
+        await db.ricorso_schemas.update_one(
+            {"id": version_id},
+            {"$setOnInsert": {**schema, "ricorso_id": ricorso.get("id"), "created_at": datetime.utcnow()}},
+            upsert=True
+        )
+        _remember(schema)
+    return version_id
+
+
+async def get_schemas(db, version_ids: Iterable[str]) -> Dict[str, dict]:
+    """Schemas by id, from the in-memory cache or one batched query."""
+    wanted = {v for v in version_ids if v}
+    found = {v: _cache[v] for v in wanted if v in _cache}
+    missing = list(wanted - found.keys())
+    if missing:
+        docs = await db.ricorso_schemas.find(
+            {"id": {"$in": missing}},
+            {"_id": 0, "id": 1, "campi_dati": 1, "documenti_richiesti": 1}
+        ).to_list(len(missing))
+        for doc in docs:
+            _remember(doc)
+            found[doc["id"]] = doc
+    return found
+
+
+async def get_schema(db, version_id: Optional[str]) -> Optional[dict]:
+    if not version_id:
+        return None
+    return (await get_schemas(db, [version_id])).get(version_id)
+
+
+def regione_field_id(schema: dict) -> Optional[str]:
+    """Id of the region field in a form definition, if any."""
+    for campo in schema.get("campi_dati", []):
+        if campo.get("label", "").lower() == "regione" or campo.get("id") == "regione":
+            return campo.get("id")
+    return None
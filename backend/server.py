@@ -1,21 +1,69 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Form, Header, Request, Response
+from fastapi.responses import FileResponse, ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
 import os
 import logging
 from pathlib import Path
 from typing import List, Optional
 from datetime import datetime, timedelta
-import shutil
+import asyncio
+import base64
 import json
 import uuid
 
 from models import (
     Ricorso, RicorsoCreate, RicorsoUpdate, Admin, AdminLogin, AdminCreate,
-    Token, Submission, CampoData, DocumentoRichiesto, AdminCreateManual,
-    AdminInvite, InviteToken, AdminRegisterWithToken
+    Token, Submission, CampoData, DocumentoRichiesto, FileType, AdminCreateManual,
+    AdminInvite, InviteToken, AdminRegisterWithToken, ReviewClaim, ReviewDecision, ReviewStatus, JobStatus
+)
+from jobs import create_job, update_job, add_progress, get_job, find_unfinished_jobs, start_job
+from deletion import cascade_delete_ricorso
+from janitor import run_janitor
+from archive import load_archived_submissions, find_archived_submission, archived_upload_dir
+from upload_guard import (
+    receive_upload, document_limit, MAX_SUBMISSION_MB, MB, ALLOWED_KINDS, SPREADSHEET_KINDS
+)
+from importer import import_submissions, IMPORT_MAX_MB
+from schemas import ensure_schema_version, schema_version_id, get_schemas, get_schema, regione_field_id
+from analytics import submission_analytics
+from thumbnails import (
+    invalidate_thumbnail, schedule_thumbnail, load_thumbnails, backfill_thumbnails,
+    start_thumbnail_workers, stop_thumbnail_workers
+)
+from members import (
+    ensure_member_indexes, upsert_member, record_member_document, mark_documents_verified,
+    find_member, prefill, link_document, member_keys, verify_member_token, receipt_member_token,
+    backfill_submission_matricole
+)
+from review import (
+    ensure_review_indexes, claim, renew, decide, release, queue_summary,
+    start_lease_sweeper, stop_lease_sweeper
+)
+from budgets import QueryBudgetMiddleware, budget_metrics, DEFAULT_BUDGET_MS
+from slowlog import slow_query_listener, slow_queries, start_slow_query_log, stop_slow_query_log
+from singleflight import single_flight, single_flight_stats
+from compression import CompressionMiddleware, compression_metrics
+from notifications import (
+    ensure_outbox_indexes, enqueue, submission_receipt, invite_message, outbox_summary, retry,
+    start_notification_worker, stop_notification_worker
+)
+from receipts import load_receipt, receipt_etag, RECEIPT_STEM
+from deadlines import (
+    normalize_deadlines, closing_time, deadline_table, cached_closure, closed_message, forget,
+    parse_deadline, start_deadline_scheduler, stop_deadline_scheduler
+)
+from public_bundle import start_publisher, stop_publisher, request_publish, read_manifest
+from audit import record, ensure_audit_indexes, start_audit_writer, stop_audit_writer, query_audit
+from completeness import (
+    required_document_ids, upload_update_pipeline, backfill_completeness, incomplete_worklist
+)
+from file_access import (
+    find_document_file, sign_document_url, sign_receipt_url, verify_document_signature, range_file_response,
+    SIGNED_URL_TTL_SECONDS
 )
 from auth import (
     verify_password, get_password_hash, create_access_token, verify_token,
@@ -27,7 +75,8 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# Il listener misura ogni comando per il log delle query lente (slowlog.py)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[slow_query_listener])
 db = client[os.environ['DB_NAME']]
 
 # Uploads directory
@@ -38,6 +87,21 @@ UPLOADS_DIR.mkdir(exist_ok=True)
 EXAMPLES_DIR = ROOT_DIR / 'examples'
 EXAMPLES_DIR.mkdir(exist_ok=True)
 
+# Archive directory (submissions of closed ricorsi, see archive.py)
+ARCHIVE_DIR = ROOT_DIR / 'archive'
+ARCHIVE_DIR.mkdir(exist_ok=True)
+
+# Public bundle (static copy of the active ricorsi, see public_bundle.py)
+PUBLIC_DIR = ROOT_DIR / 'public'
+PUBLIC_DIR.mkdir(exist_ok=True)
+
+# Spreadsheets being imported (see importer.py), removed when the import ends
+IMPORTS_DIR = ROOT_DIR / 'imports'
+IMPORTS_DIR.mkdir(exist_ok=True)
+
+# Rotating JSONL of the slow queries (see slowlog.py)
+LOGS_DIR = ROOT_DIR / 'logs'
+
 # Create the main app
 app = FastAPI()
 
@@ -51,21 +115,36 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# I ricorsi in cancellazione restano in DB finché il job non ha finito:
+# {"deleted_at": None} corrisponde anche ai documenti senza il campo
+NOT_DELETED = {"deleted_at": None}
+
+
+# Giorni di conservazione di un invito dopo la scadenza, poi l'indice TTL lo rimuove
+INVITE_RETENTION_DAYS = 30
+
 
 # ============= ADMIN ROUTES =============
 
+def _duplicate_admin_error(e: DuplicateKeyError) -> HTTPException:
+    """Map a violation of the unique indexes on admins to a 400."""
+    key = next(iter((e.details or {}).get("keyPattern") or {}), None)
+    if key == "email":
+        return HTTPException(status_code=400, detail="Email già utilizzata")
+    return HTTPException(status_code=400, detail="Username già esistente")
+
+
 @api_router.post("/admin/register", response_model=dict)
 async def register_admin(admin: AdminCreate):
     """Register a new admin (first time only)"""
-    existing = await db.admins.find_one({"username": admin.username}, {"_id": 0})
-    if existing:
-        raise HTTPException(status_code=400, detail="Username already exists")
-    
     admin_dict = {
         "username": admin.username,
         "password_hash": get_password_hash(admin.password)
     }
-    await db.admins.insert_one(admin_dict)
+    try:
+        await db.admins.insert_one(admin_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Username already exists")
     return {"message": "Admin created successfully"}
 
 
@@ -96,16 +175,7 @@ async def check_admin(username: str = Depends(verify_token)):
 @api_router.post("/admin/create-manual")
 async def create_admin_manual(admin_data: AdminCreateManual, username: str = Depends(verify_token)):
     """Create a new admin manually (admin only)"""
-    # Check if username already exists
-    existing = await db.admins.find_one({"username": admin_data.username})
-    if existing:
-        raise HTTPException(status_code=400, detail="Username già esistente")
-    
-    # Check if email already exists
-    existing_email = await db.admins.find_one({"email": admin_data.email})
-    if existing_email:
-        raise HTTPException(status_code=400, detail="Email già utilizzata")
-    
+    # Username and email uniqueness are enforced by the unique indexes
     admin_dict = {
         "id": str(uuid.uuid4()),
         "username": admin_data.username,
@@ -117,10 +187,15 @@ async def create_admin_manual(admin_data: AdminCreateManual, username: str = Dep
         "created_by": username,
         "created_at": datetime.utcnow()
     }
-    await db.admins.insert_one(admin_dict)
+    try:
+        await db.admins.insert_one(admin_dict)
+    except DuplicateKeyError as e:
+        raise _duplicate_admin_error(e)
+    record(username, "admin.create", "admin", admin_dict["id"], username=admin_data.username)
     
     # Return admin without password
     del admin_dict["password_hash"]
+    admin_dict.pop("_id", None)
     return {"message": "Admin creato con successo", "admin": admin_dict}
 
 
@@ -132,19 +207,16 @@ async def create_invite(invite_data: AdminInvite, username: str = Depends(verify
     if existing_email:
         raise HTTPException(status_code=400, detail="Email già utilizzata da un admin esistente")
     
-    # Check if there's already an active invite for this email
-    existing_invite = await db.invite_tokens.find_one({
-        "email": invite_data.email,
-        "used": False,
-        "expires_at": {"$gt": datetime.utcnow()}
-    })
-    if existing_invite:
-        raise HTTPException(status_code=400, detail="Esiste già un invito attivo per questa email")
+    # Expired invites no longer count as active: the partial unique index
+    # on (email, active) then admits at most one usable invite per email
+    await db.invite_tokens.update_many(
+        {"email": invite_data.email, "active": True, "expires_at": {"$lte": datetime.utcnow()}},
+        {"$set": {"active": False}}
+    )
     
     # Create invite token (expires in 7 days)
-    import uuid as uuid_lib
     invite = InviteToken(
-        token=str(uuid_lib.uuid4()),
+        token=str(uuid.uuid4()),
         email=invite_data.email,
         nome=invite_data.nome,
         cognome=invite_data.cognome,
@@ -152,7 +224,13 @@ async def create_invite(invite_data: AdminInvite, username: str = Depends(verify
         expires_at=datetime.utcnow() + timedelta(days=7)
     )
     
-    await db.invite_tokens.insert_one(invite.dict())
+    try:
+        await db.invite_tokens.insert_one(invite.dict())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Esiste già un invito attivo per questa email")
+    record(username, "invite.create", "invite", invite.email, expires_at=invite.expires_at)
+    # L'email parte dal worker dell'outbox: la richiesta non aspetta il server di posta
+    await enqueue(db, "admin_invite", invite.token, invite.email, *invite_message(invite.dict()))
     
     # Generate invite URL (frontend will use this)
     invite_url = f"/admin/register/{invite.token}"
@@ -190,28 +268,29 @@ async def validate_invite(token: str):
 
 @api_router.post("/admin/register-with-invite")
 async def register_admin_with_invite(registration: AdminRegisterWithToken):
-    """Register as admin using an invite token (public endpoint)"""
-    # Validate token
-    invite = await db.invite_tokens.find_one({"token": registration.token})
-    
+    """Register as admin using an invite token (public endpoint)
+
+    The invite is claimed atomically before the admin is created, so
+    concurrent requests cannot use the same token twice.
+    """
+    now = datetime.utcnow()
+    invite = await db.invite_tokens.find_one_and_update(
+        {"token": registration.token, "used": False, "expires_at": {"$gt": now}},
+        {"$set": {"used": True, "active": False, "used_at": now}},
+        projection={"_id": 0}
+    )
     if not invite:
-        raise HTTPException(status_code=404, detail="Invito non trovato")
-    
-    if invite["used"]:
-        raise HTTPException(status_code=400, detail="Invito già utilizzato")
-    
-    if invite["expires_at"] < datetime.utcnow():
+        # Claim failed: tell why
+        invite = await db.invite_tokens.find_one({"token": registration.token}, {"_id": 0})
+        if not invite:
+            raise HTTPException(status_code=404, detail="Invito non trovato")
+        if invite["used"]:
+            raise HTTPException(status_code=400, detail="Invito già utilizzato")
         raise HTTPException(status_code=400, detail="Invito scaduto")
     
-    # Check if username already exists
-    existing = await db.admins.find_one({"username": registration.username})
-    if existing:
-        raise HTTPException(status_code=400, detail="Username già esistente")
-    
     # Create admin
-    import uuid as uuid_lib
     admin_dict = {
-        "id": str(uuid_lib.uuid4()),
+        "id": str(uuid.uuid4()),
         "username": registration.username,
         "password_hash": get_password_hash(registration.password),
         "nome": invite["nome"],
@@ -221,13 +300,18 @@ async def register_admin_with_invite(registration: AdminRegisterWithToken):
         "created_by": invite["created_by"],
         "created_at": datetime.utcnow()
     }
-    await db.admins.insert_one(admin_dict)
-    
-    # Mark invite as used
-    await db.invite_tokens.update_one(
-        {"token": registration.token},
-        {"$set": {"used": True}}
-    )
+    try:
+        await db.admins.insert_one(admin_dict)
+    except DuplicateKeyError as e:
+        # Release the claim so the invitee can retry with another username
+        try:
+            await db.invite_tokens.update_one(
+                {"token": registration.token, "used_at": now},
+                {"$set": {"used": False, "active": True, "used_at": None}}
+            )
+        except DuplicateKeyError:
+            logger.warning(f"Invite {registration.token} not released: a newer invite is active")
+        raise _duplicate_admin_error(e)
     
     return {"message": "Registrazione completata con successo", "username": registration.username}
 
@@ -256,6 +340,7 @@ async def delete_admin(admin_id: str, username: str = Depends(verify_token)):
     result = await db.admins.delete_one({"id": admin_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Admin non trovato")
+    record(username, "admin.delete", "admin", admin_id, username=admin_to_delete.get("username"))
     
     return {"message": "Admin eliminato con successo"}
 
@@ -264,7 +349,7 @@ async def delete_admin(admin_id: str, username: str = Depends(verify_token)):
 async def list_invites(username: str = Depends(verify_token)):
     """Get list of all invite tokens (admin only)"""
     invites = await db.invite_tokens.find({}, {"_id": 0}).sort("created_at", -1).limit(100).to_list(100)
-    return invites
+    return ORJSONResponse(invites)
 
 
 # ============= RICORSI ROUTES =============
@@ -276,58 +361,211 @@ async def create_ricorso(ricorso: RicorsoCreate, username: str = Depends(verify_
         raise HTTPException(status_code=400, detail="Maximum 10 documents allowed")
     
     ricorso_obj = Ricorso(**ricorso.dict())
+    try:
+        ricorso_obj.scadenze_regioni, ricorso_obj.scadenza_generale = normalize_deadlines(ricorso_obj.dict())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    ricorso_obj.closes_at = closing_time(ricorso_obj.dict())
+    ricorso_obj.schema_version = await ensure_schema_version(db, ricorso_obj.dict())
     await db.ricorsi.insert_one(ricorso_obj.dict())
+    record(username, "ricorso.create", "ricorso", ricorso_obj.id, titolo=ricorso_obj.titolo)
+    request_publish()
     return ricorso_obj
 
 
 @api_router.get("/ricorsi", response_model=List[Ricorso])
 async def get_ricorsi(attivo: Optional[bool] = None):
     """Get all ricorsi (public or filtered by active status)"""
-    query = {}
+    query = dict(NOT_DELETED)
     if attivo is not None:
         query["attivo"] = attivo
     
     ricorsi = await db.ricorsi.find(query, {"_id": 0}).sort("created_at", -1).limit(100).to_list(100)
-    return [Ricorso(**r) for r in ricorsi]
+    # I documenti sono già validati in scrittura: li serializziamo direttamente
+    # senza ricostruire i modelli (response_model resta solo per la doc OpenAPI)
+    return ORJSONResponse(ricorsi)
+
+
+def _version_etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def _parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    if if_match is None or if_match.strip() == "*":
+        return None
+    try:
+        return int(if_match.strip().removeprefix("W/").strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid If-Match header")
 
 
 @api_router.get("/ricorsi/{ricorso_id}", response_model=Ricorso)
-async def get_ricorso(ricorso_id: str):
-    """Get a specific ricorso by ID"""
-    ricorso = await db.ricorsi.find_one({"id": ricorso_id}, {"_id": 0})
+async def get_ricorso(ricorso_id: str, response: Response):
+    """Get a specific ricorso by ID (the ETag carries its version)"""
+    ricorso = await db.ricorsi.find_one({"id": ricorso_id, **NOT_DELETED}, {"_id": 0})
     if not ricorso:
         raise HTTPException(status_code=404, detail="Ricorso not found")
-    return Ricorso(**ricorso)
+    ricorso_obj = Ricorso(**ricorso)
+    response.headers["ETag"] = _version_etag(ricorso_obj.version)
+    return ricorso_obj
 
 
 @api_router.put("/ricorsi/{ricorso_id}", response_model=Ricorso)
 async def update_ricorso(
     ricorso_id: str,
     ricorso_update: RicorsoUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     username: str = Depends(verify_token)
 ):
-    """Update a ricorso (admin only)"""
-    existing = await db.ricorsi.find_one({"id": ricorso_id}, {"_id": 0})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Ricorso not found")
+    """Update a ricorso (admin only)
+
+    With an If-Match header (the ETag of GET /ricorsi/{id}) the update only
+    applies if nobody changed the ricorso in the meantime, otherwise 412.
+    """
+    query = {"id": ricorso_id, **NOT_DELETED}
+    expected_version = _parse_if_match(if_match)
+    if expected_version is not None:
+        query["version"] = expected_version
     
     update_data = {k: v for k, v in ricorso_update.dict(exclude_unset=True).items()}
-    if update_data:
-        from datetime import datetime
-        update_data["updated_at"] = datetime.utcnow()
-        await db.ricorsi.update_one({"id": ricorso_id}, {"$set": update_data})
+    if update_data.keys() & {"scadenze_regioni", "scadenza_generale", "campi_dati", "attivo"}:
+        # Scadenze validate sul ricorso risultante (le regioni dipendono da campi_dati)
+        current = await db.ricorsi.find_one({"id": ricorso_id, **NOT_DELETED}, {"_id": 0})
+        if current:
+            merged = {**current, **update_data}
+            try:
+                regionali, generale = normalize_deadlines(merged)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            if "scadenze_regioni" in update_data:
+                update_data["scadenze_regioni"] = regionali
+            if "scadenza_generale" in update_data:
+                update_data["scadenza_generale"] = generale
+            closes_at = closing_time({**merged, **update_data})
+            if (merged.get("attivo") and closes_at and closes_at <= datetime.utcnow()
+                    and update_data.keys() & {"attivo", "scadenze_regioni", "scadenza_generale"}):
+                raise HTTPException(
+                    status_code=400,
+                    detail="Tutte le scadenze sono passate: prorogarne una per riattivare il ricorso"
+                )
+    update_data["updated_at"] = datetime.utcnow()
+    updated = await db.ricorsi.find_one_and_update(
+        query,
+        {"$set": update_data, "$inc": {"version": 1}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated:
+        if expected_version is not None and await db.ricorsi.find_one(
+            {"id": ricorso_id, **NOT_DELETED}, {"_id": 0, "id": 1}
+        ):
+            raise HTTPException(status_code=412, detail="Ricorso modificato da un altro utente, ricaricare")
+        raise HTTPException(status_code=404, detail="Ricorso not found")
+    
+    # A changed form definition becomes a new schema version; submissions
+    # already received keep pointing to the one they were filled against
+    if schema_version_id(updated) != updated.get("schema_version"):
+        updated["schema_version"] = await ensure_schema_version(db, updated)
+        await db.ricorsi.update_one(
+            {"id": ricorso_id, "version": updated["version"]},
+            {"$set": {"schema_version": updated["schema_version"]}}
+        )
+    # closes_at from the stored result, so concurrent partial updates cannot leave it stale
+    if closing_time(updated) != updated.get("closes_at"):
+        updated["closes_at"] = closing_time(updated)
+        await db.ricorsi.update_one(
+            {"id": ricorso_id, "version": updated["version"]},
+            {"$set": {"closes_at": updated["closes_at"]}}
+        )
+    forget(ricorso_id)
     
-    updated = await db.ricorsi.find_one({"id": ricorso_id}, {"_id": 0})
+    record(
+        username, "ricorso.update", "ricorso", ricorso_id,
+        fields=sorted(k for k in update_data if k != "updated_at"), version=updated["version"]
+    )
+    request_publish()
+    response.headers["ETag"] = _version_etag(updated["version"])
     return Ricorso(**updated)
 
 
+def _start_delete_ricorso_job(job_id: str, ricorso_id: str):
+    start_job(db, job_id, lambda: cascade_delete_ricorso(
+        db, job_id, ricorso_id, UPLOADS_DIR, EXAMPLES_DIR, ARCHIVE_DIR
+    ))
+
+
 @api_router.delete("/ricorsi/{ricorso_id}")
 async def delete_ricorso(ricorso_id: str, username: str = Depends(verify_token)):
-    """Delete a ricorso (admin only)"""
-    result = await db.ricorsi.delete_one({"id": ricorso_id})
-    if result.deleted_count == 0:
+    """Delete a ricorso (admin only)
+
+    The ricorso is hidden immediately; submissions and files are removed by a background job.
+    """
+    result = await db.ricorsi.update_one(
+        {"id": ricorso_id, **NOT_DELETED},
+        {"$set": {"deleted_at": datetime.utcnow(), "attivo": False}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Ricorso not found")
+    forget(ricorso_id)
+
+    job = await create_job(db, "delete_ricorso", created_by=username, ricorso_id=ricorso_id)
+    _start_delete_ricorso_job(job["id"], ricorso_id)
+    record(username, "ricorso.delete", "ricorso", ricorso_id, job_id=job["id"])
+    request_publish()
+    return {"message": "Ricorso deleted successfully", "job_id": job["id"]}
+
+
+@api_router.post("/ricorsi/{ricorso_id}/import")
+async def import_ricorso_submissions(
+    ricorso_id: str,
+    request: Request,
+    dry_run: bool = False,
+    mapping: Optional[str] = None,
+    username: str = Depends(verify_token)
+):
+    """Import submissions from a CSV/XLSX spreadsheet (admin only)
+
+    The file goes in the multipart field `file`. Columns are matched to the
+    form fields by id or label; `mapping` (JSON, column -> field id) covers
+    the others. The import runs as a job whose result is the per-row report;
+    with dry_run the rows are only validated.
+    """
+    ricorso = await db.ricorsi.find_one({"id": ricorso_id, **NOT_DELETED}, {"_id": 0})
+    if not ricorso:
         raise HTTPException(status_code=404, detail="Ricorso not found")
-    return {"message": "Ricorso deleted successfully"}
+    if ricorso.get("archive_status"):
+        raise HTTPException(status_code=400, detail="Ricorso chiuso e archiviato")
+    try:
+        column_mapping = json.loads(mapping) if mapping else None
+        if column_mapping is not None and not isinstance(column_mapping, dict):
+            raise ValueError
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid mapping format")
+    
+    upload = await receive_upload(
+        request, IMPORTS_DIR, str(uuid.uuid4()), None, IMPORT_MAX_MB * MB, kinds=SPREADSHEET_KINDS
+    )
+    path = upload["path"]
+    job = await create_job(
+        db, "import_submissions", created_by=username,
+        ricorso_id=ricorso_id, filename=upload["filename"], file=path.name, dry_run=dry_run, mapping=column_mapping
+    )
+    
+    async def work():
+        try:
+            report = await import_submissions(
+                db, ricorso, path, job["id"], mapping=column_mapping, dry_run=dry_run,
+                on_progress=lambda count: add_progress(db, job["id"], count)
+            )
+            await update_job(db, job["id"], result=report)
+        finally:
+            path.unlink(missing_ok=True)
+    
+    start_job(db, job["id"], work)
+    if not dry_run:
+        record(username, "ricorso.import", "ricorso", ricorso_id, job_id=job["id"], filename=upload["filename"])
+    return {"message": "Import avviato", "job_id": job["id"]}
 
 
 # ============= SUBMISSION ROUTES =============
@@ -336,105 +574,291 @@ async def delete_ricorso(ricorso_id: str, username: str = Depends(verify_token))
 async def create_submission(
     ricorso_id: str = Form(...),
     dati_utente: str = Form(...),  # JSON string
+    member_token: Optional[str] = Form(None),
 ):
-    """Create a new submission"""
-    # Get ricorso
-    ricorso = await db.ricorsi.find_one({"id": ricorso_id}, {"_id": 0})
-    if not ricorso:
-        raise HTTPException(status_code=404, detail="Ricorso not found")
-    
+    """Create a new submission
+
+    Rejected once the deadline of the member's region has passed. The
+    response carries receipt_url, the signed link to the PDF receipt.
+    With the member token (codice socio, from a receipt email) the
+    submission is linked to the member and refreshes its data.
+    """
     # Parse user data
     try:
         dati_dict = json.loads(dati_utente)
-    except:
+    except ValueError:
         raise HTTPException(status_code=400, detail="Invalid dati_utente format")
+    if not isinstance(dati_dict, dict):
+        raise HTTPException(status_code=400, detail="Invalid dati_utente format")
+    member_id = verify_member_token(member_token) if member_token else None
+    if member_token and not member_id:
+        raise HTTPException(status_code=403, detail="Codice socio non valido")
+    
+    # Regione già nota come chiusa: rifiuto senza interrogare Mongo
+    closure = cached_closure(ricorso_id, dati_dict)
+    if closure:
+        raise HTTPException(status_code=400, detail=closed_message(closure))
+    
+    # Get ricorso
+    ricorso = await db.ricorsi.find_one({"id": ricorso_id, **NOT_DELETED}, {"_id": 0})
+    if not ricorso:
+        raise HTTPException(status_code=404, detail="Ricorso not found")
+    if ricorso.get("archive_status"):
+        raise HTTPException(status_code=400, detail="Ricorso chiuso e archiviato")
+    closure = deadline_table(ricorso).closed(dati_dict)
+    if closure:
+        raise HTTPException(status_code=400, detail=closed_message(closure))
     
     # Create submission
+    regione_id = regione_field_id(ricorso)
+    missing_documents = required_document_ids(ricorso)
+    matricola, email = member_keys(ricorso, dati_dict)
     submission = Submission(
         ricorso_id=ricorso_id,
-        ricorso_titolo=ricorso["titolo"],
+        schema_version=ricorso.get("schema_version") or await ensure_schema_version(db, ricorso),
+        member_id=await upsert_member(db, ricorso, dati_dict, member_id),
         dati_utente=dati_dict,
-        files_info={}  # Will be populated by file upload endpoint
+        files_info={},  # Will be populated by file upload endpoint
+        regione=dati_dict.get(regione_id) if regione_id else None,
+        matricola=matricola,
+        missing_documents=missing_documents,
+        is_complete=not missing_documents
     )
     
-    await db.submissions.insert_one(submission.dict())
-    return submission
+    submission_dict = submission.dict()
+    await db.submissions.insert_one(submission_dict)
+    # Ricevuta via email, consegnata in background dal worker dell'outbox
+    # Il codice socio va solo nell'email (quella registrata), mai nella risposta
+    token = await receipt_member_token(db, ricorso, submission_dict)
+    await enqueue(
+        db, "submission_receipt", submission.id, email, *submission_receipt(ricorso, submission_dict, token)
+    )
+    return {**submission.dict(), "receipt_url": sign_receipt_url(submission.id)}
+
+
+def _find_documento(ricorso: dict, document_id: str) -> Optional[dict]:
+    for documento in ricorso.get("documenti_richiesti", []):
+        if documento.get("id") == document_id:
+            return documento
+    return None
+
+
+async def _upload_target(submission_id: str, document_id: str):
+    """Checks shared by upload and reuse: returns (submission, documento, byte budget)."""
+    # Only existing submissions may own an upload directory
+    submission = await db.submissions.find_one(
+        {"id": submission_id}, {"_id": 0, "ricorso_id": 1, "member_id": 1, "dati_utente": 1, "files_bytes": 1}
+    )
+    if not submission:
+        raise HTTPException(status_code=404, detail="Submission not found")
+    
+    # Un ricorso in cancellazione non accetta file: il job sta rimuovendo le cartelle
+    ricorso = await db.ricorsi.find_one(
+        {"id": submission["ricorso_id"], **NOT_DELETED}, {"_id": 0, "documenti_richiesti": 1, "archive_status": 1}
+    )
+    if not ricorso:
+        raise HTTPException(status_code=404, detail="Ricorso not found")
+    if ricorso.get("archive_status"):
+        raise HTTPException(status_code=400, detail="Ricorso chiuso e archiviato")
+    documento = _find_documento(ricorso, document_id)
+    if not documento:
+        raise HTTPException(status_code=404, detail="Document not required by this ricorso")
+    
+    # Per-submission budget: what is left after the other documents
+    used = sum(
+        size for doc_id, size in (submission.get("files_bytes") or {}).items() if doc_id != document_id
+    )
+    budget = MAX_SUBMISSION_MB * MB - used
+    if budget <= 0:
+        raise HTTPException(status_code=413, detail=f"Upload limit reached for this submission ({MAX_SUBMISSION_MB} MB)")
+    return submission, documento, min(document_limit(documento), budget)
 
 
 @api_router.post("/upload/{submission_id}/{document_id}")
 async def upload_file(
     submission_id: str,
     document_id: str,
-    file: UploadFile = File(...)
+    request: Request
 ):
-    """Upload a file for a submission"""
-    # Validate file type
-    file_ext = file.filename.split('.')[-1].lower()
-    allowed_extensions = ['pdf', 'jpg', 'jpeg', 'png']
-    if file_ext not in allowed_extensions:
-        raise HTTPException(status_code=400, detail=f"File type not allowed. Allowed: {allowed_extensions}")
-    
-    # Create directory for submission
-    submission_dir = UPLOADS_DIR / submission_id
-    submission_dir.mkdir(exist_ok=True)
+    """Upload a file for a submission
+
+    The multipart body is streamed through upload_guard: files of the wrong
+    type or over the size budget are rejected while still arriving.
+    """
+    submission, documento, max_bytes = await _upload_target(submission_id, document_id)
     
     # Save file
-    file_path = submission_dir / f"{document_id}.{file_ext}"
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    upload = await receive_upload(
+        request,
+        UPLOADS_DIR / submission_id,
+        document_id,
+        documento.get("fileType", FileType.PDF),
+        max_bytes,
+        encrypt=True
+    )
+    invalidate_thumbnail(UPLOADS_DIR / submission_id, document_id)
+    schedule_thumbnail(upload["path"], encrypt=True)
     
-    # Update submission with file info
+    # Update submission with file info and completeness in one atomic update
     await db.submissions.update_one(
         {"id": submission_id},
-        {"$set": {f"files_info.{document_id}": file.filename}}
+        upload_update_pipeline(document_id, upload["filename"], upload["size"])
     )
+    await record_member_document(
+        db, submission.get("member_id"), submission["ricorso_id"], submission_id, document_id,
+        upload["filename"], upload["size"]
+    )
+    
+    return {"message": "File uploaded successfully", "filename": upload["filename"]}
+
+
+@api_router.post("/submissions/{submission_id}/reuse/{document_id}")
+async def reuse_document(submission_id: str, document_id: str, token: Optional[str] = None):
+    """Attach the member's verified copy of a document instead of uploading it again
+
+    `token` is the member token: only the member, on a submission linked
+    to them, can reuse their documents.
+    """
+    submission, documento, max_bytes = await _upload_target(submission_id, document_id)
+    member_id = verify_member_token(token)
+    if not member_id or submission.get("member_id") != member_id:
+        raise HTTPException(status_code=403, detail="Codice socio non valido")
+    member = await db.members.find_one({"id": member_id}, {"_id": 0, f"documents.{document_id}": 1})
+    verified = ((member or {}).get("documents") or {}).get(document_id)
+    if not verified:
+        raise HTTPException(status_code=404, detail="Nessun documento verificato da riutilizzare")
+    
+    # The original submission may have been archived with its ricorso since
+    source = find_document_file(UPLOADS_DIR / verified["submission_id"], document_id) or find_document_file(
+        archived_upload_dir(ARCHIVE_DIR, verified["ricorso_id"]) / verified["submission_id"], document_id
+    )
+    if source is None:
+        raise HTTPException(status_code=404, detail="Documento verificato non più disponibile")
+    allowed = ALLOWED_KINDS[FileType(documento.get("fileType", FileType.PDF))]
+    if source.suffix.lstrip(".") not in allowed:
+        raise HTTPException(status_code=415, detail=f"File type not allowed. Allowed: {sorted(allowed)}")
+    if verified["size"] > max_bytes:
+        raise HTTPException(status_code=413, detail=f"File too large. Maximum size: {max_bytes // MB} MB")
     
-    return {"message": "File uploaded successfully", "filename": file.filename}
+    path = await asyncio.to_thread(link_document, source, UPLOADS_DIR / submission_id, document_id)
+    invalidate_thumbnail(UPLOADS_DIR / submission_id, document_id)
+    schedule_thumbnail(path, encrypt=True)
+    await db.submissions.update_one(
+        {"id": submission_id},
+        upload_update_pipeline(document_id, verified["filename"], verified["size"])
+    )
+    return {"message": "Documento riutilizzato", "filename": verified["filename"]}
+
+
+@api_router.get("/submissions/{submission_id}/receipt")
+async def get_submission_receipt(
+    submission_id: str,
+    request: Request,
+    expires: Optional[int] = None,
+    sig: Optional[str] = None
+):
+    """PDF proof of submission for the member, via the signed receipt_url of the submit response
+
+    Rendered once per state of files_info and cached with the uploads; the
+    ETag lets a repeat download end in a 304.
+    """
+    # Contiene i dati personali del socio: serve la firma, gli id sono indovinabili
+    if expires is None or not sig:
+        raise HTTPException(status_code=403, detail="Link della ricevuta non valido")
+    verify_document_signature(submission_id, RECEIPT_STEM, "", expires, sig)
+    submission = await db.submissions.find_one(
+        {"id": submission_id},
+        {"_id": 0, "id": 1, "ricorso_id": 1, "schema_version": 1, "reference_id": 1,
+         "dati_utente": 1, "files_info": 1, "submitted_at": 1}
+    )
+    if not submission:
+        raise HTTPException(status_code=404, detail="Submission not found")
+    etag = receipt_etag(submission)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    ricorso = await db.ricorsi.find_one(
+        {"id": submission["ricorso_id"]}, {"_id": 0, "titolo": 1, "campi_dati": 1, "documenti_richiesti": 1}
+    ) or {}
+    schema = await get_schema(db, submission.get("schema_version")) or ricorso
+    data = await load_receipt(UPLOADS_DIR / submission_id, submission, ricorso.get("titolo", ""), schema)
+    headers["Content-Disposition"] = f'inline; filename="ricevuta_{submission["reference_id"]}.pdf"'
+    return Response(content=data, media_type="application/pdf", headers=headers)
+
+
+@api_router.get("/members/prefill")
+async def get_member_prefill(token: str, ricorso_id: Optional[str] = None):
+    """Form values and reusable verified documents of a returning member
+
+    `token` is the member token sent with the receipt email.
+    """
+    member_id = verify_member_token(token)
+    if not member_id:
+        raise HTTPException(status_code=403, detail="Codice socio non valido")
+    member = await find_member(db, member_id)
+    if not member:
+        raise HTTPException(status_code=404, detail="Socio non trovato")
+    ricorso = None
+    if ricorso_id:
+        ricorso = await db.ricorsi.find_one(
+            {"id": ricorso_id, **NOT_DELETED}, {"_id": 0, "campi_dati": 1, "documenti_richiesti": 1}
+        )
+        if not ricorso:
+            raise HTTPException(status_code=404, detail="Ricorso not found")
+    return prefill(member, ricorso)
+
+
+async def _set_esempio_url(ricorso_id: str, document_id: str, esempio_url: Optional[str]):
+    """Update one document in place: no read-modify-rewrite of the whole array."""
+    await db.ricorsi.update_one(
+        {"id": ricorso_id},
+        {
+            "$set": {
+                "documenti_richiesti.$[d].esempio_file_url": esempio_url,
+                "updated_at": datetime.utcnow()
+            },
+            "$inc": {"version": 1}
+        },
+        array_filters=[{"d.id": document_id}]
+    )
+    request_publish()
 
 
 @api_router.post("/upload-esempio/{ricorso_id}/{document_id}")
 async def upload_esempio_file(
     ricorso_id: str,
     document_id: str,
-    file: UploadFile = File(...),
+    request: Request,
     username: str = Depends(verify_token)
 ):
     """Upload an example file for a document (admin only)"""
-    # Validate file type
-    file_ext = file.filename.split('.')[-1].lower()
-    allowed_extensions = ['pdf', 'jpg', 'jpeg', 'png']
-    if file_ext not in allowed_extensions:
-        raise HTTPException(status_code=400, detail=f"File type not allowed. Allowed: {allowed_extensions}")
-    
-    # Check if ricorso exists
-    ricorso = await db.ricorsi.find_one({"id": ricorso_id})
+    # Check if ricorso exists (only the document concerned is fetched)
+    ricorso = await db.ricorsi.find_one(
+        {"id": ricorso_id, **NOT_DELETED},
+        {"_id": 0, "documenti_richiesti": {"$elemMatch": {"id": document_id}}}
+    )
     if not ricorso:
         raise HTTPException(status_code=404, detail="Ricorso not found")
+    documento = _find_documento(ricorso, document_id)
+    if not documento:
+        raise HTTPException(status_code=404, detail="Document not found in this ricorso")
     
-    # Create directory for examples
-    esempio_dir = EXAMPLES_DIR / ricorso_id
-    esempio_dir.mkdir(exist_ok=True)
-    
-    # Save file
-    filename = f"{document_id}_esempio.{file_ext}"
-    file_path = esempio_dir / filename
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Save file (a previous sample with another extension is replaced)
+    upload = await receive_upload(
+        request,
+        EXAMPLES_DIR / ricorso_id,
+        f"{document_id}_esempio",
+        documento.get("fileType", FileType.PDF),
+        document_limit(documento)
+    )
+    invalidate_thumbnail(EXAMPLES_DIR / ricorso_id, f"{document_id}_esempio")
+    schedule_thumbnail(upload["path"])
     
     # Update ricorso with esempio file URL
     esempio_url = f"/api/esempio/{ricorso_id}/{document_id}"
-    
-    # Find the document in the ricorso and update it
-    ricorso_obj = Ricorso(**ricorso)
-    for doc in ricorso_obj.documenti_richiesti:
-        if doc.id == document_id:
-            doc.esempio_file_url = esempio_url
-            break
-    
-    await db.ricorsi.update_one(
-        {"id": ricorso_id},
-        {"$set": {"documenti_richiesti": [doc.dict() for doc in ricorso_obj.documenti_richiesti]}}
-    )
+    await _set_esempio_url(ricorso_id, document_id, esempio_url)
+    record(username, "esempio.upload", "ricorso", ricorso_id, document_id=document_id)
     
     return {"message": "Example file uploaded successfully", "url": esempio_url}
 
@@ -453,6 +877,16 @@ async def get_esempio_file(ricorso_id: str, document_id: str):
     raise HTTPException(status_code=404, detail="Example file not found")
 
 
+@api_router.get("/esempio/{ricorso_id}/{document_id}/thumbnail")
+async def get_esempio_thumbnail(ricorso_id: str, document_id: str):
+    """Get the first-page thumbnail of an example file (WebP)"""
+    stem = f"{document_id}_esempio"
+    thumbnail = (await load_thumbnails(EXAMPLES_DIR / ricorso_id, [stem])).get(stem)
+    if thumbnail is None:
+        raise HTTPException(status_code=404, detail="Thumbnail not available yet")
+    return Response(thumbnail, media_type="image/webp", headers={"Cache-Control": "public, max-age=300"})
+
+
 @api_router.delete("/esempio/{ricorso_id}/{document_id}")
 async def delete_esempio_file(
     ricorso_id: str,
@@ -472,73 +906,184 @@ async def delete_esempio_file(
     
     if not deleted:
         raise HTTPException(status_code=404, detail="Example file not found")
+    invalidate_thumbnail(esempio_dir, f"{document_id}_esempio")
     
     # Update ricorso to remove esempio_file_url
-    ricorso = await db.ricorsi.find_one({"id": ricorso_id})
-    if ricorso:
-        ricorso_obj = Ricorso(**ricorso)
-        for doc in ricorso_obj.documenti_richiesti:
-            if doc.id == document_id:
-                doc.esempio_file_url = None
-                break
-        
-        await db.ricorsi.update_one(
-            {"id": ricorso_id},
-            {"$set": {"documenti_richiesti": [doc.dict() for doc in ricorso_obj.documenti_richiesti]}}
-        )
+    await _set_esempio_url(ricorso_id, document_id, None)
+    record(username, "esempio.delete", "ricorso", ricorso_id, document_id=document_id)
     
     return {"message": "Example file deleted successfully"}
 
 
+async def _is_archived(ricorso_id: str) -> bool:
+    ricorso = await db.ricorsi.find_one({"id": ricorso_id}, {"_id": 0, "archive_status": 1})
+    return bool(ricorso) and ricorso.get("archive_status") == "archived"
+
+
 @api_router.get("/submissions")
 async def get_submissions(ricorso_id: Optional[str] = None, username: str = Depends(verify_token)):
     """Get all submissions (admin only)"""
     query = {}
     if ricorso_id:
         query["ricorso_id"] = ricorso_id
+        if await _is_archived(ricorso_id):
+            return ORJSONResponse(await load_archived_submissions(ARCHIVE_DIR, ricorso_id, limit=500))
     
     submissions = await db.submissions.find(query, {"_id": 0}).sort("submitted_at", -1).limit(500).to_list(500)
-    return submissions
+    return ORJSONResponse(submissions)
+
+
+async def _locate_submission_files(submission_id: str, ricorso_id: Optional[str]):
+    """Return (files_info, directory, archived ricorso id or "") for a submission."""
+    submission = await db.submissions.find_one(
+        {"id": submission_id}, {"_id": 0, "files_info": 1}
+    )
+    if submission:
+        return submission.get("files_info") or {}, UPLOADS_DIR / submission_id, ""
+    
+    # Archived submissions are no longer in Mongo: read them from the archive
+    if ricorso_id and await _is_archived(ricorso_id):
+        doc = await asyncio.to_thread(find_archived_submission, ARCHIVE_DIR, ricorso_id, submission_id)
+        if doc:
+            directory = archived_upload_dir(ARCHIVE_DIR, ricorso_id) / submission_id
+            return doc.get("files_info") or {}, directory, ricorso_id
+    raise HTTPException(status_code=404, detail="Submission not found")
+
+
+@api_router.get("/submissions/{submission_id}/files/{document_id}")
+async def get_submission_file(
+    submission_id: str,
+    document_id: str,
+    request: Request,
+    ricorso_id: Optional[str] = None,
+    username: str = Depends(verify_token)
+):
+    """View an uploaded document, with HTTP Range support (admin only)
+
+    Pass ricorso_id for submissions of an archived ricorso.
+    """
+    files_info, directory, _ = await _locate_submission_files(submission_id, ricorso_id)
+    path = find_document_file(directory, document_id)
+    if document_id not in files_info or not path:
+        raise HTTPException(status_code=404, detail="File not found")
+    return range_file_response(request, path, files_info[document_id])
+
+
+@api_router.get("/submissions/{submission_id}/signed-urls")
+async def get_submission_signed_urls(
+    submission_id: str,
+    ricorso_id: Optional[str] = None,
+    username: str = Depends(verify_token)
+):
+    """Short-lived signed URLs for every document of a submission (admin only)"""
+    files_info, _, archived_ricorso_id = await _locate_submission_files(submission_id, ricorso_id)
+    return {
+        "submission_id": submission_id,
+        "expires_in": SIGNED_URL_TTL_SECONDS,
+        "urls": {
+            document_id: sign_document_url(submission_id, document_id, archived_ricorso_id)
+            for document_id in files_info
+        }
+    }
+
+
+@api_router.get("/submissions/{submission_id}/thumbnails")
+async def get_submission_thumbnails(
+    submission_id: str,
+    ricorso_id: Optional[str] = None,
+    username: str = Depends(verify_token)
+):
+    """First-page thumbnails of every document of a submission, in one response (admin only)
+
+    Thumbnails are WebP data URIs; those still being rendered are null and listed in `pending`.
+    """
+    files_info, directory, _ = await _locate_submission_files(submission_id, ricorso_id)
+    thumbnails = await load_thumbnails(directory, files_info.keys(), encrypt=True)
+    return ORJSONResponse({
+        "submission_id": submission_id,
+        "thumbnails": {
+            document_id: f"data:image/webp;base64,{base64.b64encode(data).decode()}" if data else None
+            for document_id, data in thumbnails.items()
+        },
+        "pending": [document_id for document_id, data in thumbnails.items() if data is None],
+    })
+
+
+@api_router.get("/files/{submission_id}/{document_id}")
+async def get_signed_file(
+    submission_id: str,
+    document_id: str,
+    expires: int,
+    sig: str,
+    request: Request,
+    ricorso_id: str = ""
+):
+    """Serve a document through a signed URL (no JWT, no database lookup)"""
+    verify_document_signature(submission_id, document_id, ricorso_id, expires, sig)
+    if ricorso_id:
+        directory = archived_upload_dir(ARCHIVE_DIR, ricorso_id) / submission_id
+    else:
+        directory = UPLOADS_DIR / submission_id
+    path = find_document_file(directory, document_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="File not found")
+    return range_file_response(request, path)
+
+
+# Per qualche secondo le statistiche già calcolate si riusano senza rifare la scansione
+STATS_TTL_SECONDS = 2.0
 
 
 @api_router.get("/submissions/stats/{ricorso_id}")
 async def get_submissions_stats(ricorso_id: str, username: str = Depends(verify_token)):
     """Get statistics by region for a ricorso (admin only)"""
+    # Richieste identiche concorrenti condividono un'unica scansione
+    return await single_flight(
+        ("stats", ricorso_id), lambda: _submissions_stats(ricorso_id), ttl=STATS_TTL_SECONDS
+    )
+
+
+async def _submissions_stats(ricorso_id: str) -> dict:
     # Get ricorso
     ricorso = await db.ricorsi.find_one(
-        {"id": ricorso_id},
-        {"_id": 0, "id": 1, "titolo": 1, "campi_dati": 1, "scadenze_regioni": 1, "scadenza_generale": 1}
+        {"id": ricorso_id, **NOT_DELETED},
+        {"_id": 0, "id": 1, "titolo": 1, "campi_dati": 1, "scadenze_regioni": 1, "scadenza_generale": 1,
+         "archive_status": 1}
     )
     if not ricorso:
         raise HTTPException(status_code=404, detail="Ricorso not found")
     
     # Get all submissions for this ricorso
-    submissions = await db.submissions.find(
-        {"ricorso_id": ricorso_id},
-        {"_id": 0, "id": 1, "reference_id": 1, "submitted_at": 1, "dati_utente": 1}
-    ).limit(5000).to_list(5000)
-    
-    # Find the regione field
-    regione_field_id = None
-    for campo in ricorso.get("campi_dati", []):
-        if campo.get("label", "").lower() == "regione" or campo.get("id") == "regione":
-            regione_field_id = campo.get("id")
-            break
-    
-    if not regione_field_id:
+    if ricorso.get("archive_status") == "archived":
+        submissions = await load_archived_submissions(ARCHIVE_DIR, ricorso_id, limit=5000, newest_first=False)
+    else:
+        submissions = await db.submissions.find(
+            {"ricorso_id": ricorso_id},
+            {"_id": 0, "id": 1, "reference_id": 1, "submitted_at": 1, "dati_utente": 1, "schema_version": 1}
+        ).limit(5000).to_list(5000)
+    
+    # Find the regione field in the schema version each submission was
+    # filled against (older submissions without one use the current form)
+    current_field_id = regione_field_id(ricorso)
+    schemas = await get_schemas(db, {sub.get("schema_version") for sub in submissions})
+    field_by_version = {version: regione_field_id(schema) for version, schema in schemas.items()}
+    
+    if not current_field_id and not any(field_by_version.values()):
         return {
             "ricorso_id": ricorso_id,
             "ricorso_titolo": ricorso.get("titolo"),
             "totale_submissions": len(submissions),
             "per_regione": {},
-            "scadenze_regioni": ricorso.get("scadenze_regioni", {}),
+            "scadenze_regioni": ricorso.get("scadenze_regioni") or {},
             "message": "Nessun campo regione trovato"
         }
     
     # Group by region
     stats_per_regione = {}
     for sub in submissions:
-        regione = sub.get("dati_utente", {}).get(regione_field_id, "Non specificata")
+        version = sub.get("schema_version")
+        field_id = field_by_version[version] if version in field_by_version else current_field_id
+        regione = sub.get("dati_utente", {}).get(field_id, "Non specificata")
         if regione not in stats_per_regione:
             stats_per_regione[regione] = {
                 "count": 0,
@@ -553,22 +1098,21 @@ async def get_submissions_stats(ricorso_id: str, username: str = Depends(verify_
     
     # Calculate scadenze imminenti (entro 30 giorni)
     scadenze_imminenti = []
-    scadenze_regioni = ricorso.get("scadenze_regioni", {})
+    scadenze_regioni = ricorso.get("scadenze_regioni") or {}
+    now = datetime.utcnow()
     
     for regione, scadenza_str in scadenze_regioni.items():
-        try:
-            scadenza = datetime.fromisoformat(scadenza_str.replace('Z', '+00:00'))
-            giorni_rimanenti = (scadenza - datetime.utcnow()).days
-            
-            if 0 <= giorni_rimanenti <= 30:
-                scadenze_imminenti.append({
-                    "regione": regione,
-                    "scadenza": scadenza_str,
-                    "giorni_rimanenti": giorni_rimanenti,
-                    "submissions_ricevute": stats_per_regione.get(regione, {}).get("count", 0)
-                })
-        except:
-            pass
+        scadenza = parse_deadline(scadenza_str)
+        if scadenza is None:
+            continue
+        giorni_rimanenti = (scadenza - now).days
+        if 0 <= giorni_rimanenti <= 30:
+            scadenze_imminenti.append({
+                "regione": regione,
+                "scadenza": scadenza_str,
+                "giorni_rimanenti": giorni_rimanenti,
+                "submissions_ricevute": stats_per_regione.get(regione, {}).get("count", 0)
+            })
     
     return {
         "ricorso_id": ricorso_id,
@@ -582,8 +1126,200 @@ async def get_submissions_stats(ricorso_id: str, username: str = Depends(verify_
 
 
 
+@api_router.get("/submissions/worklist/{ricorso_id}")
+async def get_incomplete_worklist(
+    ricorso_id: str,
+    regione: Optional[str] = None,
+    limit: int = 100,
+    username: str = Depends(verify_token)
+):
+    """Submissions still missing required documents, nearest deadline first (admin only)"""
+    async def compute():
+        ricorso = await db.ricorsi.find_one(
+            {"id": ricorso_id, **NOT_DELETED},
+            {"_id": 0, "id": 1, "scadenze_regioni": 1, "scadenza_generale": 1}
+        )
+        if not ricorso:
+            raise HTTPException(status_code=404, detail="Ricorso not found")
+        return await incomplete_worklist(db, ricorso, regione, limit)
+    return ORJSONResponse(await single_flight(("worklist", ricorso_id, regione, limit), compute))
+
+
+@api_router.get("/submissions/analytics/{ricorso_id}")
+async def get_submissions_analytics(ricorso_id: str, username: str = Depends(verify_token)):
+    """Daily and cumulative submission curves per region with deadline projections (admin only)"""
+    return ORJSONResponse(await single_flight(("analytics", ricorso_id), lambda: _analytics(ricorso_id)))
+
+
+async def _analytics(ricorso_id: str) -> dict:
+    ricorso = await db.ricorsi.find_one(
+        {"id": ricorso_id, **NOT_DELETED},
+        {"_id": 0, "id": 1, "titolo": 1, "campi_dati": 1, "scadenze_regioni": 1, "scadenza_generale": 1,
+         "version": 1, "archive_status": 1, "archived_at": 1}
+    )
+    if not ricorso:
+        raise HTTPException(status_code=404, detail="Ricorso not found")
+    
+    load_archived = None
+    if ricorso.get("archive_status") == "archived":
+        load_archived = lambda: load_archived_submissions(ARCHIVE_DIR, ricorso_id, newest_first=False)
+    return await submission_analytics(db, ricorso, load_archived)
+
+
+# ============= REVIEW ROUTES =============
+
+@api_router.post("/review/claim")
+async def claim_submissions(claim_data: ReviewClaim, username: str = Depends(verify_token)):
+    """Claim the next pending submissions for review, under a lease (admin only)"""
+    claimed = await claim(db, username, claim_data.count, claim_data.ricorso_id)
+    return ORJSONResponse(claimed)
+
+
+@api_router.post("/review/{submission_id}/renew")
+async def renew_review_lease(submission_id: str, username: str = Depends(verify_token)):
+    """Extend the lease on a submission under review (admin only)"""
+    submission = await renew(db, submission_id, username)
+    if not submission:
+        raise HTTPException(status_code=409, detail="Submission non assegnata a questo revisore")
+    return ORJSONResponse(submission)
+
+
+@api_router.post("/review/{submission_id}/decision")
+async def decide_review(
+    submission_id: str,
+    decision: ReviewDecision,
+    username: str = Depends(verify_token)
+):
+    """Approve or reject a submission under review (admin only)"""
+    submission = await decide(db, submission_id, username, decision.status, decision.note)
+    if not submission:
+        raise HTTPException(status_code=409, detail="Submission non assegnata a questo revisore")
+    if decision.status == ReviewStatus.APPROVED:
+        await mark_documents_verified(db, submission, username)
+    record(username, f"review.{decision.status.value}", "submission", submission_id)
+    return ORJSONResponse(submission)
+
+
+@api_router.post("/review/{submission_id}/release")
+async def release_review(submission_id: str, username: str = Depends(verify_token)):
+    """Put a claimed submission back in the queue (admin only)"""
+    if not await release(db, submission_id, username):
+        raise HTTPException(status_code=409, detail="Submission non assegnata a questo revisore")
+    return {"message": "Submission rimessa in coda"}
+
+
+@api_router.get("/review/queue/{ricorso_id}")
+async def get_review_queue(ricorso_id: str, username: str = Depends(verify_token)):
+    """Submissions per review status for a ricorso (admin only)"""
+    return await queue_summary(db, ricorso_id)
+
+
+# ============= JOB ROUTES =============
+
+@api_router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str, username: str = Depends(verify_token)):
+    """Get status and progress of a background job (admin only)"""
+    job = await get_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job non trovato")
+    return job
+
+
+@api_router.post("/janitor/run")
+async def start_janitor(reclaim: bool = False, username: str = Depends(verify_token)):
+    """Sweep orphan files from uploads and examples in the background (admin only)
+
+    Dry-run by default: the job result reports what would be reclaimed.
+    """
+    job = await create_job(db, "janitor", created_by=username, reclaim=reclaim)
+
+    async def work():
+        reports = [
+            await run_janitor(db, "uploads", UPLOADS_DIR, reclaim=reclaim),
+            await run_janitor(db, "examples", EXAMPLES_DIR, reclaim=reclaim),
+        ]
+        await update_job(db, job["id"], result={"reports": reports})
+
+    start_job(db, job["id"], work)
+    return {"message": "Janitor avviato", "job_id": job["id"]}
+
+
+# ============= AUDIT ROUTES =============
+
+@api_router.get("/audit")
+async def get_audit_log(
+    actor: Optional[str] = None,
+    entity_type: Optional[str] = None,
+    entity_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = 100,
+    username: str = Depends(verify_token)
+):
+    """Audit trail of admin actions, newest first (admin only)"""
+    events = await query_audit(db, actor, entity_type, entity_id, since, until, limit)
+    return ORJSONResponse(events)
+
+
+@api_router.post("/thumbnails/rebuild")
+async def rebuild_thumbnails(username: str = Depends(verify_token)):
+    """Render missing or stale thumbnails of all uploads and examples in the background (admin only)"""
+    job = await create_job(db, "thumbnails", created_by=username)
+
+    async def work():
+        reports = {
+            "uploads": await backfill_thumbnails(UPLOADS_DIR, encrypt=True),
+            "examples": await backfill_thumbnails(EXAMPLES_DIR),
+        }
+        await update_job(db, job["id"], result=reports)
+
+    start_job(db, job["id"], work)
+    return {"message": "Rendering miniature avviato", "job_id": job["id"]}
+
+
 # ============= UTILITY ROUTES =============
 
+@api_router.get("/outbox")
+async def get_outbox(username: str = Depends(verify_token)):
+    """Outgoing mail per status and the latest failed deliveries (admin only)"""
+    return ORJSONResponse(await outbox_summary(db))
+
+
+@api_router.post("/outbox/{message_id}/retry")
+async def retry_outbox_message(message_id: str, username: str = Depends(verify_token)):
+    """Queue a failed email again (admin only)"""
+    if not await retry(db, message_id):
+        raise HTTPException(status_code=404, detail="Messaggio non trovato o non fallito")
+    return {"message": "Messaggio rimesso in coda"}
+
+
+@api_router.get("/public-bundle")
+async def get_public_bundle(username: str = Depends(verify_token)):
+    """Manifest of the static bundle currently published (admin only)"""
+    manifest = await asyncio.to_thread(read_manifest, PUBLIC_DIR)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="Bundle non ancora pubblicato")
+    return manifest
+
+
+@api_router.get("/compression")
+async def get_compression_stats(username: str = Depends(verify_token)):
+    """Bytes saved and compression time per route since startup (admin only)"""
+    return compression_metrics()
+
+
+@api_router.get("/budgets")
+async def get_query_budgets(username: str = Depends(verify_token)):
+    """Time budget per route with request, timeout and cancellation counters, plus request coalescing (admin only)"""
+    return {"default_budget_ms": DEFAULT_BUDGET_MS, "routes": budget_metrics(), "single_flight": single_flight_stats()}
+
+
+@api_router.get("/slow-queries")
+async def get_slow_queries(limit: int = 50, username: str = Depends(verify_token)):
+    """Query shapes slower than the threshold with their explain summary, plus the latest slow queries (admin only)"""
+    return slow_queries(min(max(limit, 1), 200))
+
+
 @api_router.get("/")
 async def root():
     return {"message": "Ricorsi API v1.0"}
@@ -592,6 +1328,9 @@ async def root():
 # Include the router in the main app
 app.include_router(api_router)
 
+# Aggiunti prima di CORS, così anche i 503 hanno gli header CORS
+app.add_middleware(QueryBudgetMiddleware, routes=app.router.routes)
+app.add_middleware(CompressionMiddleware, routes=app.router.routes)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -601,9 +1340,92 @@ app.add_middleware(
 )
 
 
+async def _ensure_admin_indexes():
+    """Unique indexes behind admin registration and invites."""
+    # Inviti creati prima del campo "active"
+    await db.invite_tokens.update_many(
+        {"active": {"$exists": False}, "used": False}, {"$set": {"active": True}}
+    )
+    await db.invite_tokens.update_many(
+        {"active": {"$exists": False}}, {"$set": {"active": False}}
+    )
+    await db.invite_tokens.update_many(
+        {"active": True, "expires_at": {"$lte": datetime.utcnow()}}, {"$set": {"active": False}}
+    )
+    indexes = [
+        (db.admins, "username", {"unique": True}),
+        # Gli admin creati con /admin/register non hanno email
+        (db.admins, "email", {"unique": True, "partialFilterExpression": {"email": {"$type": "string"}}}),
+        (db.invite_tokens, "token", {"unique": True}),
+        (db.invite_tokens, [("email", 1), ("active", 1)],
+         {"unique": True, "partialFilterExpression": {"active": True}}),
+        (db.invite_tokens, "expires_at", {"expireAfterSeconds": INVITE_RETENTION_DAYS * 86400}),
+    ]
+    for collection, keys, options in indexes:
+        try:
+            await collection.create_index(keys, **options)
+        except OperationFailure as e:
+            # Duplicati già presenti: l'app parte, ma vanno sistemati a mano
+            logger.error(f"Cannot create index {keys} on {collection.name}: {e}")
+
+
+def _ricorsi_closed(ricorso_ids: List[str]):
+    for ricorso_id in ricorso_ids:
+        record("system", "ricorso.close", "ricorso", ricorso_id, reason="scadenze superate")
+    request_publish()
+
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize default data if needed"""
+    start_slow_query_log(db, LOGS_DIR / 'slow_queries.jsonl')
+    await db.submissions.create_index([("ricorso_id", 1), ("submitted_at", -1)])
+    await db.submissions.create_index(
+        [("ricorso_id", 1), ("is_complete", 1), ("regione", 1), ("submitted_at", 1)]
+    )
+    await db.jobs.create_index("id", unique=True)
+    await db.submissions.create_index("id")
+    # Deduplica dell'import per socio
+    await db.submissions.create_index([("ricorso_id", 1), ("member_id", 1)])
+    await db.submissions.create_index([("ricorso_id", 1), ("matricola", 1)])
+    await db.ricorsi.create_index("id")
+    await db.ricorsi.update_many({"version": {"$exists": False}}, {"$set": {"version": 1}})
+    await db.ricorso_schemas.create_index("id", unique=True)
+    await ensure_audit_indexes(db)
+    await _ensure_admin_indexes()
+    await ensure_review_indexes(db)
+    await ensure_member_indexes(db)
+    await ensure_outbox_indexes(db)
+    start_audit_writer(db)
+    start_thumbnail_workers()
+    start_lease_sweeper(db)
+    start_notification_worker(db)
+    async for ricorso in db.ricorsi.find({"schema_version": None}, {"_id": 0}):
+        await db.ricorsi.update_one(
+            {"id": ricorso["id"]},
+            {"$set": {"schema_version": await ensure_schema_version(db, ricorso)}}
+        )
+    await db.ricorsi.create_index([("attivo", 1), ("closes_at", 1)])
+    async for ricorso in db.ricorsi.find({"closes_at": {"$exists": False}}, {"_id": 0}):
+        await db.ricorsi.update_one({"id": ricorso["id"]}, {"$set": {"closes_at": closing_time(ricorso)}})
+
+    await backfill_completeness(db)
+    await backfill_submission_matricole(db)
+    
+    # Resume deletions interrupted by a restart
+    for job in await find_unfinished_jobs(db, "delete_ricorso"):
+        logger.info(f"Resuming delete job {job['id']}")
+        _start_delete_ricorso_job(job["id"], job["params"]["ricorso_id"])
+    # Imports cut short by a restart are not resumed: the file is uploaded again and
+    # the rows already written are skipped as duplicates. The backend runs as a
+    # single process, so at startup no unfinished import has a worker left.
+    for job in await find_unfinished_jobs(db, "import_submissions"):
+        await update_job(
+            db, job["id"], status=JobStatus.FAILED.value,
+            error="Import interrotto dal riavvio del server: ricaricare il file", finished_at=datetime.utcnow()
+        )
+        (IMPORTS_DIR / job["params"]["file"]).unlink(missing_ok=True)
+    
     # Check if any admin exists
     admin_count = await db.admins.count_documents({})
     if admin_count == 0:
@@ -612,8 +1434,11 @@ async def startup_event():
             "username": "admin",
             "password_hash": get_password_hash("admin123")
         }
-        await db.admins.insert_one(default_admin)
-        logger.info("Default admin created: username=admin, password=admin123")
+        try:
+            await db.admins.insert_one(default_admin)
+            logger.info("Default admin created: username=admin, password=admin123")
+        except DuplicateKeyError:
+            pass  # creato da un altro worker
     
     # Check if default ricorso exists
     ricorso_count = await db.ricorsi.count_documents({})
@@ -653,10 +1478,21 @@ async def startup_event():
             ],
             attivo=True
         )
+        default_ricorso.schema_version = await ensure_schema_version(db, default_ricorso.dict())
         await db.ricorsi.insert_one(default_ricorso.dict())
         logger.info("Default ricorso created")
+    
+    start_publisher(db, PUBLIC_DIR, EXAMPLES_DIR)
+    start_deadline_scheduler(db, _ricorsi_closed)
 
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await stop_audit_writer()
+    await stop_thumbnail_workers()
+    await stop_lease_sweeper()
+    await stop_publisher()
+    await stop_notification_worker()
+    await stop_deadline_scheduler()
+    await stop_slow_query_log()
     client.close()
@@ -0,0 +1,66 @@
+"""
+Single-flight coalescing of expensive reads.
+
+Concurrent calls with the same key share one computation: the first one
+starts it as a task, the others await the same task, so ten staff opening
+the stats of a ricorso cost one scan. The result can also be kept for a
+short TTL. The computation runs in the context (and query budget) of the
+request that started it; it is cancelled only when every caller waiting
+for it has gone.
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+_inflight: Dict[Hashable, asyncio.Task] = {}
+_waiters: Dict[Hashable, int] = {}
+_results: Dict[Hashable, Tuple[float, Any]] = {}
+_counters = {"computed": 0, "coalesced": 0, "cached": 0}
+
+
+def _store(key: Hashable, value: Any, ttl: float):
+    now = time.monotonic()
+    for expired in [k for k, (expires, _) in _results.items() if expires <= now]:
+        del _results[expired]
+    _results[key] = (now + ttl, value)
+
+
+async def single_flight(key: Hashable, compute: Callable[[], Awaitable[Any]], ttl: float = 0.0) -> Any:
+    """Result of compute(), shared by all concurrent callers with the same key."""
+    cached = _results.get(key)
+    if cached and cached[0] > time.monotonic():
+        _counters["cached"] += 1
+        return cached[1]
+
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(compute())
+        _inflight[key] = task
+        _counters["computed"] += 1
+
+        def done(finished: asyncio.Task):
+            if _inflight.get(key) is finished:
+                del _inflight[key]
+            if ttl and not finished.cancelled() and finished.exception() is None:
+                _store(key, finished.result(), ttl)
+
+        task.add_done_callback(done)
+    else:
+        _counters["coalesced"] += 1
+
+    _waiters[key] = _waiters.get(key, 0) + 1
+    try:
+        # shield: chi si disconnette non cancella il calcolo degli altri
+        return await asyncio.shield(task)
+    finally:
+        _waiters[key] -= 1
+        if not _waiters[key]:
+            del _waiters[key]
+            if not task.done():
+                task.cancel()
+                if _inflight.get(key) is task:
+                    del _inflight[key]
+
+
+def single_flight_stats() -> dict:
+    return {**_counters, "in_flight": len(_inflight), "cached_keys": len(_results)}
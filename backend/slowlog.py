@@ -0,0 +1,302 @@
+"""
+Slow-query log for every MongoDB command sent by the backend.
+
+A pymongo command listener attached to the Motor client sees each command
+with its duration, whichever module issued it. Commands slower than
+SLOW_QUERY_MS are recorded with their shape: collection, command, filter
+with every value replaced by its type (no member data reaches the log),
+sort, projection and the API route being served. The first time a shape
+is seen slow an explain("executionStats") of the same command is run in
+the background and its summary (plan stages, index, keys and documents
+examined) is attached to the shape.
+
+Shapes with their counters and the most recent slow commands are served
+by the admin endpoint; every slow command and explain is also appended to
+a rotating JSONL file.
+"""
+import asyncio
+import contextvars
+import logging
+import logging.handlers
+import os
+import threading
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+import orjson
+import pymongo
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = int(os.environ.get("SLOW_QUERY_MS", 100))
+SLOW_QUERY_LOG_BYTES = 10 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 5
+RECENT_SLOW_QUERIES = 200
+MAX_SHAPES = 500
+MAX_PENDING_EXPLAINS = 8
+EXPLAIN_TIMEOUT_SECONDS = 10
+
+EXPLAINABLE = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+# Campi del comando aggiunti dal driver, da togliere prima di rilanciarlo dentro explain
+DRIVER_FIELDS = {"lsid", "txnNumber", "maxTimeMS", "writeConcern", "readConcern", "$clusterTime", "$db",
+                 "$readPreference", "autocommit", "startTransaction"}
+
+# Route servita dalla richiesta corrente (impostata da QueryBudgetMiddleware, Motor copia il contesto)
+current_route: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_route", default=None)
+
+_lock = threading.Lock()
+_shapes: Dict[str, dict] = {}
+_recent: deque = deque(maxlen=RECENT_SLOW_QUERIES)
+_file_logger = logging.getLogger("slow_queries")
+_file_logger.propagate = False
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_db = None
+_explains: set = set()
+
+
+def _value_shape(value, keep_paths: bool):
+    if isinstance(value, dict):
+        return {key: _value_shape(item, keep_paths) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        # Le liste di operatori ($and, $or, pipeline) mantengono la struttura, quelle di valori no
+        if value and all(isinstance(item, dict) for item in value):
+            return [_value_shape(item, keep_paths) for item in value]
+        return "?array"
+    if keep_paths and isinstance(value, str) and value.startswith("$"):
+        return value
+    if value is None:
+        return "?null"
+    if isinstance(value, bool):
+        return "?bool"
+    if isinstance(value, (int, float)):
+        return "?number"
+    if isinstance(value, str):
+        return "?string"
+    if isinstance(value, datetime):
+        return "?date"
+    return f"?{type(value).__name__}"
+
+
+def _pipeline_shape(pipeline: list) -> list:
+    shape = []
+    for stage in pipeline:
+        name, spec = next(iter(stage.items()))
+        # Fuori da $match le stringhe "$campo" sono riferimenti a campi, non dati
+        shape.append({name: _value_shape(spec, keep_paths=name != "$match")})
+    return shape
+
+
+def command_shape(name: str, command: dict) -> dict:
+    """Collection, filter, sort and projection of a command, with values redacted."""
+    # getMore porta l'id del cursore al posto del nome della collezione
+    shape = {"command": name, "collection": command.get("collection" if name == "getMore" else name)}
+    if name == "find":
+        shape["filter"] = _value_shape(command.get("filter", {}), False)
+        shape["sort"] = command.get("sort")
+        shape["projection"] = command.get("projection")
+    elif name == "aggregate":
+        shape["pipeline"] = _pipeline_shape(command.get("pipeline", []))
+    elif name in ("count", "distinct"):
+        shape["filter"] = _value_shape(command.get("query", {}), False)
+        if name == "distinct":
+            shape["key"] = command.get("key")
+    elif name in ("update", "delete"):
+        statements = command.get("updates" if name == "update" else "deletes") or [{}]
+        shape["filter"] = _value_shape(statements[0].get("q", {}), False)
+    elif name == "findAndModify":
+        shape["filter"] = _value_shape(command.get("query", {}), False)
+        shape["sort"] = command.get("sort")
+        shape["projection"] = command.get("fields")
+    return {key: value for key, value in shape.items() if value is not None}
+
+
+def _shape_key(shape: dict) -> str:
+    return orjson.dumps(shape, option=orjson.OPT_SORT_KEYS, default=str).decode()
+
+
+def _write(entry: dict):
+    if _file_logger.handlers:
+        _file_logger.info(orjson.dumps(entry, default=str).decode())
+
+
+def _explainable(name: str, command: dict) -> bool:
+    if name not in EXPLAINABLE:
+        return False
+    if name == "aggregate":
+        return not any("$out" in stage or "$merge" in stage for stage in command.get("pipeline", []))
+    return True
+
+
+def _record(name: str, command: dict, duration_ms: float, error: Optional[str]):
+    shape = command_shape(name, command)
+    key = _shape_key(shape)
+    now = datetime.utcnow()
+    entry = {"at": now, "duration_ms": round(duration_ms, 1), "route": current_route.get(), **shape}
+    if error:
+        entry["error"] = error
+    explain = False
+    with _lock:
+        stats = _shapes.get(key)
+        if stats is None:
+            if len(_shapes) >= MAX_SHAPES:
+                # Tabella piena: si scarta la forma vista meno di recente
+                del _shapes[min(_shapes, key=lambda k: _shapes[k]["last_seen"])]
+            stats = _shapes[key] = {
+                "shape": shape, "count": 0, "total_ms": 0.0, "max_ms": 0.0, "routes": [],
+                "first_seen": now, "last_seen": now, "explain": None,
+            }
+            explain = _explainable(name, command)
+        stats["count"] += 1
+        stats["total_ms"] = round(stats["total_ms"] + duration_ms, 1)
+        stats["max_ms"] = max(stats["max_ms"], entry["duration_ms"])
+        stats["last_seen"] = now
+        if entry["route"] and entry["route"] not in stats["routes"]:
+            stats["routes"].append(entry["route"])
+        _recent.append(entry)
+    _write({"event": "slow_query", **entry})
+    if explain and _loop is not None and len(_explains) < MAX_PENDING_EXPLAINS:
+        # Contesto vuoto: l'explain non eredita il budget della richiesta che ha fatto la query
+        _loop.call_soon_threadsafe(_schedule_explain, key, name, command, context=contextvars.Context())
+
+
+def _schedule_explain(key: str, name: str, command: dict):
+    task = asyncio.create_task(_explain(key, name, command))
+    _explains.add(task)
+    task.add_done_callback(_explains.discard)
+
+
+def _find(doc, key: str):
+    """First value of `key` anywhere in an explain document."""
+    if isinstance(doc, dict):
+        if key in doc:
+            return doc[key]
+        items = doc.values()
+    elif isinstance(doc, list):
+        items = doc
+    else:
+        return None
+    for item in items:
+        found = _find(item, key)
+        if found is not None:
+            return found
+    return None
+
+
+def _plan_stages(plan: Optional[dict]) -> list:
+    stages = []
+    while plan:
+        plan = plan.get("queryPlan", plan)
+        stage = plan.get("stage", "?")
+        if plan.get("indexName"):
+            stage += f" {plan['indexName']}"
+        stages.append(stage)
+        children = plan.get("inputStages") or [plan.get("inputStage")]
+        plan = children[0]
+    return stages[::-1]
+
+
+def explain_summary(explain: dict) -> dict:
+    """Winning plan (leaf first) and execution counters of an explain output."""
+    planner = _find(explain, "queryPlanner") or {}
+    stats = _find(explain, "executionStats") or {}
+    stages = _plan_stages(planner.get("winningPlan"))
+    return {
+        "stages": stages,
+        "collscan": "COLLSCAN" in stages,
+        "n_returned": stats.get("nReturned"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "docs_examined": stats.get("totalDocsExamined"),
+        "execution_ms": stats.get("executionTimeMillis"),
+    }
+
+
+async def _explain(key: str, name: str, command: dict):
+    explained = {field: value for field, value in command.items() if field not in DRIVER_FIELDS}
+    if name in ("update", "delete"):
+        field = "updates" if name == "update" else "deletes"
+        explained[field] = explained[field][:1]
+    try:
+        with pymongo.timeout(EXPLAIN_TIMEOUT_SECONDS):
+            result = await _db.command({"explain": explained, "verbosity": "executionStats"})
+    except Exception as e:
+        logger.warning(f"Explain of a slow {name} on {command.get(name)} failed: {e}")
+        return
+    summary = explain_summary(result)
+    with _lock:
+        if key in _shapes:
+            _shapes[key]["explain"] = summary
+            shape = _shapes[key]["shape"]
+        else:
+            shape = command_shape(name, command)
+    _write({"event": "explain", "at": datetime.utcnow(), **shape, "explain": summary})
+
+
+class SlowQueryListener(monitoring.CommandListener):
+    """Times every command and records the ones over SLOW_QUERY_MS."""
+
+    def __init__(self):
+        self._started: Dict[tuple, dict] = {}
+
+    def started(self, event):
+        if event.command_name != "explain":
+            self._started[(event.connection_id, event.request_id)] = event.command
+
+    def _finished(self, event, error: Optional[str]):
+        command = self._started.pop((event.connection_id, event.request_id), None)
+        duration_ms = event.duration_micros / 1000
+        if command is None or duration_ms < SLOW_QUERY_MS:
+            return
+        try:
+            _record(event.command_name, command, duration_ms, error)
+        except Exception:
+            logger.exception("Could not record a slow query")
+
+    def succeeded(self, event):
+        self._finished(event, None)
+
+    def failed(self, event):
+        failure = event.failure or {}
+        self._finished(event, failure.get("codeName") or failure.get("errmsg") or "failed")
+
+
+slow_query_listener = SlowQueryListener()
+
+
+def slow_queries(limit: int = 50) -> dict:
+    """Slow shapes by total time spent, plus the most recent slow commands."""
+    with _lock:
+        shapes = sorted(_shapes.values(), key=lambda stats: stats["total_ms"], reverse=True)
+        recent = list(_recent)[-limit:][::-1]
+        return {
+            "threshold_ms": SLOW_QUERY_MS,
+            "shapes": [dict(stats, routes=list(stats["routes"])) for stats in shapes],
+            "recent": recent,
+        }
+
+
+def start_slow_query_log(db, path: Path):
+    """Enable explains (run on this loop with `db`) and the JSONL file at `path`."""
+    global _loop, _db
+    _loop = asyncio.get_running_loop()
+    _db = db
+    path.parent.mkdir(parents=True, exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=SLOW_QUERY_LOG_BYTES, backupCount=SLOW_QUERY_LOG_BACKUPS, encoding="utf-8"
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    _file_logger.addHandler(handler)
+    _file_logger.setLevel(logging.INFO)
+
+
+async def stop_slow_query_log():
+    global _loop
+    _loop = None
+    for task in list(_explains):
+        task.cancel()
+    await asyncio.gather(*_explains, return_exceptions=True)
+    for handler in list(_file_logger.handlers):
+        _file_logger.removeHandler(handler)
+        handler.close()
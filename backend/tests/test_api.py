@@ -7,7 +7,11 @@ import requests
 import os
 import json
 import uuid
+import time
+import http.client
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from urllib.parse import urlsplit
 
 BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
 if not BASE_URL:
@@ -125,6 +129,17 @@ class TestRicorsiCRUD:
         for ricorso in data:
             assert ricorso["attivo"] == True
         print(f"Found {len(data)} active ricorsi")
+
+    def test_get_ricorsi_compressed(self):
+        """Test that large JSON responses are compressed with the negotiated encoding"""
+        plain = requests.get(f"{API_URL}/ricorsi", headers={"Accept-Encoding": "identity"})
+        assert "Content-Encoding" not in plain.headers
+        if len(plain.content) < 1024:
+            pytest.skip("Ricorsi list too small to be compressed")
+        response = requests.get(f"{API_URL}/ricorsi", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in response.headers["Vary"]
+        assert response.json() == plain.json()
     
     def test_create_ricorso(self, auth_token):
         """Test creating a new ricorso"""
@@ -230,7 +245,44 @@ class TestRicorsiCRUD:
         verify_response = requests.get(f"{API_URL}/ricorsi/{ricorso_id}")
         assert verify_response.status_code == 404
         print("Verified ricorso is deleted (returns 404)")
-    
+
+    def test_delete_ricorso_cascades_submissions(self, auth_token):
+        """Test that deleting a ricorso runs a job that removes its submissions"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        create_response = requests.post(f"{API_URL}/ricorsi", json={
+            "titolo": f"TEST_Cascade_{str(uuid.uuid4())[:8]}",
+            "descrizione": "Cascade delete test",
+            "campi_dati": [],
+            "documenti_richiesti": [],
+            "attivo": True
+        }, headers=headers)
+        ricorso_id = create_response.json()["id"]
+
+        for _ in range(3):
+            requests.post(f"{API_URL}/submissions", data={
+                "ricorso_id": ricorso_id,
+                "dati_utente": json.dumps({"nome": "TEST"})
+            })
+
+        delete_response = requests.delete(f"{API_URL}/ricorsi/{ricorso_id}", headers=headers)
+        assert delete_response.status_code == 200
+        job_id = delete_response.json()["job_id"]
+
+        job = None
+        for _ in range(50):
+            job = requests.get(f"{API_URL}/jobs/{job_id}", headers=headers).json()
+            if job["status"] in ("completed", "failed"):
+                break
+            time.sleep(0.2)
+        assert job["status"] == "completed"
+        assert job["processed"] == job["total"]
+
+        remaining = requests.get(
+            f"{API_URL}/submissions", params={"ricorso_id": ricorso_id}, headers=headers
+        ).json()
+        assert remaining == []
+        print(f"Cascade delete job {job_id} removed {job['processed']} submissions")
+
     def test_delete_ricorso_unauthorized(self):
         """Test deleting ricorso without token"""
         response = requests.delete(f"{API_URL}/ricorsi/some-id")
@@ -277,13 +329,102 @@ class TestRicorsiCRUD:
         # Verify with GET
         get_response = requests.get(f"{API_URL}/ricorsi/{ricorso_id}")
         assert get_response.json()["descrizione"] == "Updated description"
-        
+
         # Cleanup
         requests.delete(
             f"{API_URL}/ricorsi/{ricorso_id}",
             headers={"Authorization": f"Bearer {auth_token}"}
         )
 
+    def test_public_bundle_published(self, auth_token):
+        """Test that a new active ricorso appears in the static public bundle"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        create_response = requests.post(f"{API_URL}/ricorsi", json={
+            "titolo": f"TEST_Bundle_{str(uuid.uuid4())[:8]}",
+            "descrizione": "Bundle test",
+            "campi_dati": [],
+            "documenti_richiesti": [],
+            "attivo": True
+        }, headers=headers)
+        ricorso_id = create_response.json()["id"]
+
+        # Il publisher raggruppa le modifiche: il bundle arriva con un breve ritardo
+        manifest = None
+        for _ in range(20):
+            time.sleep(0.5)
+            response = requests.get(f"{API_URL}/public-bundle", headers=headers)
+            if response.status_code == 200 and ricorso_id in response.json()["ricorsi"]:
+                manifest = response.json()
+                break
+        assert manifest is not None
+        print(f"Public bundle {manifest['version']} includes {ricorso_id}")
+
+        requests.delete(f"{API_URL}/ricorsi/{ricorso_id}", headers=headers)
+
+    def test_regional_deadline_enforced(self, auth_token):
+        """Test that a region past its deadline rejects submissions while the others stay open"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        create_response = requests.post(f"{API_URL}/ricorsi", json={
+            "titolo": f"TEST_Scadenze_{str(uuid.uuid4())[:8]}",
+            "descrizione": "Deadline test",
+            "campi_dati": [{
+                "id": "regione", "label": "Regione", "type": "select",
+                "required": True, "options": ["Lazio", "Sicilia"]
+            }],
+            "documenti_richiesti": [],
+            "scadenze_regioni": {"lazio": "2000-01-31", "Sicilia": "2999-12-31"},
+            "attivo": True
+        }, headers=headers)
+        assert create_response.status_code == 200
+        ricorso = create_response.json()
+        # I nomi delle regioni prendono la grafia delle opzioni
+        assert ricorso["scadenze_regioni"] == {"Lazio": "2000-01-31", "Sicilia": "2999-12-31"}
+
+        for regione, expected in (("Lazio", 400), ("Sicilia", 200)):
+            response = requests.post(f"{API_URL}/submissions", data={
+                "ricorso_id": ricorso["id"],
+                "dati_utente": json.dumps({"regione": regione})
+            })
+            assert response.status_code == expected
+
+        invalid = requests.put(
+            f"{API_URL}/ricorsi/{ricorso['id']}", json={"scadenze_regioni": {"Lazio": "31/01/2000"}}, headers=headers
+        )
+        assert invalid.status_code == 400
+
+        requests.delete(f"{API_URL}/ricorsi/{ricorso['id']}", headers=headers)
+
+    def test_update_with_if_match(self, auth_token):
+        """Test that a stale If-Match gets 412 and a matching one bumps the ETag"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        ricorso_id = requests.post(f"{API_URL}/ricorsi", json={
+            "titolo": f"TEST_IfMatch_{str(uuid.uuid4())[:8]}",
+            "descrizione": "Optimistic locking test",
+            "campi_dati": [],
+            "documenti_richiesti": [],
+            "attivo": True
+        }, headers=headers).json()["id"]
+        etag = requests.get(f"{API_URL}/ricorsi/{ricorso_id}").headers["ETag"]
+
+        response = requests.put(
+            f"{API_URL}/ricorsi/{ricorso_id}", json={"descrizione": "Prima modifica"},
+            headers={**headers, "If-Match": etag}
+        )
+        assert response.status_code == 200
+        new_etag = response.headers["ETag"]
+        assert new_etag != etag
+        assert requests.get(f"{API_URL}/ricorsi/{ricorso_id}").headers["ETag"] == new_etag
+
+        # Un secondo admin con la versione vecchia non sovrascrive la modifica
+        stale = requests.put(
+            f"{API_URL}/ricorsi/{ricorso_id}", json={"descrizione": "Modifica persa"},
+            headers={**headers, "If-Match": etag}
+        )
+        assert stale.status_code == 412
+        assert requests.get(f"{API_URL}/ricorsi/{ricorso_id}").json()["descrizione"] == "Prima modifica"
+
+        requests.delete(f"{API_URL}/ricorsi/{ricorso_id}", headers=headers)
+
 
 class TestSubmissions:
     """Submission tests"""
@@ -370,6 +511,419 @@ class TestSubmissions:
         assert "per_regione" in data
         print(f"Stats - Total submissions: {data['totale_submissions']}")
 
+    def test_concurrent_stats_coalesced(self, auth_token, ricorso_id):
+        """Test that identical concurrent stats requests share one computation"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        url = f"{API_URL}/submissions/stats/{ricorso_id}"
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            responses = list(pool.map(lambda _: requests.get(url, headers=headers), range(10)))
+        assert all(r.status_code == 200 for r in responses)
+        assert all(r.json() == responses[0].json() for r in responses)
+
+        single_flight = requests.get(f"{API_URL}/budgets", headers=headers).json()["single_flight"]
+        assert single_flight["coalesced"] + single_flight["cached"] >= 1
+
+    def test_query_budgets_reported(self, auth_token, ricorso_id):
+        """Test that heavy admin routes run under a time budget with counters"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        requests.get(f"{API_URL}/submissions", params={"ricorso_id": ricorso_id}, headers=headers)
+        response = requests.get(f"{API_URL}/budgets", headers=headers)
+        assert response.status_code == 200
+        route = response.json()["routes"]["/api/submissions"]
+        assert route["budget_ms"] > 0
+        assert route["requests"] >= 1
+        assert route["completed"] + route["timeouts"] + route["cancelled"] <= route["requests"]
+
+    def test_slow_queries_reported(self, auth_token):
+        """Test that the slow-query log is admin only and reports redacted shapes"""
+        assert requests.get(f"{API_URL}/slow-queries").status_code in (401, 403)
+        response = requests.get(f"{API_URL}/slow-queries", headers={"Authorization": f"Bearer {auth_token}"})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["threshold_ms"] > 0
+        for stats in data["shapes"]:
+            assert stats["count"] >= 1
+            assert stats["shape"]["command"]
+
+    @pytest.fixture
+    def import_ricorso(self, auth_token):
+        """A fresh ricorso to import into, deleted afterwards"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        ricorso_id = requests.post(f"{API_URL}/ricorsi", json={
+            "titolo": f"TEST_Import_{str(uuid.uuid4())[:8]}",
+            "descrizione": "Bulk import test",
+            "campi_dati": [
+                {"id": "nome", "label": "Nome", "type": "text", "required": True},
+                {"id": "matricola", "label": "Matricola", "type": "text", "required": True},
+                {"id": "email", "label": "Email", "type": "email", "required": False}
+            ],
+            "documenti_richiesti": [],
+            "attivo": True
+        }, headers=headers).json()["id"]
+        yield ricorso_id
+        requests.delete(f"{API_URL}/ricorsi/{ricorso_id}", headers=headers)
+
+    def _run_import(self, auth_token, ricorso_id, rows, **params):
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        sheet = "\n".join(";".join(row) for row in [["Nome", "Matricola", "Email"], *rows])
+        response = requests.post(
+            f"{API_URL}/ricorsi/{ricorso_id}/import",
+            params=params,
+            files={"file": ("soci.csv", sheet.encode())},
+            headers=headers
+        )
+        assert response.status_code == 200
+        job_id = response.json()["job_id"]
+        for _ in range(50):
+            job = requests.get(f"{API_URL}/jobs/{job_id}", headers=headers).json()
+            if job["status"] in ("completed", "failed"):
+                break
+            time.sleep(0.1)
+        assert job["status"] == "completed"
+        return job["result"]
+
+    def test_bulk_import_dry_run(self, auth_token, import_ricorso):
+        """Test that a spreadsheet import validates rows and reports errors per row"""
+        matricola = f"TEST{str(uuid.uuid4().int)[:8]}"
+        result = self._run_import(auth_token, import_ricorso, [
+            ["TEST_Import", matricola, "x@example.com"],
+            ["TEST_Import", "", "not-an-email"],
+        ], dry_run="true")
+        assert result["imported"] == 1
+        assert result["invalid"] == 1
+        assert result["errors"][0]["row"] == 3
+
+    def test_bulk_import_skips_unlinked_submissions(self, auth_token, import_ricorso):
+        """Test that an import dedupes by matricola even against submissions with no member"""
+        matricola = f"TEST{str(uuid.uuid4().int)[:8]}"
+        # Senza email la submission non è collegata a nessun socio
+        requests.post(f"{API_URL}/submissions", data={
+            "ricorso_id": import_ricorso,
+            "dati_utente": json.dumps({"nome": "TEST_Form", "matricola": matricola})
+        })
+
+        new_matricola = f"TEST{str(uuid.uuid4().int)[:8]}"
+        result = self._run_import(auth_token, import_ricorso, [
+            ["TEST_Import", f" {matricola} ", ""],
+            ["TEST_Import", new_matricola, ""],
+        ])
+        assert result["duplicates"] == 1
+        assert result["imported"] == 1
+        again = self._run_import(auth_token, import_ricorso, [["TEST_Import", new_matricola, ""]])
+        assert again["duplicates"] == 1
+
+    def test_incomplete_submission_in_worklist(self, auth_token, ricorso_id):
+        """Test that a submission without uploads is tracked as incomplete"""
+        response = requests.post(
+            f"{API_URL}/submissions",
+            data={
+                "ricorso_id": ricorso_id,
+                "dati_utente": json.dumps({"nome": "TEST_Worklist"})
+            }
+        )
+        submission = response.json()
+        ricorso = requests.get(f"{API_URL}/ricorsi/{ricorso_id}").json()
+        required = [d["id"] for d in ricorso["documenti_richiesti"] if d["required"]]
+        if not required:
+            pytest.skip("Ricorso has no required documents")
+        assert sorted(submission["missing_documents"]) == sorted(required)
+        assert submission["is_complete"] is False
+
+        worklist = requests.get(
+            f"{API_URL}/submissions/worklist/{ricorso_id}",
+            params={"regione": submission["regione"], "limit": 500},
+            headers={"Authorization": f"Bearer {auth_token}"}
+        ).json()
+        assert worklist["totale_incomplete"] >= 1
+        print(f"Worklist - Incomplete submissions: {worklist['totale_incomplete']}")
+
+    def test_member_prefill_requires_token(self, ricorso_id):
+        """Test that matricola and email alone do not give access to a member's data"""
+        matricola = f"TEST{str(uuid.uuid4().int)[:8]}"
+        email = f"test_{matricola.lower()}@example.com"
+        requests.post(f"{API_URL}/submissions", data={
+            "ricorso_id": ricorso_id,
+            "dati_utente": json.dumps({"nome": "TEST_Prefill", "matricola": matricola, "email": email})
+        })
+
+        by_keys = requests.get(f"{API_URL}/members/prefill", params={"matricola": matricola, "email": email})
+        assert by_keys.status_code == 422
+        forged = requests.get(f"{API_URL}/members/prefill", params={"token": f"{uuid.uuid4()}.9999999999.AAAA"})
+        assert forged.status_code == 403
+
+    def test_member_not_hijacked_by_matricola(self, auth_token):
+        """Test that someone knowing a member's matricola and email cannot reuse their documents"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        ricorso_id = requests.post(f"{API_URL}/ricorsi", json={
+            "titolo": f"TEST_Members_{str(uuid.uuid4())[:8]}",
+            "descrizione": "Member hijack test",
+            "campi_dati": [
+                {"id": "nome", "label": "Nome", "type": "text", "required": True},
+                {"id": "matricola", "label": "Matricola", "type": "text", "required": True},
+                {"id": "email", "label": "Email", "type": "email", "required": True}
+            ],
+            "documenti_richiesti": [{"id": "istanza", "label": "Istanza", "required": True, "fileType": "pdf"}],
+            "attivo": True
+        }, headers=headers).json()["id"]
+        matricola = f"TEST{str(uuid.uuid4().int)[:8]}"
+        victim_email = f"victim_{matricola.lower()}@example.com"
+
+        def submit(nome, email, **extra):
+            return requests.post(f"{API_URL}/submissions", data={
+                "ricorso_id": ricorso_id,
+                "dati_utente": json.dumps({"nome": nome, "matricola": matricola, "email": email}),
+                **extra
+            })
+
+        # Il socio carica l'istanza e la revisione la verifica
+        victim_submission = submit("TEST_Vittima", victim_email).json()["id"]
+        requests.post(
+            f"{API_URL}/upload/{victim_submission}/istanza",
+            files={"file": ("istanza.pdf", b"%PDF-1.4\n" + b"0" * 512, "application/pdf")}
+        )
+        claimed = requests.post(f"{API_URL}/review/claim", json={"ricorso_id": ricorso_id}, headers=headers).json()
+        requests.post(f"{API_URL}/review/{claimed[0]['id']}/decision", json={"status": "approved"}, headers=headers)
+
+        # Stessa matricola e stessa email: senza codice socio nessun collegamento
+        intruder = submit("TEST_Intruso", victim_email).json()
+        reuse = requests.post(f"{API_URL}/submissions/{intruder['id']}/reuse/istanza")
+        assert reuse.status_code == 403
+        forged = requests.post(
+            f"{API_URL}/submissions/{intruder['id']}/reuse/istanza", params={"token": "x.9999999999.AAAA"}
+        )
+        assert forged.status_code == 403
+        assert submit("TEST_Intruso", victim_email, member_token="x.9999999999.AAAA").status_code == 403
+
+        requests.delete(f"{API_URL}/ricorsi/{ricorso_id}", headers=headers)
+
+    def test_submission_receipt(self, ricorso_id):
+        """Test the PDF receipt is served with an ETag and revalidated with a 304"""
+        submission = requests.post(f"{API_URL}/submissions", data={
+            "ricorso_id": ricorso_id,
+            "dati_utente": json.dumps({"nome": "TEST_Receipt"})
+        }).json()
+        receipt_url = f"{BASE_URL}{submission['receipt_url']}"
+
+        response = requests.get(receipt_url)
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/pdf"
+        assert response.content.startswith(b"%PDF-")
+
+        cached = requests.get(receipt_url, headers={"If-None-Match": response.headers["etag"]})
+        assert cached.status_code == 304
+
+    def test_submission_receipt_requires_signature(self, ricorso_id):
+        """Test that the receipt, which holds the member's data, is not served without its signed link"""
+        submission = requests.post(f"{API_URL}/submissions", data={
+            "ricorso_id": ricorso_id,
+            "dati_utente": json.dumps({"nome": "TEST_Receipt"})
+        }).json()
+        unsigned = requests.get(f"{API_URL}/submissions/{submission['id']}/receipt")
+        assert unsigned.status_code == 403
+        tampered = requests.get(f"{BASE_URL}{submission['receipt_url']}".replace("sig=", "sig=x"))
+        assert tampered.status_code == 403
+
+
+class TestDocumentViewer:
+    """Admin document viewer tests (Range requests and signed URLs)"""
+
+    PDF_CONTENT = b"%PDF-1.4\n" + bytes(range(256)) * 64
+
+    @pytest.fixture
+    def auth_token(self):
+        """Get authentication token"""
+        response = requests.post(f"{API_URL}/admin/login", json={
+            "username": "admin",
+            "password": "admin123"
+        })
+        return response.json()["access_token"]
+
+    @pytest.fixture
+    def uploaded_submission(self):
+        """Create a submission with an uploaded PDF, return (submission_id, document_id)"""
+        ricorsi = requests.get(f"{API_URL}/ricorsi", params={"attivo": True}).json()
+        ricorso = next((r for r in ricorsi if any(
+            d["fileType"] in ("pdf", "both") for d in r["documenti_richiesti"]
+        )), None)
+        if not ricorso:
+            pytest.skip("No active ricorso accepting PDF documents")
+        document_id = next(
+            d["id"] for d in ricorso["documenti_richiesti"] if d["fileType"] in ("pdf", "both")
+        )
+
+        submission = requests.post(f"{API_URL}/submissions", data={
+            "ricorso_id": ricorso["id"],
+            "dati_utente": json.dumps({"nome": "TEST_Viewer"})
+        }).json()
+        upload_response = requests.post(
+            f"{API_URL}/upload/{submission['id']}/{document_id}",
+            files={"file": ("test.pdf", self.PDF_CONTENT, "application/pdf")}
+        )
+        assert upload_response.status_code == 200
+        return submission["id"], document_id
+
+    def test_range_request(self, auth_token, uploaded_submission):
+        """Test that the admin viewer honours Range headers"""
+        submission_id, document_id = uploaded_submission
+        response = requests.get(
+            f"{API_URL}/submissions/{submission_id}/files/{document_id}",
+            headers={"Authorization": f"Bearer {auth_token}", "Range": "bytes=0-99"}
+        )
+        assert response.status_code == 206
+        assert response.content == self.PDF_CONTENT[:100]
+        assert response.headers["Content-Range"] == f"bytes 0-99/{len(self.PDF_CONTENT)}"
+        print(f"Range request served: {response.headers['Content-Range']}")
+
+    def test_signed_url(self, auth_token, uploaded_submission):
+        """Test that signed URLs work without a token and reject tampering"""
+        submission_id, document_id = uploaded_submission
+        response = requests.get(
+            f"{API_URL}/submissions/{submission_id}/signed-urls",
+            headers={"Authorization": f"Bearer {auth_token}"}
+        )
+        assert response.status_code == 200
+        url = response.json()["urls"][document_id]
+
+        signed_response = requests.get(f"{BASE_URL}{url}")
+        assert signed_response.status_code == 200
+        assert signed_response.content == self.PDF_CONTENT
+
+        tampered_response = requests.get(f"{BASE_URL}{url}".replace("sig=", "sig=x"))
+        assert tampered_response.status_code == 403
+        print("Signed URL served the file and rejected a tampered signature")
+
+    def test_submission_thumbnails(self, auth_token, uploaded_submission):
+        """Test that all thumbnails of a submission come back in one response"""
+        submission_id, document_id = uploaded_submission
+        response = requests.get(
+            f"{API_URL}/submissions/{submission_id}/thumbnails",
+            headers={"Authorization": f"Bearer {auth_token}"}
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert document_id in data["thumbnails"]
+        thumbnail = data["thumbnails"][document_id]
+        # Il rendering è in background: la miniatura può essere ancora in coda
+        assert thumbnail is None or thumbnail.startswith("data:image/webp;base64,")
+        assert (thumbnail is None) == (document_id in data["pending"])
+
+
+class TestUploadGuard:
+    """Uploads rejected while the body is still arriving"""
+
+    @pytest.fixture
+    def pdf_target(self):
+        """A fresh submission and one of its PDF documents, return (submission_id, document_id, limit in MB)"""
+        ricorsi = requests.get(f"{API_URL}/ricorsi", params={"attivo": True}).json()
+        ricorso = next((r for r in ricorsi if any(
+            d["fileType"] == "pdf" for d in r["documenti_richiesti"]
+        )), None)
+        if not ricorso:
+            pytest.skip("No active ricorso with a PDF-only document")
+        documento = next(d for d in ricorso["documenti_richiesti"] if d["fileType"] == "pdf")
+        submission = requests.post(f"{API_URL}/submissions", data={
+            "ricorso_id": ricorso["id"],
+            "dati_utente": json.dumps({"nome": "TEST_Guard"})
+        }).json()
+        return submission["id"], documento["id"], documento.get("max_size_mb") or 10
+
+    def test_wrong_magic_bytes_rejected(self, pdf_target):
+        """Test that a file whose content is not a PDF gets 415 despite its name"""
+        submission_id, document_id, _ = pdf_target
+        response = requests.post(
+            f"{API_URL}/upload/{submission_id}/{document_id}",
+            files={"file": ("test.pdf", b"MZ\x90\x00" + b"\x00" * 2048, "application/pdf")}
+        )
+        assert response.status_code == 415
+
+    def test_oversize_rejected_before_end_of_body(self, pdf_target):
+        """Test that an oversize body gets 413 while the client has not finished sending it"""
+        submission_id, document_id, limit_mb = pdf_target
+        url = urlsplit(f"{API_URL}/upload/{submission_id}/{document_id}")
+        connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        connection = connection_class(url.netloc, timeout=30)
+        boundary = "testboundary"
+        connection.putrequest("POST", url.path)
+        connection.putheader("Content-Type", f"multipart/form-data; boundary={boundary}")
+        connection.putheader("Transfer-Encoding", "chunked")
+        connection.endheaders()
+
+        def send_chunk(data):
+            connection.send(b"%x\r\n%s\r\n" % (len(data), data))
+
+        send_chunk((f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"big.pdf\"\r\n"
+                    f"Content-Type: application/pdf\r\n\r\n%PDF-1.4\n").encode())
+        for _ in range(limit_mb + 1):
+            send_chunk(b"\x00" * 1024 * 1024)
+        # Il corpo non viene mai chiuso: la risposta deve arrivare comunque
+        response = connection.getresponse()
+        assert response.status == 413
+        connection.close()
+
+
+class TestReviewQueue:
+    """Review queue: claims, leases and decisions"""
+
+    @pytest.fixture
+    def headers(self):
+        response = requests.post(f"{API_URL}/admin/login", json={
+            "username": "admin",
+            "password": "admin123"
+        })
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    @pytest.fixture
+    def queued_ricorso(self, headers):
+        """A fresh ricorso with 3 pending submissions, deleted afterwards"""
+        ricorso_id = requests.post(f"{API_URL}/ricorsi", json={
+            "titolo": f"TEST_Review_{str(uuid.uuid4())[:8]}",
+            "descrizione": "Review queue test",
+            "campi_dati": [],
+            "documenti_richiesti": [],
+            "attivo": True
+        }, headers=headers).json()["id"]
+        for _ in range(3):
+            requests.post(f"{API_URL}/submissions", data={
+                "ricorso_id": ricorso_id,
+                "dati_utente": json.dumps({"nome": "TEST_Review"})
+            })
+        yield ricorso_id
+        requests.delete(f"{API_URL}/ricorsi/{ricorso_id}", headers=headers)
+
+    def test_claims_do_not_overlap(self, headers, queued_ricorso):
+        """Test that successive claims never return the same submission"""
+        first = requests.post(
+            f"{API_URL}/review/claim", json={"ricorso_id": queued_ricorso, "count": 2}, headers=headers
+        ).json()
+        second = requests.post(
+            f"{API_URL}/review/claim", json={"ricorso_id": queued_ricorso, "count": 2}, headers=headers
+        ).json()
+        assert len(first) == 2
+        assert len(second) == 1
+        assert not {s["id"] for s in first} & {s["id"] for s in second}
+        assert all(s["review_status"] == "in_review" for s in first + second)
+
+        summary = requests.get(f"{API_URL}/review/queue/{queued_ricorso}", headers=headers).json()
+        assert summary["in_review"] == 3
+        assert summary["pending"] == 0
+
+    def test_decision_ends_review(self, headers, queued_ricorso):
+        """Test approving a claimed submission"""
+        claimed = requests.post(
+            f"{API_URL}/review/claim", json={"ricorso_id": queued_ricorso}, headers=headers
+        ).json()[0]
+        response = requests.post(
+            f"{API_URL}/review/{claimed['id']}/decision", json={"status": "approved"}, headers=headers
+        )
+        assert response.status_code == 200
+        assert response.json()["review_status"] == "approved"
+
+        # Una submission già decisa non è più assegnata
+        again = requests.post(
+            f"{API_URL}/review/{claimed['id']}/decision", json={"status": "rejected"}, headers=headers
+        )
+        assert again.status_code == 409
+
 
 class TestAdminManagement:
     """Admin management tests (MOCKED invite system)"""
@@ -413,7 +967,22 @@ class TestAdminManagement:
         assert "token" in data
         assert "invite_url" in data
         print(f"MOCKED: Invite created with URL: {data['invite_url']}")
-    
+
+    def test_invite_email_queued(self, auth_token):
+        """Test that creating an invite queues its email in the outbox"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        before = requests.get(f"{API_URL}/outbox", headers=headers).json()["counts"]
+        unique_id = str(uuid.uuid4())[:8]
+        response = requests.post(f"{API_URL}/admin/invite", json={
+            "email": f"test_{unique_id}@example.com",
+            "nome": "Test",
+            "cognome": f"User_{unique_id}"
+        }, headers=headers)
+        assert response.status_code == 200
+
+        after = requests.get(f"{API_URL}/outbox", headers=headers).json()["counts"]
+        assert sum(after.values()) == sum(before.values()) + 1
+
     def test_list_invites(self, auth_token):
         """Test listing all invites"""
         response = requests.get(
@@ -425,6 +994,103 @@ class TestAdminManagement:
         assert isinstance(data, list)
         print(f"Found {len(data)} invites")
 
+    def test_invite_is_audited(self, auth_token):
+        """Test that creating an invite leaves an entry in the audit log"""
+        email = f"test_{str(uuid.uuid4())[:8]}@example.com"
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        requests.post(
+            f"{API_URL}/admin/invite",
+            json={"email": email, "nome": "Test", "cognome": "Audit"},
+            headers=headers
+        )
+
+        # Gli eventi vengono scritti in batch: si attende il flush
+        events = []
+        for _ in range(10):
+            events = requests.get(
+                f"{API_URL}/audit",
+                params={"entity_type": "invite", "entity_id": email},
+                headers=headers
+            ).json()
+            if events:
+                break
+            time.sleep(0.5)
+        assert len(events) == 1
+        assert events[0]["action"] == "invite.create"
+        assert events[0]["actor"] == "admin"
+
+
+class TestConcurrentAdminRegistration:
+    """Parallel requests racing for the same invite, username or email"""
+
+    PARALLEL = 20
+
+    @pytest.fixture
+    def headers(self):
+        response = requests.post(f"{API_URL}/admin/login", json={
+            "username": "admin",
+            "password": "admin123"
+        })
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    def _hammer(self, fn):
+        with ThreadPoolExecutor(max_workers=self.PARALLEL) as pool:
+            return list(pool.map(fn, range(self.PARALLEL)))
+
+    def _delete_admins(self, headers, usernames):
+        for admin in requests.get(f"{API_URL}/admin/list", headers=headers).json():
+            if admin.get("username") in usernames:
+                requests.delete(f"{API_URL}/admin/delete/{admin['id']}", headers=headers)
+
+    def test_invite_claimed_once(self, headers):
+        """Test that one invite registers exactly one admin"""
+        unique_id = str(uuid.uuid4())[:8]
+        invite = requests.post(
+            f"{API_URL}/admin/invite",
+            json={"email": f"test_{unique_id}@example.com", "nome": "Test", "cognome": "Race"},
+            headers=headers
+        ).json()
+        usernames = [f"TEST_race_{unique_id}_{i}" for i in range(self.PARALLEL)]
+
+        responses = self._hammer(lambda i: requests.post(
+            f"{API_URL}/admin/register-with-invite",
+            json={"token": invite["token"], "username": usernames[i], "password": "test123"}
+        ))
+        try:
+            codes = sorted(r.status_code for r in responses)
+            assert codes == [200] + [400] * (self.PARALLEL - 1)
+        finally:
+            self._delete_admins(headers, set(usernames))
+
+    def test_one_active_invite_per_email(self, headers):
+        """Test that parallel invites for one email create a single invite"""
+        email = f"test_{str(uuid.uuid4())[:8]}@example.com"
+        responses = self._hammer(lambda i: requests.post(
+            f"{API_URL}/admin/invite",
+            json={"email": email, "nome": "Test", "cognome": "Race"},
+            headers=headers
+        ))
+        codes = sorted(r.status_code for r in responses)
+        assert codes == [200] + [400] * (self.PARALLEL - 1)
+
+    def test_manual_admin_unique_username(self, headers):
+        """Test that parallel manual creations with one username create a single admin"""
+        unique_id = str(uuid.uuid4())[:8]
+        username = f"TEST_race_{unique_id}"
+        responses = self._hammer(lambda i: requests.post(
+            f"{API_URL}/admin/create-manual",
+            json={
+                "username": username, "password": "test123", "nome": "Test",
+                "cognome": "Race", "email": f"test_{unique_id}_{i}@example.com"
+            },
+            headers=headers
+        ))
+        try:
+            codes = sorted(r.status_code for r in responses)
+            assert codes == [200] + [400] * (self.PARALLEL - 1)
+        finally:
+            self._delete_admins(headers, {username})
+
 
 def cleanup_test_data():
     """Cleanup TEST_ prefixed data"""
@@ -0,0 +1,103 @@
+"""
+Member registry tests: the member token is the only key to an existing member.
+
+Requires MongoDB (MONGO_URL, also from backend/.env); a temporary
+database is dropped at the end.
+"""
+import asyncio
+import os
+import sys
+import uuid
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from members import (
+    ensure_member_indexes, member_token, receipt_member_token, upsert_member, verify_member_token
+)
+from notifications import submission_receipt
+
+load_dotenv(ROOT_DIR / '.env')
+
+RICORSO = {
+    "id": "ric0",
+    "titolo": "Ricorso di prova",
+    "campi_dati": [
+        {"id": "nome", "label": "Nome", "type": "text"},
+        {"id": "matricola", "label": "Matricola", "type": "text"},
+        {"id": "email", "label": "Email", "type": "email"},
+    ],
+}
+VICTIM = {"nome": "Mario", "matricola": "123456", "email": "mario@example.com"}
+
+
+async def _with_db(check):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[f"test_members_{uuid.uuid4().hex[:8]}"]
+    try:
+        await ensure_member_indexes(db)
+        return await check(db)
+    finally:
+        await client.drop_database(db.name)
+        client.close()
+
+
+def test_member_token_round_trip():
+    """Test that a member token verifies and a tampered or expired one does not"""
+    token = member_token("m1")
+    assert verify_member_token(token) == "m1"
+    member_id, expires, sig = token.split(".")
+    assert verify_member_token(f"m2.{expires}.{sig}") is None
+    assert verify_member_token(f"m1.{int(expires) + 1}.{sig}") is None
+    assert verify_member_token(member_token("m1", ttl=-1)) is None
+    assert verify_member_token(None) is None
+    assert verify_member_token("garbage") is None
+
+
+def test_existing_member_untouched_without_token():
+    """Test that matricola and email alone neither link to nor overwrite an existing member"""
+    async def check(db):
+        created = await upsert_member(db, RICORSO, VICTIM)
+        intruder = await upsert_member(db, RICORSO, {**VICTIM, "nome": "Intruso"})
+        member = await db.members.find_one({"id": created}, {"_id": 0})
+        return created, intruder, member
+
+    created, intruder, member = asyncio.run(_with_db(check))
+    assert created
+    assert intruder is None
+    assert member["dati"]["nome"] == "Mario"
+    assert member["email"] == "mario@example.com"
+
+
+def test_token_holder_refreshes_own_member_only():
+    """Test that a submission with the member token is linked and updates that member's data"""
+    async def check(db):
+        created = await upsert_member(db, RICORSO, VICTIM)
+        linked = await upsert_member(db, RICORSO, {**VICTIM, "nome": "Mario Rossi"}, created)
+        other = await upsert_member(db, RICORSO, {**VICTIM, "matricola": "999999"}, created)
+        member = await db.members.find_one({"id": created}, {"_id": 0})
+        return created, linked, other, member
+
+    created, linked, other, member = asyncio.run(_with_db(check))
+    assert linked == created
+    assert other is None
+    assert member["dati"]["nome"] == "Mario Rossi"
+
+
+def test_receipt_carries_token_only_to_email_on_record():
+    """Test that the receipt email holds the member token only when sent to the registered address"""
+    async def check(db):
+        created = await upsert_member(db, RICORSO, VICTIM)
+        own = await receipt_member_token(db, RICORSO, {"dati_utente": VICTIM})
+        other = await receipt_member_token(db, RICORSO, {"dati_utente": {**VICTIM, "email": "x@example.com"}})
+        return created, own, other
+
+    created, own, other = asyncio.run(_with_db(check))
+    assert verify_member_token(own) == created
+    assert other is None
+    _, body = submission_receipt(RICORSO, {"reference_id": "REF-1", "dati_utente": VICTIM}, own)
+    assert own in body
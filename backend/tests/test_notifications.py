@@ -0,0 +1,110 @@
+"""
+Outbox delivery tests: notifications.deliver_due against a local SMTP stand-in.
+
+The stand-in accepts mail for any recipient except busy@ (451, retried
+later) and unknown@ (550, failed for good). Requires MongoDB (MONGO_URL,
+also from backend/.env); a temporary database is dropped at the end.
+"""
+import asyncio
+import os
+import socket
+import sys
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from aiosmtpd.controller import Controller
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import notifications
+
+load_dotenv(ROOT_DIR / '.env')
+
+
+class StandInHandler:
+    """Accepts every message, except for the busy@ and unknown@ mailboxes."""
+
+    def __init__(self):
+        self.delivered = []
+
+    async def handle_DATA(self, server, session, envelope):
+        if any(rcpt.startswith("busy@") for rcpt in envelope.rcpt_tos):
+            return "451 Mailbox busy, try again later"
+        if any(rcpt.startswith("unknown@") for rcpt in envelope.rcpt_tos):
+            return "550 No such user"
+        self.delivered.append((envelope.rcpt_tos, envelope.content))
+        return "250 OK"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    handler = StandInHandler()
+    # All'avvio il controller si collega alla propria porta: serve una porta reale, non 0
+    port = _free_port()
+    controller = Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    monkeypatch.setattr(notifications, "SMTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(notifications, "SMTP_PORT", port)
+    monkeypatch.setattr(notifications, "SMTP_STARTTLS", False)
+    monkeypatch.setattr(notifications, "SMTP_USER", None)
+    yield handler
+    controller.stop()
+
+
+async def _deliver_one_batch(recipients):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[f"test_outbox_{uuid.uuid4().hex[:8]}"]
+    try:
+        await notifications.ensure_outbox_indexes(db)
+        ids = {}
+        for to in recipients:
+            ids[to] = await notifications.enqueue(
+                db, "submission_receipt", f"TEST_{uuid.uuid4()}", to, "Ricevuta adesione", "Testo della ricevuta"
+            )
+        pool = notifications.SMTPPool()
+        try:
+            claimed = await notifications.deliver_due(db, pool)
+        finally:
+            await pool.close()
+        messages = {m["to"]: m async for m in db.outbox.find({}, {"_id": 0})}
+        return claimed, messages
+    finally:
+        await client.drop_database(db.name)
+        client.close()
+
+
+def test_deliver_due_sends_retries_and_fails(smtp_server):
+    """Test one accepted message, one 4xx left for a retry and one 5xx marked failed"""
+    claimed, messages = asyncio.run(_deliver_one_batch(
+        ["socio@example.com", "busy@example.com", "unknown@example.com"]
+    ))
+    assert claimed == 3
+
+    sent = messages["socio@example.com"]
+    assert sent["status"] == notifications.SENT
+    assert sent["attempts"] == 1
+    assert [rcpttos for rcpttos, _ in smtp_server.delivered] == [["socio@example.com"]]
+    assert b"Subject: Ricevuta adesione" in smtp_server.delivered[0][1]
+
+    busy = messages["busy@example.com"]
+    assert busy["status"] == notifications.PENDING
+    assert busy["attempts"] == 1
+    assert "451" in busy["last_error"]
+    # Riprovato più tardi, con backoff
+    assert busy["next_attempt_at"] > datetime.utcnow()
+
+    unknown = messages["unknown@example.com"]
+    assert unknown["status"] == notifications.FAILED
+    assert "550" in unknown["last_error"]
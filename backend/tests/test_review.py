@@ -0,0 +1,82 @@
+"""
+Review queue tests: concurrent claims and lapsed leases, straight on review.py.
+
+Requires MongoDB (MONGO_URL, also from backend/.env); a temporary
+database is dropped at the end.
+"""
+import asyncio
+import os
+import sys
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from models import ReviewStatus
+from review import claim, decide, ensure_review_indexes, renew
+
+load_dotenv(ROOT_DIR / '.env')
+
+
+async def _with_queue(size: int, check):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[f"test_review_{uuid.uuid4().hex[:8]}"]
+    try:
+        start = datetime.utcnow() - timedelta(days=1)
+        await db.submissions.insert_many([
+            {
+                "id": f"sub{i}",
+                "ricorso_id": "ric0",
+                "dati_utente": {},
+                "review_status": ReviewStatus.PENDING.value,
+                "submitted_at": start + timedelta(seconds=i),
+            }
+            for i in range(size)
+        ])
+        await ensure_review_indexes(db)
+        return await check(db)
+    finally:
+        await client.drop_database(db.name)
+        client.close()
+
+
+def test_concurrent_claims_do_not_overlap():
+    """Test that 50 reviewers claiming at once drain the queue with no submission given twice"""
+    async def check(db):
+        seen = Counter()
+
+        async def reviewer(name):
+            while batch := await claim(db, name, 5, "ric0"):
+                for doc in batch:
+                    seen[doc["id"]] += 1
+                    assert doc["reviewer"] == name
+
+        await asyncio.gather(*(reviewer(f"rev{i}") for i in range(50)))
+        return seen
+
+    seen = asyncio.run(_with_queue(300, check))
+    assert len(seen) == 300
+    assert max(seen.values()) == 1
+
+
+def test_lapsed_lease_cannot_be_used():
+    """Test that a reviewer whose lease has expired can no longer renew or decide"""
+    async def check(db):
+        claimed = await claim(db, "rev0", 1, "ric0", lease_seconds=0)
+        await asyncio.sleep(0.01)
+        return (
+            claimed,
+            await renew(db, claimed[0]["id"], "rev0"),
+            await decide(db, claimed[0]["id"], "rev0", ReviewStatus.APPROVED),
+        )
+
+    claimed, renewed, decided = asyncio.run(_with_queue(1, check))
+    assert claimed[0]["id"] == "sub0"
+    assert renewed is None
+    assert decided is None
@@ -0,0 +1,83 @@
+"""
+Slow-query shapes: slowlog.command_shape must keep no value from the command,
+only its structure, so that no member data reaches the log.
+"""
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import orjson
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from slowlog import command_shape
+
+SECRETS = [
+    "RSSMRA80A01H501U", "mario.rossi@example.com", "123456", "654321", "Lazio",
+    "$secret", "2024-03-01", "87.5", "1987",
+]
+
+
+def _serialized(shape: dict) -> str:
+    return orjson.dumps(shape, default=str).decode()
+
+
+def test_find_shape_has_no_values():
+    """Test that a find keeps fields, operators, sort and projection but no value"""
+    command = {
+        "find": "submissions",
+        "filter": {
+            "dati_utente.codice_fiscale": "RSSMRA80A01H501U",
+            "dati_utente.email": {"$in": ["mario.rossi@example.com", "$secret"]},
+            "dati_utente.matricola": {"$in": ["123456", "654321"]},
+            "regione": "Lazio",
+            "submitted_at": {"$gte": datetime(2024, 3, 1)},
+            "punteggio": {"$gt": 87.5},
+            "$or": [{"anno": 1987}, {"note": "$secret"}, {"deleted_at": None}],
+        },
+        "sort": {"submitted_at": -1},
+        "projection": {"_id": 0, "id": 1},
+        "lsid": {"id": "session"},
+    }
+    shape = command_shape("find", command)
+
+    assert shape["collection"] == "submissions"
+    assert shape["filter"]["dati_utente.codice_fiscale"] == "?string"
+    assert shape["filter"]["dati_utente.email"] == {"$in": "?array"}
+    assert shape["filter"]["submitted_at"] == {"$gte": "?date"}
+    assert shape["filter"]["punteggio"] == {"$gt": "?number"}
+    assert shape["filter"]["$or"] == [{"anno": "?number"}, {"note": "?string"}, {"deleted_at": "?null"}]
+    assert shape["sort"] == {"submitted_at": -1}
+    serialized = _serialized(shape)
+    for secret in SECRETS:
+        assert secret not in serialized
+
+
+def test_aggregate_shape_has_no_values():
+    """Test that an aggregate keeps field paths outside $match but no literal value"""
+    command = {
+        "aggregate": "submissions",
+        "pipeline": [
+            {"$match": {
+                "ricorso_id": "Lazio",
+                "dati_utente.matricola": {"$in": ["123456", "654321"]},
+                "dati_utente.note": "$secret",
+                "submitted_at": {"$gte": datetime(2024, 3, 1), "$lt": "2024-03-01"},
+            }},
+            {"$group": {"_id": "$regione", "totale": {"$sum": 1}}},
+            {"$sort": {"totale": -1}},
+        ],
+        "cursor": {},
+    }
+    shape = command_shape("aggregate", command)
+
+    match, group, sort = shape["pipeline"]
+    # Dentro $match una stringa "$..." è un valore, non un campo
+    assert match["$match"]["dati_utente.note"] == "?string"
+    assert match["$match"]["dati_utente.matricola"] == {"$in": "?array"}
+    assert group["$group"]["_id"] == "$regione"
+    assert sort == {"$sort": {"totale": "?number"}}
+    serialized = _serialized(shape)
+    for secret in SECRETS:
+        assert secret not in serialized
@@ -0,0 +1,184 @@
+"""
+First-page thumbnails of uploaded documents and example files.
+
+A thumbnail is a small WebP stored next to its source as
+<stem>.thumb.webp (encrypted like the source for uploads). Uploads only
+queue a render; a few background workers do the rendering in threads.
+A thumbnail older than its source is stale and is never served, so a
+re-upload invalidates it even if a render of the old file finishes late.
+"""
+import asyncio
+import io
+import logging
+import os
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import pypdfium2 as pdfium
+from PIL import Image
+
+from encryption import EncryptedWriter, StoredFile, encryption_enabled
+from file_access import find_document_file
+from receipts import RECEIPT_STEM
+
+logger = logging.getLogger(__name__)
+
+THUMB_SUFFIX = ".thumb.webp"
+THUMB_SIZE = 320
+THUMB_QUALITY = 70
+THUMBNAIL_WORKERS = 2
+
+_queue: Optional[asyncio.Queue] = None
+_queued = set()
+_workers = []
+
+
+def thumbnail_path(source: Path) -> Path:
+    return source.with_name(source.name.split(".", 1)[0] + THUMB_SUFFIX)
+
+
+def _is_fresh(thumb: Path, source: Path) -> bool:
+    try:
+        return os.stat(thumb).st_mtime_ns >= os.stat(source).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def _first_page(source: Path) -> Image.Image:
+    # Le sorgenti cifrate si leggono decifrando un chunk alla volta, mai tutte in memoria
+    with StoredFile(source).open() as fh:
+        if source.suffix.lower() == ".pdf":
+            pdf = pdfium.PdfDocument(fh)
+            try:
+                page = pdf[0]
+                scale = THUMB_SIZE / max(page.get_size())
+                return page.render(scale=scale).to_pil()
+            finally:
+                pdf.close()
+        image = Image.open(fh)
+        # Per i JPEG decodifica direttamente a risoluzione ridotta
+        image.draft("RGB", (THUMB_SIZE, THUMB_SIZE))
+        image.load()
+        return image
+
+
+def render_thumbnail(source: Path, encrypt: bool = False) -> Optional[Path]:
+    """Render the thumbnail of `source` unless a fresh one exists."""
+    thumb = thumbnail_path(source)
+    if _is_fresh(thumb, source):
+        return thumb
+    source_mtime = os.stat(source).st_mtime_ns
+    image = _first_page(source)
+    image.thumbnail((THUMB_SIZE, THUMB_SIZE))
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, "WEBP", quality=THUMB_QUALITY)
+
+    tmp_path = thumb.with_name(f".{thumb.name}.{uuid.uuid4().hex}.part")
+    try:
+        fh = open(tmp_path, "wb")
+        if encrypt and encryption_enabled():
+            fh = EncryptedWriter(fh)
+        fh.write(buffer.getvalue())
+        fh.close()
+        # Sorgente sostituita durante il rendering: questa miniatura è già vecchia
+        if os.stat(source).st_mtime_ns != source_mtime:
+            return None
+        os.replace(tmp_path, thumb)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return thumb
+
+
+def read_thumbnail(source: Path) -> Optional[bytes]:
+    """Thumbnail bytes (WebP) if a fresh one exists."""
+    thumb = thumbnail_path(source)
+    if not _is_fresh(thumb, source):
+        return None
+    return StoredFile(thumb).read()
+
+
+def invalidate_thumbnail(directory: Path, stem: str):
+    (directory / f"{stem}{THUMB_SUFFIX}").unlink(missing_ok=True)
+
+
+def schedule_thumbnail(source: Path, encrypt: bool = False):
+    """Queue a render; a no-op if this file is already queued."""
+    if _queue is None or source in _queued:
+        return
+    _queued.add(source)
+    _queue.put_nowait((source, encrypt))
+
+
+async def _worker():
+    while True:
+        source, encrypt = await _queue.get()
+        _queued.discard(source)
+        try:
+            if source.is_file():
+                await asyncio.to_thread(render_thumbnail, source, encrypt)
+        except Exception:
+            logger.exception(f"Thumbnail rendering failed for {source}")
+        finally:
+            _queue.task_done()
+
+
+def start_thumbnail_workers(workers: int = THUMBNAIL_WORKERS):
+    global _queue
+    _queue = asyncio.Queue()
+    for _ in range(workers):
+        _workers.append(asyncio.create_task(_worker()))
+
+
+async def stop_thumbnail_workers():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+
+async def load_thumbnails(directory: Path, stems: Iterable[str], encrypt: bool = False) -> Dict[str, Optional[bytes]]:
+    """Fresh thumbnails by stem; missing ones are queued and returned as None."""
+    def read_all():
+        found = {}
+        for stem in stems:
+            source = find_document_file(directory, stem)
+            if source is not None:
+                found[stem] = (source, read_thumbnail(source))
+        return found
+
+    result = {}
+    for stem, (source, data) in (await asyncio.to_thread(read_all)).items():
+        if data is None:
+            schedule_thumbnail(source, encrypt)
+        result[stem] = data
+    return result
+
+
+def _missing_thumbnails(root: Path) -> List[Path]:
+    missing = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if name.startswith((".", RECEIPT_STEM)) or name.endswith(THUMB_SUFFIX):
+                continue
+            source = Path(dirpath) / name
+            if not _is_fresh(thumbnail_path(source), source):
+                missing.append(source)
+    return missing
+
+
+async def backfill_thumbnails(root: Path, encrypt: bool = False) -> dict:
+    """Render every file under `root` without a fresh thumbnail, one at a time."""
+    report = {"rendered": 0, "failed": 0}
+    for source in await asyncio.to_thread(_missing_thumbnails, root):
+        try:
+            await asyncio.to_thread(render_thumbnail, source, encrypt)
+            report["rendered"] += 1
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Thumbnail rendering failed for {source}: {e}")
+            report["failed"] += 1
+    return report
@@ -0,0 +1,212 @@
+"""
+Streaming upload guard.
+
+Parses the multipart body as it arrives instead of letting Starlette spool
+the whole file first: the file type is sniffed from its first bytes and
+checked against the document's `fileType`, and size limits are enforced
+chunk by chunk, so a rejected upload is aborted after a few kilobytes.
+With `encrypt=True` the file is sealed as it is written (see encryption.py).
+"""
+import os
+import uuid
+from pathlib import Path
+from typing import Optional, Set
+
+from fastapi import HTTPException, Request
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from encryption import EncryptedWriter, encryption_enabled
+from models import FileType
+
+MAX_UPLOAD_MB = int(os.environ.get('MAX_UPLOAD_MB', '10'))
+MAX_SUBMISSION_MB = int(os.environ.get('MAX_SUBMISSION_MB', '40'))
+MB = 1024 * 1024
+
+# Margine per boundary e header multipart oltre al contenuto del file
+MULTIPART_OVERHEAD = 16 * 1024
+SNIFF_BYTES = 1024
+
+STORED_EXTENSIONS = ['pdf', 'jpg', 'png']
+ALLOWED_KINDS = {
+    FileType.PDF: {'pdf'},
+    FileType.IMAGE: {'jpg', 'png'},
+    FileType.BOTH: {'pdf', 'jpg', 'png'},
+}
+SPREADSHEET_KINDS = {'csv', 'xlsx'}
+
+
+def sniff_kind(head: bytes) -> Optional[str]:
+    """Detect the file type from its magic bytes."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return 'jpg'
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return 'png'
+    # Lo standard ammette qualche byte prima dell'header PDF
+    if b"%PDF-" in head[:SNIFF_BYTES]:
+        return 'pdf'
+    # Fogli per l'import (importer.py): xlsx è uno zip, un CSV è testo senza byte nulli
+    if head.startswith(b"PK\x03\x04"):
+        return 'xlsx'
+    if head and b"\x00" not in head:
+        return 'csv'
+    return None
+
+
+def document_limit(documento: dict) -> int:
+    """Per-document size limit in bytes."""
+    return (documento.get("max_size_mb") or MAX_UPLOAD_MB) * MB
+
+
+class _FilePart:
+    def __init__(self, dest_dir: Path, stem: str, allowed: Set[str], max_bytes: int,
+                 encrypt: bool = False):
+        self.dest_dir = dest_dir
+        self.encrypt = encrypt
+        self.stem = stem
+        self.allowed = allowed
+        self.max_bytes = max_bytes
+        self.filename = None
+        self.kind = None
+        self.size = 0
+        self.head = b""
+        self.tmp_path = None
+        self.fh = None
+
+    def _check_kind(self):
+        self.kind = sniff_kind(self.head)
+        if self.kind not in self.allowed:
+            raise HTTPException(
+                status_code=415,
+                detail=f"File type not allowed. Allowed: {sorted(self.allowed)}"
+            )
+        self.dest_dir.mkdir(parents=True, exist_ok=True)
+        self.tmp_path = self.dest_dir / f".{self.stem}.{uuid.uuid4().hex}.part"
+        self.fh = open(self.tmp_path, "wb")
+        if self.encrypt:
+            self.fh = EncryptedWriter(self.fh)
+        self.fh.write(self.head)
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File too large. Maximum size: {self.max_bytes // MB} MB"
+            )
+        if self.fh is None:
+            self.head += data
+            if len(self.head) >= SNIFF_BYTES:
+                self._check_kind()
+        else:
+            self.fh.write(data)
+
+    def finish(self) -> Path:
+        if self.fh is None:
+            if not self.head:
+                raise HTTPException(status_code=400, detail="Empty file")
+            self._check_kind()
+        self.fh.close()
+        final_path = self.dest_dir / f"{self.stem}.{self.kind}"
+        os.replace(self.tmp_path, final_path)
+        self.tmp_path = None
+        # Una versione precedente con estensione diversa non serve più
+        for ext in STORED_EXTENSIONS + ['jpeg']:
+            if ext != self.kind:
+                (self.dest_dir / f"{self.stem}.{ext}").unlink(missing_ok=True)
+        return final_path
+
+    def abort(self):
+        if self.fh is not None:
+            self.fh.close()
+        if self.tmp_path is not None:
+            self.tmp_path.unlink(missing_ok=True)
+
+
+async def receive_upload(
+    request: Request,
+    dest_dir: Path,
+    stem: str,
+    file_type: FileType,
+    max_bytes: int,
+    field_name: str = "file",
+    encrypt: bool = False,
+    kinds: Optional[Set[str]] = None,
+) -> dict:
+    """Stream the `field_name` part of a multipart request to dest_dir/<stem>.<ext>.
+
+    Raises 413 as soon as more than `max_bytes` arrive and 415 as soon as the
+    first bytes do not match `file_type` (or `kinds`, when given). `encrypt`
+    only applies when a master key is configured.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes + MULTIPART_OVERHEAD:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File too large. Maximum size: {max_bytes // MB} MB"
+        )
+
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=400, detail="Expected multipart/form-data")
+
+    events = []
+    header_field = b""
+    header_value = b""
+
+    def on_header_field(data, start, end):
+        nonlocal header_field
+        header_field += data[start:end]
+
+    def on_header_value(data, start, end):
+        nonlocal header_value
+        header_value += data[start:end]
+
+    def on_header_end():
+        nonlocal header_field, header_value
+        events.append(("header", header_field.lower(), header_value))
+        header_field = b""
+        header_value = b""
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": lambda: events.append(("begin", None, None)),
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_part_data": lambda data, start, end: events.append(("data", None, data[start:end])),
+        "on_part_end": lambda: events.append(("end", None, None)),
+    })
+
+    allowed = kinds or ALLOWED_KINDS[FileType(file_type)]
+    encrypt = encrypt and encryption_enabled()
+    current = None
+    in_file_part = False
+    result = None
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for event, key, value in events:
+                if event == "begin":
+                    in_file_part = False
+                elif event == "header" and key == b"content-disposition":
+                    _, disposition = parse_options_header(value)
+                    if disposition.get(b"name", b"").decode() == field_name and result is None:
+                        in_file_part = True
+                        current = _FilePart(dest_dir, stem, allowed, max_bytes, encrypt)
+                        current.filename = disposition.get(b"filename", b"").decode("utf-8", "replace")
+                elif event == "data" and in_file_part:
+                    current.write(value)
+                elif event == "end" and in_file_part:
+                    path = current.finish()
+                    result = {"filename": current.filename, "path": path, "size": current.size}
+                    in_file_part = False
+            events.clear()
+        parser.finalize()
+    except BaseException:
+        if current is not None:
+            current.abort()
+        raise
+
+    if result is None:
+        raise HTTPException(status_code=400, detail=f"Missing '{field_name}' file field")
+    return result